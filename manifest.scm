@@ -131,6 +131,7 @@ end of the session, e.g. for applicative benchmarking purposes.")
     (list "python-apscheduler"
           "python-beautifulsoup4"
           "python-dotenv"
+          "python-httpx"
           "python-numpy"
           "python-pandas"
           "python-pip"
@@ -0,0 +1,377 @@
+"""
+Store raw chart files in compressed monthly archives instead of one file per chart.
+
+An archive holds the compressed charts one after another, followed by a JSON index
+mapping each chart's file name to its byte range, and a footer pointing at the index.
+Every chart is compressed on its own, so any of them can be read without touching the
+rest. Charts in an archive are addressed by virtual paths of the form
+`<archive path>/<file name>`, so they can be used wherever a file path is expected.
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import struct
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+
+except ImportError:
+    # Not available on Windows, where writes are only serialized within a process.
+    fcntl = None
+
+from radiant_net_scraper.config import get_configured_logger
+from radiant_net_scraper.files import (
+    checksum_path,
+    read_verified,
+    write_files_atomically,
+)
+
+LOGGER = get_configured_logger(__name__)
+
+ARCHIVE_SUFFIX = ".archive"
+LOCK_SUFFIX = ".lock"
+
+# Number of archive indices kept in memory, a decade of monthly archives.
+INDEX_CACHE_SIZE = 120
+
+FOOTER_MAGIC = b"RNSARC01"
+FOOTER_FORMAT = ">Q"
+FOOTER_SIZE = len(FOOTER_MAGIC) + struct.calcsize(FOOTER_FORMAT)
+
+CODECS = {
+    "gzip": (lambda data: gzip.compress(data, mtime=0), gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+# Charts of a day or month, whose name starts with the month they belong to.
+ARCHIVABLE_RE = re.compile(r"^(\d{6})(\d{2})?_.*\.json$")
+
+_archive_locks: dict[str, threading.Lock] = {}
+_archive_locks_lock = threading.Lock()
+
+# Maps archive paths to their signature and index, least recently used first.
+_index_cache: OrderedDict[str, tuple[tuple[int, int, int], dict]] = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def _archive_lock(archive_path: str) -> threading.Lock:
+    """
+    Get the lock serializing writes to the archive at `archive_path` by the threads
+    of this process.
+    """
+    with _archive_locks_lock:
+        return _archive_locks.setdefault(
+            os.path.abspath(archive_path), threading.Lock()
+        )
+
+
+@contextmanager
+def _locked(archive_path: str) -> Iterator[None]:
+    """
+    Hold the lock on the archive at `archive_path`, serializing writes to it among
+    all processes, e.g. a scraper and a parser in watch mode, or workers on different
+    machines sharing a volume. Processes lock a sidecar file next to the archive, as
+    the archive itself gets replaced on every write.
+    """
+    with _archive_lock(archive_path):
+        if fcntl is None:
+            yield
+            return
+
+        with open(archive_path + LOCK_SUFFIX, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def archive_member_path(path: str) -> str | None:
+    """
+    Get the virtual path under which the chart file at `path` is stored in its monthly
+    archive, or None if it doesn't belong to a month.
+    """
+    dir_path, name = os.path.split(path)
+    name_match = ARCHIVABLE_RE.match(name)
+
+    if name_match is None:
+        return None
+
+    return os.path.join(dir_path, name_match.group(1) + ARCHIVE_SUFFIX, name)
+
+
+def split_member_path(path: str) -> tuple[str, str] | None:
+    """
+    Split a virtual path into the path of the archive and the name of the chart, or
+    return None if `path` doesn't point into an archive.
+    """
+    archive_path, name = os.path.split(path)
+
+    if not archive_path.endswith(ARCHIVE_SUFFIX) or not os.path.isfile(archive_path):
+        return None
+
+    return archive_path, name
+
+
+def _read_index(archive_path: str, infile) -> dict:
+    """
+    Read the index of the archive at `archive_path` from its opened file `infile`.
+    Indices are cached for as long as the archive file doesn't change.
+    """
+    archive_stat = os.fstat(infile.fileno())
+    signature = (archive_stat.st_ino, archive_stat.st_mtime_ns, archive_stat.st_size)
+
+    with _index_cache_lock:
+        cached = _index_cache.get(archive_path)
+
+        if cached is not None and cached[0] == signature:
+            _index_cache.move_to_end(archive_path)
+            return cached[1]
+
+    infile.seek(-FOOTER_SIZE, os.SEEK_END)
+    footer = infile.read(FOOTER_SIZE)
+
+    if not footer.startswith(FOOTER_MAGIC):
+        raise ValueError(f"{archive_path} is not a raw data archive.")
+
+    (index_offset,) = struct.unpack(FOOTER_FORMAT, footer[len(FOOTER_MAGIC) :])
+
+    infile.seek(index_offset)
+    index = json.loads(infile.read(archive_stat.st_size - FOOTER_SIZE - index_offset))
+
+    with _index_cache_lock:
+        _index_cache[archive_path] = (signature, index)
+        _index_cache.move_to_end(archive_path)
+
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+    return index
+
+
+def read_index(archive_path: str) -> dict:
+    """
+    Read the index of the archive at `archive_path`.
+    """
+    with open(archive_path, "rb") as infile:
+        return _read_index(archive_path, infile)
+
+
+def read_member(archive_path: str, name: str) -> bytes:
+    """
+    Read and decompress the chart `name` from the archive at `archive_path`, checking
+    it against its checksum. Index and chart are read through the same file handle, so
+    an archive getting replaced concurrently can't mix up their offsets.
+    """
+    with open(archive_path, "rb") as infile:
+        entry = _read_index(archive_path, infile)[name]
+
+        infile.seek(entry["offset"])
+        content = CODECS[entry["codec"]][1](infile.read(entry["length"]))
+
+    if hashlib.sha256(content).hexdigest() != entry["sha256"]:
+        raise ValueError(
+            f"Checksum of {name} in {archive_path} doesn't match, the archive is "
+            "corrupt."
+        )
+
+    return content
+
+
+@contextmanager
+def open_if_exists(path: str) -> Iterator:
+    """
+    Open the file at `path` for reading in binary mode, or provide None if there is
+    none.
+    """
+    if not os.path.exists(path):
+        yield None
+        return
+
+    with open(path, "rb") as infile:
+        yield infile
+
+
+def write_members(
+    archive_path: str, contents: dict[str, bytes], codec: str = "gzip"
+) -> None:
+    """
+    Add the charts in `contents`, mapping names to contents, to the archive at
+    `archive_path`, replacing those of the same name. The archive is rewritten
+    atomically, streaming the other charts over without recompressing them. Writes
+    to the same archive are serialized across processes, so none of them get lost.
+    """
+    compress = CODECS[codec][0]
+    compressed = {name: compress(content) for name, content in contents.items()}
+
+    with _locked(archive_path), open_if_exists(archive_path) as infile:
+        index = {}
+        copied = []
+        offset = 0
+
+        if infile is not None:
+            for name, entry in _read_index(archive_path, infile).items():
+                if name in contents:
+                    continue
+
+                index[name] = {**entry, "offset": offset}
+                copied.append(entry)
+                offset += entry["length"]
+
+        for name, content in contents.items():
+            index[name] = {
+                "offset": offset,
+                "length": len(compressed[name]),
+                "codec": codec,
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "mtime": time.time(),
+            }
+            offset += len(compressed[name])
+
+        def chunks() -> Iterator[bytes]:
+            for entry in copied:
+                infile.seek(entry["offset"])
+                yield infile.read(entry["length"])
+
+            yield from compressed.values()
+            yield json.dumps(index, sort_keys=True).encode()
+            yield FOOTER_MAGIC + struct.pack(FOOTER_FORMAT, offset)
+
+        write_files_atomically({archive_path: chunks()}, checksums=False)
+
+
+def write_chart_files(
+    contents: dict[str, str | bytes], codec: str | None = None
+) -> dict[str, str]:
+    """
+    Save chart files, mapping paths to contents, either as plain files, or with a
+    `codec` into the monthly archives next to where the plain files would go. Returns
+    a dict mapping the given paths to where the charts ended up.
+    """
+    stored_paths = {path: path for path in contents}
+
+    if codec is not None:
+        for path in contents:
+            stored_paths[path] = archive_member_path(path) or path
+
+    plain = {
+        path: content
+        for path, content in contents.items()
+        if stored_paths[path] == path
+    }
+
+    if plain:
+        write_files_atomically(plain)
+
+    by_archive = {}
+    for path, content in contents.items():
+        if stored_paths[path] != path:
+            archive_path, name = os.path.split(stored_paths[path])
+
+            if isinstance(content, str):
+                content = content.encode("UTF-8")
+
+            by_archive.setdefault(archive_path, {})[name] = content
+
+    for archive_path, members in by_archive.items():
+        write_members(archive_path, members, codec)
+
+    return stored_paths
+
+
+def stored_mtime(path: str) -> float | None:
+    """
+    Get when the chart file at `path` was written, whether as plain file or into its
+    monthly archive, or None if it wasn't.
+    """
+    if os.path.exists(path):
+        return os.path.getmtime(path)
+
+    member_path = archive_member_path(path)
+
+    if member_path is None:
+        return None
+
+    archive_path, name = os.path.split(member_path)
+
+    if not os.path.exists(archive_path):
+        return None
+
+    entry = read_index(archive_path).get(name)
+
+    return entry["mtime"] if entry is not None else None
+
+
+def list_archived_files(input_dir: str) -> list[str]:
+    """
+    List the virtual paths of all charts in the archives in `input_dir`.
+    """
+    return [
+        os.path.join(archive_path, name)
+        for archive_path in sorted(glob.glob(f"{input_dir}/*{ARCHIVE_SUFFIX}"))
+        for name in sorted(read_index(archive_path))
+    ]
+
+
+def convert_dir(input_dir: str, codec: str = "gzip", keep: bool = False) -> int:
+    """
+    Move all plain chart files in `input_dir` into monthly archives. The plain files
+    (and their checksum sidecars) are only removed, unless `keep`, once each archive
+    was written and its charts read back successfully. Files not matching their
+    checksum are left in place along with their sidecars. Returns the number of
+    archived files.
+    """
+    by_archive = {}
+    for path in sorted(glob.glob(f"{input_dir}/*.json")):
+        member_path = archive_member_path(path)
+
+        if member_path is not None:
+            by_archive.setdefault(os.path.dirname(member_path), []).append(path)
+
+    n_archived = 0
+    for archive_path, paths in by_archive.items():
+        contents = {}
+        for path in list(paths):
+            try:
+                contents[os.path.basename(path)] = read_verified(path)
+
+            except ValueError as e:
+                LOGGER.error("Not archiving %s: %s", path, e)
+                paths.remove(path)
+
+        if not paths:
+            continue
+
+        LOGGER.info("Archiving %s files into %s...", len(paths), archive_path)
+
+        write_members(archive_path, contents, codec)
+
+        for name, content in contents.items():
+            if read_member(archive_path, name) != content:
+                raise ValueError(
+                    f"{name} didn't survive archiving into {archive_path}."
+                )
+
+        if not keep:
+            for path in paths:
+                os.remove(path)
+
+                if os.path.exists(checksum_path(path)):
+                    os.remove(checksum_path(path))
+
+        n_archived += len(paths)
+
+    return n_archived
@@ -0,0 +1,173 @@
+"""
+Take consistent snapshots of the app's database while it is being written to.
+"""
+
+import datetime as dt
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from radiant_net_scraper.config import (
+    Config,
+    get_chosen_data_path,
+    get_configured_logger,
+)
+from radiant_net_scraper.database import get_shard_path, get_shard_years, path_to_uri
+
+LOGGER = get_configured_logger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+PARTIAL_SUFFIX = ".partial"
+
+
+def backup_db_file(
+    src_path: str,
+    dest_path: str,
+    pages_per_step: int = 256,
+    step_sleep: float = 0.05,
+) -> None:
+    """
+    Copy the SQLite DB at `src_path` to `dest_path` using the online backup API.
+    Only `pages_per_step` pages get copied at a time, sleeping `step_sleep` seconds in
+    between, so writers are never locked out for long. Should a writer modify the
+    source in between steps, SQLite restarts the backup, so the result is always
+    consistent. The copy only appears at `dest_path` once complete.
+    """
+    tmp_path = dest_path + PARTIAL_SUFFIX
+
+    src_conn = sqlite3.connect(path_to_uri(src_path, mode="ro"), uri=True)
+    dest_conn = sqlite3.connect(tmp_path)
+
+    def _yield_to_writers(status, remaining, total):
+        LOGGER.debug("Backing up %s: %s of %s pages left.", src_path, remaining, total)
+        time.sleep(step_sleep)
+
+    try:
+        src_conn.backup(dest_conn, pages=pages_per_step, progress=_yield_to_writers)
+
+    finally:
+        dest_conn.close()
+        src_conn.close()
+
+    os.replace(tmp_path, dest_path)
+
+
+def _file_signature(path: str) -> dict:
+    """
+    Get what identifies the state of a file for the purpose of incremental snapshots.
+    """
+    file_stat = os.stat(path)
+
+    return {"mtime_ns": file_stat.st_mtime_ns, "size": file_stat.st_size}
+
+
+def list_snapshots(target_dir: str) -> list[str]:
+    """
+    List the paths of all complete snapshots in `target_dir`, oldest first.
+    """
+    if not os.path.exists(target_dir):
+        return []
+
+    return sorted(
+        os.path.join(target_dir, name)
+        for name in os.listdir(target_dir)
+        if os.path.exists(os.path.join(target_dir, name, MANIFEST_NAME))
+    )
+
+
+def snapshot_files(
+    db_files: list[str],
+    target_dir: str,
+    keep: int | None = None,
+    **backup_kwargs,
+) -> str:
+    """
+    Snapshot `db_files` into a new, timestamped dir inside `target_dir`. Snapshots are
+    incremental: files unchanged since the latest snapshot are hard-linked to their
+    previous copy instead of being copied again, which makes snapshots of frozen
+    shards free. Only the newest `keep` snapshots are retained. Returns the path of
+    the new snapshot.
+    """
+    snapshots = list_snapshots(target_dir)
+    previous_dir = snapshots[-1] if snapshots else None
+    previous_manifest = {}
+
+    if previous_dir is not None:
+        with open(
+            os.path.join(previous_dir, MANIFEST_NAME), encoding="UTF-8"
+        ) as infile:
+            previous_manifest = json.load(infile)
+
+    snapshot_name = dt.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    snapshot_dir = os.path.join(target_dir, snapshot_name)
+    partial_dir = snapshot_dir + PARTIAL_SUFFIX
+    os.makedirs(partial_dir)
+
+    LOGGER.info("Taking snapshot of %s files to %s...", len(db_files), snapshot_dir)
+
+    manifest = {}
+    for db_file in db_files:
+        file_name = os.path.basename(db_file)
+        dest_path = os.path.join(partial_dir, file_name)
+        signature = _file_signature(db_file)
+
+        if previous_manifest.get(file_name) == signature:
+            LOGGER.debug("%s is unchanged, linking previous copy.", db_file)
+            os.link(os.path.join(previous_dir, file_name), dest_path)
+
+        else:
+            backup_db_file(db_file, dest_path, **backup_kwargs)
+
+        manifest[file_name] = signature
+
+    with open(
+        os.path.join(partial_dir, MANIFEST_NAME), "w", encoding="UTF-8"
+    ) as outfile:
+        json.dump(manifest, outfile, indent=2)
+
+    os.replace(partial_dir, snapshot_dir)
+
+    LOGGER.info("... done taking snapshot %s.", snapshot_dir)
+
+    if keep is not None:
+        for old_snapshot in list_snapshots(target_dir)[:-keep]:
+            LOGGER.info("Removing old snapshot %s.", old_snapshot)
+            shutil.rmtree(old_snapshot)
+
+    return snapshot_dir
+
+
+def get_db_files(db_path: str) -> list[str]:
+    """
+    Get the paths of all files making up the DB at `db_path`, its raw data shards
+    included. The files are only looked up, not opened, so taking a backup never
+    creates or migrates tables.
+    """
+    shard_files = [get_shard_path(db_path, year) for year in get_shard_years(db_path)]
+
+    return [db_path, *shard_files]
+
+
+def run_backup(target_dir: str | None = None) -> str:
+    """
+    Snapshot the app's DB as given by the config.
+    """
+    backup_config = Config.get_config()["backup"]
+
+    target_dir = target_dir or backup_config["target_dir"]
+
+    if not target_dir:
+        raise ValueError(
+            "No target dir for backups given. Set `target_dir` in the `backup` "
+            "section of the config."
+        )
+
+    return snapshot_files(
+        get_db_files(get_chosen_data_path()),
+        target_dir,
+        keep=backup_config.getint("keep"),
+        pages_per_step=backup_config.getint("pages_per_step"),
+        step_sleep=backup_config.getfloat("step_sleep_seconds"),
+    )
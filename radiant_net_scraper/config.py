@@ -5,35 +5,60 @@ construct a config object.
 
 import configparser as cfp
 import logging
-import pandas as pd
+import threading
 
 
-from importlib.metadata import metadata
+from functools import lru_cache
+from hashlib import sha256
 from importlib.resources import files
 from json import load, dumps
 from os import environ, makedirs
-from os.path import exists
+from os.path import exists, getmtime, splitext
 from platformdirs import site_config_dir, user_config_dir, site_data_dir, user_data_dir
+from typing import Callable
 
 
-# Disallow in-place modification of dataframes.
-pd.options.mode.copy_on_write = True
+LOGGER = logging.getLogger(__name__)
+
+# Name of the PV system configured through the `secrets` section.
+DEFAULT_SYSTEM_ID = "default"
+
+# Prefix of the config sections each describing a PV system.
+SYSTEM_SECTION_PREFIX = "system:"
+
+
+@lru_cache(maxsize=None)
+def _app_dirs() -> dict[str, str]:
+    """
+    Get the platform dirs of the app, resolved from its package metadata once per
+    process, as reading the metadata takes a while.
+    """
+    # Imported here, as importing it is slow as well.
+    from importlib.metadata import metadata
+
+    scraper_meta = metadata("radiant_net_scraper")
+    app_name, app_author = scraper_meta["Name"], scraper_meta["Author"]
+
+    return {
+        "site_config": site_config_dir(app_name, app_author),
+        "user_config": user_config_dir(app_name, app_author),
+        "site_data": site_data_dir(app_name, app_author),
+        "user_data": user_data_dir(app_name, app_author),
+    }
 
 
 def get_config_paths(config_file_name: str = "config.json") -> dict[str, str]:
     """
     Get a dict of paths in which the app looks for configuration files.
     """
-    scraper_meta = metadata("radiant_net_scraper")
+    app_dirs = _app_dirs()
 
     return {
         "default": str(
             files("radiant_net_scraper.data").joinpath("default_config.json")
         ),
-        "site": site_config_dir(scraper_meta["Name"], scraper_meta["Author"])
-        + f"/{config_file_name}",
-        "user": user_config_dir(scraper_meta["Name"], scraper_meta["Author"])
-        + f"/{config_file_name}",
+        "site": app_dirs["site_config"] + f"/{config_file_name}",
+        "user": app_dirs["user_config"] + f"/{config_file_name}",
     }
 
 
@@ -43,13 +68,11 @@ def get_data_paths(
     """
     Get a dict of possible paths to where the app saves its data.
     """
-    scraper_meta = metadata("radiant_net_scraper")
+    app_dirs = _app_dirs()
 
     return {
-        "site": site_data_dir(scraper_meta["Name"], scraper_meta["Author"])
-        + f"/{data_file_name}",
-        "user": user_data_dir(scraper_meta["Name"], scraper_meta["Author"])
-        + f"/{data_file_name}",
+        "site": app_dirs["site_data"] + f"/{data_file_name}",
+        "user": app_dirs["user_data"] + f"/{data_file_name}",
     }
 
 
@@ -237,11 +260,10 @@ def _init_config() -> cfp.ConfigParser:
     return config
 
 
-def _config_logging(level: str = "info") -> None:
+def _parse_log_level(level: str) -> int:
     """
-    Perform configuration for the logging module.
+    Get the logging module's level of the name `level`, as given in the config.
     """
-
     match level.lower():
         case "critical":
             log_level = logging.CRITICAL
@@ -256,34 +278,132 @@ def _config_logging(level: str = "info") -> None:
         case _:
             raise ValueError(f"Unknown log level: {level}.")
 
+    return log_level
+
+
+def _config_logging(level: str = "info") -> None:
+    """
+    Perform configuration for the logging module.
+    """
+    log_level = _parse_log_level(level)
+
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         level=log_level,
     )
+    # Only the first call configures logging, later ones just change the level.
+    logging.getLogger().setLevel(log_level)
 
-    # Explicitly set logging for urllib3 to remove clutter during debugging.
+    # Explicitly set logging for urllib3 and httpx to remove clutter during debugging.
     # FIXME Add a config option to undo this.
     logging.getLogger("urllib3").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def _get_config_mtimes() -> dict[str, float | None]:
+    """
+    Get when each of the config files was last modified, None for those missing.
+    """
+    return {
+        path: getmtime(path) if exists(path) else None
+        for path in get_config_paths().values()
+    }
 
 
 class Config:
     """
     Singleton wrapper to defer the creation of the config object from module load to
-    when it is first needed.
+    when it is first needed. Long-running processes can reload it once its files
+    changed, subscribers then get to apply the new config in place.
     """
 
     _config_obj = None
+    _config_mtimes = {}
+    _subscribers = []
+    _lock = threading.RLock()
 
     @classmethod
     def get_config(cls) -> cfp.ConfigParser:
         """
         Get the class-internal config object, intantiate if not already present.
+        Logging gets configured along with it.
         """
         if cls._config_obj is None:
-            cls._config_obj = _init_config()
+            with cls._lock:
+                if cls._config_obj is None:
+                    # Taken before reading, so changes made meanwhile aren't missed.
+                    cls._config_mtimes = _get_config_mtimes()
+                    cls._config_obj = _init_config()
+                    _config_logging(
+                        cls._config_obj.get("logging", "level", fallback="info")
+                    )
 
         return cls._config_obj
 
+    @classmethod
+    def subscribe(cls, callback: Callable[[cfp.ConfigParser], None]) -> None:
+        """
+        Have `callback` called with the new config whenever it gets reloaded.
+        """
+        with cls._lock:
+            cls._subscribers.append(callback)
+
+    @classmethod
+    def unsubscribe(cls, callback: Callable[[cfp.ConfigParser], None]) -> None:
+        """
+        Stop calling `callback` on reloads.
+        """
+        with cls._lock:
+            if callback in cls._subscribers:
+                cls._subscribers.remove(callback)
+
+    @classmethod
+    def reload(cls) -> bool:
+        """
+        Read the config again, reconfigure logging and notify all subscribers. Should
+        the new config fail to load, e.g. while a file is still being edited, the
+        current one is kept. Returns whether the config got replaced.
+        """
+        with cls._lock:
+            config_mtimes = _get_config_mtimes()
+
+            try:
+                config = _init_config()
+                # Validated up front, so a bad level doesn't leave the new config in
+                # place without subscribers knowing of it.
+                log_level = config.get("logging", "level", fallback="info")
+                _parse_log_level(log_level)
+
+            except (OSError, ValueError, cfp.Error) as e:
+                LOGGER.error("Failed to reload the config, keeping the current: %s", e)
+                return False
+
+            cls._config_mtimes = config_mtimes
+            cls._config_obj = config
+            _config_logging(log_level)
+
+            LOGGER.info("Reloaded the config.")
+
+            for callback in list(cls._subscribers):
+                try:
+                    callback(config)
+
+                except Exception:
+                    LOGGER.exception("Failed to apply the reloaded config.")
+
+        return True
+
+    @classmethod
+    def reload_if_changed(cls) -> bool:
+        """
+        Reload the config if any of its files was modified, created or removed since
+        it was last read. Returns whether it was reloaded.
+        """
+        if cls._config_obj is None or _get_config_mtimes() == cls._config_mtimes:
+            return False
+
+        return cls.reload()
+
 
 def get_chosen_data_path() -> str:
     """
@@ -297,16 +417,82 @@ def get_chosen_data_path() -> str:
     )
 
 
-def get_configured_logger(name: str) -> logging.Logger:
+def get_chosen_db_sharding() -> bool:
     """
-    Get the logger, configured by config and module name.
+    Get whether the raw data in the database should be sharded into per-year files.
     """
     config = Config.get_config()
-    _config_logging(config["logging"]["level"])
 
+    return config["database"].getboolean("shard_by_year", fallback=False)
+
+
+def get_chosen_queue_path() -> str:
+    """
+    Get the path to the job queue file as determined by the config, by default next
+    to the database file.
+    """
+    queue_path = Config.get_config()["queue"].get("path", fallback=None)
+
+    if queue_path:
+        return queue_path
+
+    return splitext(get_chosen_data_path())[0] + ".queue.sqlite3"
+
+
+def get_db_pragmas() -> dict[str, int]:
+    """
+    Get the pragmas the DB connections get set to, as determined by the config.
+    """
+    db_config = Config.get_config()["database"]
+
+    return {
+        "busy_timeout": db_config.getint("busy_timeout_ms", fallback=5000),
+        # Negative cache sizes are given in KiB rather than pages.
+        "cache_size": -db_config.getint("cache_size_kib", fallback=2000),
+    }
+
+
+def get_raw_data_archive_codec() -> str | None:
+    """
+    Get the codec with which raw data files get compressed into monthly archives, or
+    None if they should be saved as plain files.
+    """
+    return Config.get_config()["raw_data"].get("archive", fallback=None) or None
+
+
+def get_configured_logger(name: str) -> logging.Logger:
+    """
+    Get the logger, configured by config and module name. Modules get their loggers
+    at import time, so the config is only read, and logging configured, once it is
+    first needed, keeping imports quick.
+    """
     return logging.getLogger(name)
 
 
+def get_session_cookie_path(username: str | None = None) -> str | None:
+    """
+    Get the path at which the Solarweb session (of the account `username`) gets
+    persisted between runs, or None if it shouldn't be.
+    """
+    config = Config.get_config()
+
+    if not config["session"].getboolean("persist_cookies", fallback=True):
+        return None
+
+    cookie_path = (
+        config["session"]["cookie_path"] or get_data_paths("session.json")["user"]
+    )
+
+    if username is None:
+        return cookie_path
+
+    # Keep the username out of the file name, it is likely an email address.
+    stem, ext = splitext(cookie_path)
+    account_hash = sha256(username.encode("UTF-8")).hexdigest()[:16]
+
+    return f"{stem}_{account_hash}{ext}"
+
+
 def get_fronius_secrets() -> dict:
     """
     Obtain a dict of required secrets for fronius, in this case from the config object.
@@ -333,3 +519,44 @@ def get_fronius_secrets() -> dict:
         )
 
     return secrets
+
+
+def get_fronius_systems() -> list[dict]:
+    """
+    Obtain a list of the PV systems to scrape, each a dict of the secrets required
+    for it plus its `name`. Systems are configured in sections named
+    `system:<name>`, each needing a `fronius-id`. Their `username` & `password` default
+    to those in the `secrets` section, so systems of the same account need only be
+    given their ID. Without any such section, the system configured in `secrets` is
+    used under the name "default".
+    """
+    config = Config.get_config()
+
+    systems = []
+    for section_name in config.sections():
+        if not section_name.startswith(SYSTEM_SECTION_PREFIX):
+            continue
+
+        section = config[section_name]
+        system = {
+            "name": section_name[len(SYSTEM_SECTION_PREFIX) :],
+            "username": section.get("username") or config["secrets"]["username"],
+            "password": section.get("password") or config["secrets"]["password"],
+            "fronius-id": section.get("fronius-id"),
+        }
+
+        if None in system.values():
+            none_fields = ", ".join([x[0] for x in system.items() if x[1] is None])
+
+            raise ValueError(
+                f"Fields {none_fields} of PV system {system['name']} were neither "
+                f"filled in its config section {section_name}, nor in the `secrets` "
+                f"section."
+            )
+
+        systems.append(system)
+
+    if not systems:
+        systems = [{"name": DEFAULT_SYSTEM_ID, **get_fronius_secrets()}]
+
+    return systems
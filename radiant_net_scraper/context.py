@@ -0,0 +1,108 @@
+"""
+Keep the resources of a long-running process warm between the jobs it runs.
+"""
+
+import configparser as cfp
+
+from radiant_net_scraper.config import (
+    Config,
+    get_chosen_data_path,
+    get_chosen_db_sharding,
+    get_chosen_raw_data_path,
+    get_configured_logger,
+    get_db_pragmas,
+    get_fronius_systems,
+)
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.fronius_session import FroniusSession
+
+LOGGER = get_configured_logger(__name__)
+
+
+class AppContext:
+    """
+    Own the resources shared by all jobs of a long-running process: the loaded config
+    and PV systems, a single connection to the app's DB, and a session per account.
+    Use as a context manager, so all of them get closed when the process is done.
+
+    The DB connection follows reloads of the config, changes of settings it can't
+    apply in place, like the DB's path, only get logged.
+    """
+
+    def __init__(
+        self,
+        db_path: str | None = None,
+        shard_by_year: bool | None = None,
+        systems: list[dict] | None = None,
+        raw_data_dir: str | None = None,
+    ) -> None:
+        self.systems = systems if systems is not None else get_fronius_systems()
+        self.raw_data_dir = raw_data_dir or get_chosen_raw_data_path() + "/"
+
+        if shard_by_year is None:
+            shard_by_year = get_chosen_db_sharding()
+
+        self._configured_db_path = get_chosen_data_path()
+
+        # Tables get created or migrated once here, not on every job.
+        self.db = Database(
+            db_path=db_path or self._configured_db_path, shard_by_year=shard_by_year
+        )
+        self.db.set_pragmas(get_db_pragmas())
+        self._closed = False
+
+        Config.subscribe(self.apply_config)
+
+    @property
+    def config(self) -> cfp.ConfigParser:
+        """
+        The current config, which may have been reloaded since the context was created.
+        """
+        return Config.get_config()
+
+    def apply_config(self, config: cfp.ConfigParser) -> None:
+        """
+        Apply a reloaded config to the resources of the context.
+        """
+        self.db.set_pragmas(get_db_pragmas())
+
+        if get_chosen_data_path() != self._configured_db_path:
+            LOGGER.warning(
+                "The DB path changed to %s, restart to switch over from %s.",
+                get_chosen_data_path(),
+                self.db.db_path,
+            )
+
+    def warm_up(self) -> None:
+        """
+        Log into the accounts of all PV systems now rather than during the first job.
+        Failures are only logged, jobs log in again when needed.
+        """
+        for system in self.systems:
+            try:
+                FroniusSession.get_session(system)
+
+            except Exception as e:
+                LOGGER.warning(
+                    "Couldn't log in for PV system %s yet: %s", system["name"], e
+                )
+
+    def close(self) -> None:
+        """
+        Close the DB connections and the sessions of all accounts.
+        """
+        if self._closed:
+            return
+
+        LOGGER.info("Closing DB connections and sessions...")
+
+        Config.unsubscribe(self.apply_config)
+        self.db.close()
+        FroniusSession.close_all()
+        self._closed = True
+
+    def __enter__(self) -> "AppContext":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
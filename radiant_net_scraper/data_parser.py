@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 import glob
 import json
+import os
 import re
 
 from dataclasses import asdict, astuple
@@ -17,8 +18,20 @@ from typing import Iterable
 from pipe import where, Pipe
 from pipe import map as pmap
 
-from radiant_net_scraper.config import get_chosen_data_path, get_configured_logger
+from radiant_net_scraper.config import (
+    DEFAULT_SYSTEM_ID,
+    get_chosen_data_path,
+    get_chosen_db_sharding,
+    get_configured_logger,
+)
+from radiant_net_scraper.archive import (
+    list_archived_files,
+    read_member,
+    split_member_path,
+)
 from radiant_net_scraper.database import Database
+from radiant_net_scraper.files import read_verified
+from radiant_net_scraper.metrics import count_bytes, timed
 from radiant_net_scraper.types import (
     ChartFileGroup,
     ChartGroup,
@@ -28,6 +41,17 @@ from radiant_net_scraper.types import (
 
 LOGGER = get_configured_logger(__name__)
 
+# Disallow in-place modification of dataframes. Set here rather than in the config, so
+# only processes handling dataframes pay for importing pandas.
+pd.options.mode.copy_on_write = True
+
+# Files of charts over a coarser interval than a day, as saved by the scraper.
+COARSE_FILE_RE = re.compile(r"_month_(production|consumption)\.json$")
+
+# Files of year charts, which hold a total per month rather than per day, and thus
+# can't be ingested as daily aggregates.
+YEAR_FILE_RE = re.compile(r"_year_(production|consumption)\.json$")
+
 
 @Pipe
 def filter_by(x: Iterable, flags: Iterable[bool]) -> Iterable:
@@ -89,6 +113,7 @@ def series_data_to_df(series_data: list[list[int,]]) -> pd.DataFrame:
     return pd.DataFrame({"time": time_arr, "data": data_arr})
 
 
+@timed("parse_usage_json")
 def parse_usage_json(usage_json: dict) -> pd.DataFrame:
     """
     Parse JSON dict representing the Fronius data for a given day into a
@@ -133,16 +158,22 @@ def parse_usage_json(usage_json: dict) -> pd.DataFrame:
     return usage_df
 
 
+@timed("load_daily_usage_json")
 def load_daily_usage_json(filepath: str) -> dict:
     """
-    Load a json file containing daily usage data into a dict. Later validation should
-    go in here.
+    Load a json file containing daily usage data into a dict, checking it against its
+    checksum first. `filepath` may also point to a chart inside a monthly archive.
+    Later validation should go in here.
     """
     # TODO Validate againts a schema to detect if the format has changed.
     # TODO Handle IO errors
     LOGGER.debug("Loading file at %s...", filepath)
-    with open(filepath, encoding="UTF-8") as infile:
-        return json.load(infile)
+
+    member = split_member_path(filepath)
+    content = read_member(*member) if member is not None else read_verified(filepath)
+    count_bytes("load_daily_usage_json", len(content))
+
+    return json.loads(content)
 
 
 def load_chart_group(group: ChartFileGroup) -> ChartGroup:
@@ -185,6 +216,7 @@ def calculate_col_kwh(raw_df=pd.DataFrame, agg_cols=list[str]) -> pd.DataFrame:
     return raw_df
 
 
+@timed("agg_daily_df")
 def agg_daily_df(
     daily_df: pd.DataFrame,
     kwh_cols: tuple[str, ...],
@@ -219,9 +251,10 @@ def agg_daily_df(
 
 def get_json_list(input_dir: str) -> list[str]:
     """
-    Find all the downloaded json files in a given dir and return them as a list.
+    Find all the downloaded json files in a given dir, including those in monthly
+    archives, and return them as a list.
     """
-    return glob.glob(f"{input_dir}/*.json")
+    return glob.glob(f"{input_dir}/*.json") + list_archived_files(input_dir)
 
 
 def get_chart_file_groups(files: list[str]) -> list[ChartFileGroup]:
@@ -239,13 +272,14 @@ def get_chart_file_groups(files: list[str]) -> list[ChartFileGroup]:
     return [ChartFileGroup(*group) for _, group in groupings]
 
 
-def process_daily_usage_dict(json_dict: dict) -> OutputDataFrames:
+def aggregate_usage_df(
+    usage_df: pd.DataFrame, time_cols: tuple[str, ...] = ("year", "month", "day")
+) -> pd.DataFrame:
     """
-    Process a json dict of daily usage data into a dataframe, and return it alongside
-    a dataframe of the data aggregated over the whole day.
+    Aggregate a data frame of a single day's usage data over `time_cols`, summing
+    power columns into kWh and averaging the rest. As the kWh of each row depend on the
+    time to the next one, the frame should always contain the full day.
     """
-    daily_df = parse_usage_json(json_dict)
-
     kwh_col_re = re.compile(r"^[A-Z]")
 
     avg_cols = tuple(["StateOfCharge"])
@@ -253,20 +287,61 @@ def process_daily_usage_dict(json_dict: dict) -> OutputDataFrames:
     kwh_cols = tuple(
         [
             col
-            for col in daily_df.columns
+            for col in usage_df.columns
             if re.search(kwh_col_re, col) is not None and col not in avg_cols
         ]
     )
 
-    time_cols = ("year", "month", "day")
-
-    agg_df = agg_daily_df(
-        daily_df, time_cols=time_cols, avg_cols=avg_cols, kwh_cols=kwh_cols
+    return agg_daily_df(
+        usage_df, time_cols=time_cols, avg_cols=avg_cols, kwh_cols=kwh_cols
     )
 
+
+def process_daily_usage_dict(json_dict: dict) -> OutputDataFrames:
+    """
+    Process a json dict of daily usage data into a dataframe, and return it alongside
+    a dataframe of the data aggregated over the whole day.
+    """
+    daily_df = parse_usage_json(json_dict)
+
+    agg_df = aggregate_usage_df(daily_df)
+
     return OutputDataFrames(raw=daily_df, aggregated=agg_df)
 
 
+def process_coarse_usage_dict(json_dict: dict, source: str = "month") -> pd.DataFrame:
+    """
+    Process a json dict of a chart holding a total per day, i.e. of a month chart, into
+    a dataframe of daily aggregates marked with their `source`.
+    """
+    usage_df = parse_usage_json(json_dict)
+
+    day_cols = ["year", "month", "day"]
+
+    if usage_df.duplicated(day_cols).any():
+        raise ValueError(
+            f"The {source} chart holds more than one value per day, only charts of "
+            "daily totals can be used as daily aggregates."
+        )
+
+    value_cols = [
+        col
+        for col in usage_df.columns
+        if col not in ("time", "hour", "minute", *day_cols)
+    ]
+
+    return (
+        usage_df[[*day_cols, *value_cols]]
+        .rename(
+            columns={
+                col: ("mean_" if col == "StateOfCharge" else "kwh_") + col
+                for col in value_cols
+            }
+        )
+        .assign(source=source)
+    )
+
+
 def parse_chart_group_data(group: ChartGroup) -> ChartGroupData:
     """
     Parse data from chart group.
@@ -280,12 +355,18 @@ def parse_chart_group_data(group: ChartGroup) -> ChartGroupData:
     )
 
 
-def save_usage_dataframe_dict(output_dfs: OutputDataFrames, db_handler: Database):
+def save_usage_dataframe_dict(
+    output_dfs: OutputDataFrames,
+    db_handler: Database,
+    system_id: str = DEFAULT_SYSTEM_ID,
+):
     """
-    Save the dataframes in a dict for raw and aggregated data into the DB.
+    Save the dataframes in a dict for raw and aggregated data of the PV system
+    `system_id` into the DB, both of them or neither.
     """
-    db_handler.insert_raw_data_df(output_dfs.raw)
-    db_handler.insert_daily_agg_df(output_dfs.aggregated)
+    with db_handler.transaction():
+        db_handler.insert_raw_data_df(output_dfs.raw, system_id=system_id)
+        db_handler.insert_daily_agg_df(output_dfs.aggregated, system_id=system_id)
 
 
 def merge_chart_data(
@@ -297,54 +378,267 @@ def merge_chart_data(
     return OutputDataFrames(*[pd.merge(df_a, df_b) for df_a, df_b in zip(dfs_a, dfs_b)])
 
 
-def save_chart_data(group: ChartGroupData, *args, **kwargs) -> None:
+def merge_chart_group_data(group: ChartGroupData) -> OutputDataFrames:
     """
-    Merge the parsed data of a group and insert it into the DB.
+    Merge the parsed data of all charts of a group.
     """
     group_data_filtered = [data for data in astuple(group) if data]
 
-    merged_data = reduce(merge_chart_data, group_data_filtered)
+    return reduce(merge_chart_data, group_data_filtered)
 
-    save_usage_dataframe_dict(merged_data, *args, **kwargs)
 
+def save_chart_data(group: ChartGroupData, *args, **kwargs) -> None:
+    """
+    Merge the parsed data of a group and insert it into the DB.
+    """
+    save_usage_dataframe_dict(merge_chart_group_data(group), *args, **kwargs)
 
-def parse_json_data_from_file_pair_list(
-    infile_groups: list[ChartFileGroup], **kwargs
-) -> None:
+
+def open_database(**kwargs) -> Database:
     """
-    Parse a list of JSON file groups into the SQLite DB.
+    Open the DB given by `kwargs`, defaulting to the one given by the config.
     """
     if "db_path" not in kwargs:
         kwargs["db_path"] = get_chosen_data_path()
-    db_handler = Database(**kwargs)
+    if "shard_by_year" not in kwargs:
+        kwargs["shard_by_year"] = get_chosen_db_sharding()
+
+    return Database(**kwargs)
+
+
+def journal_key(group: ChartFileGroup) -> str:
+    """
+    Get the key under which the ingestion of a group is journaled.
+    """
+    return os.path.abspath(group.production)
+
+
+def ingest_chart_file_group(
+    group: ChartFileGroup,
+    db_handler: Database,
+    system_id: str = DEFAULT_SYSTEM_ID,
+    interrupted: bool = False,
+) -> None:
+    """
+    Parse a group of chart files into the DB, recording its progress in the journal.
+    The group's data is written in a single transaction along with its commit to the
+    journal, so a failure leaves neither behind. Should the ingestion of the group
+    have been `interrupted` before, the stored data of the group's days is replaced.
+    """
+    key = journal_key(group)
+    chart_group = load_chart_group(group)
+
+    if group_is_paywalled(chart_group):
+        db_handler.set_journal_state([key], "committed", system_id)
+        return
+
+    data = merge_chart_group_data(parse_chart_group_data(chart_group))
+    db_handler.set_journal_state([key], "parsed", system_id)
+
+    with db_handler.transaction():
+        if interrupted:
+            days = data.aggregated[["year", "month", "day"]]
+
+            for year, month, day in days.itertuples(index=False):
+                date = dt.date(int(year), int(month), int(day))
+                db_handler.delete_raw_data(date, date, system_id=system_id)
+                db_handler.delete_daily_agg(date, date, system_id=system_id)
+
+        save_usage_dataframe_dict(data, db_handler, system_id=system_id)
+        db_handler.set_journal_state([key], "committed", system_id)
+
+
+def parse_json_data_from_file_pair_list(
+    infile_groups: list[ChartFileGroup],
+    system_id: str = DEFAULT_SYSTEM_ID,
+    db_handler: Database | None = None,
+    resume: bool = False,
+    replace: bool = False,
+    **kwargs,
+) -> list[ChartFileGroup]:
+    """
+    Parse a list of JSON file groups of the PV system `system_id` into the SQLite DB.
+    Without a `db_handler`, the DB given by `kwargs` is opened for the occasion.
+
+    The state of each group is journaled in the DB. Groups failing to parse or insert
+    get quarantined along with their error, while the rest carry on. With `resume`,
+    groups committed or quarantined by earlier runs are skipped, and those
+    interrupted while being written are redone. With `replace`, the stored data of
+    the groups' days is replaced, as when charts got written again. Returns the groups
+    quarantined in this run.
+    """
+    close_db = db_handler is None
+
+    if close_db:
+        db_handler = open_database(**kwargs)
 
     LOGGER.debug("Parsing %s groups:", len(infile_groups))
     LOGGER.debug("%s", infile_groups)
 
-    _ = (
-        infile_groups
-        | pmap(load_chart_group)
-        | where(lambda x: not group_is_paywalled(x))
-        | pmap(parse_chart_group_data)
-        | pmap(lambda x: save_chart_data(x, db_handler))
-        | run_pipe()
-    )
+    quarantined = []
+
+    try:
+        states = {}
+
+        if resume:
+            states = db_handler.get_journal_states(
+                [journal_key(group) for group in infile_groups], system_id
+            )
+            infile_groups = [
+                group
+                for group in infile_groups
+                if states.get(journal_key(group)) not in ("committed", "quarantined")
+            ]
+
+            LOGGER.info(
+                "Resuming ingestion, %s groups are left to do.", len(infile_groups)
+            )
+
+        db_handler.set_journal_state(
+            [journal_key(group) for group in infile_groups], "pending", system_id
+        )
+
+        for group in infile_groups:
+            try:
+                ingest_chart_file_group(
+                    group,
+                    db_handler,
+                    system_id=system_id,
+                    interrupted=replace or states.get(journal_key(group)) == "parsed",
+                )
+
+            except Exception as e:
+                LOGGER.error("Quarantining %s: %s", group.production, e)
+                db_handler.set_journal_state(
+                    [journal_key(group)], "quarantined", system_id, error=str(e)
+                )
+                quarantined.append(group)
+
+    finally:
+        if close_db:
+            db_handler.close()
+
+    if quarantined:
+        LOGGER.warning(
+            "Quarantined %s of %s groups, see the ingest_journal table.",
+            len(quarantined),
+            len(infile_groups),
+        )
+
+    return quarantined
+
+
+def parse_coarse_json_data_from_file_pair_list(
+    infile_groups: list[ChartFileGroup],
+    system_id: str = DEFAULT_SYSTEM_ID,
+    today: dt.date | None = None,
+    db_handler: Database | None = None,
+    **kwargs,
+) -> None:
+    """
+    Parse a list of JSON file groups of month charts of the PV system `system_id` into
+    the daily aggregates of the SQLite DB. Today and later days are left out, as their
+    totals are not final yet. Without a `db_handler`, the DB given by `kwargs` is
+    opened for the occasion.
+    """
+    close_db = db_handler is None
+
+    if close_db:
+        db_handler = open_database(**kwargs)
 
+    today = today or dt.date.today()
+    today_int = today.year * 10000 + today.month * 100 + today.day
 
-def parse_json_data_from_file_list(infiles: list[str], **kwargs) -> None:
+    LOGGER.debug("Parsing %s coarse groups:", len(infile_groups))
+    LOGGER.debug("%s", infile_groups)
+
+    def save_coarse_group(group: ChartGroup) -> None:
+        daily_df = reduce(
+            pd.merge,
+            [process_coarse_usage_dict(chart) for chart in astuple(group) if chart],
+        )
+        date_ints = daily_df.year * 10000 + daily_df.month * 100 + daily_df.day
+
+        db_handler.upsert_coarse_daily_agg_df(
+            daily_df[date_ints < today_int], system_id=system_id
+        )
+
+    try:
+        _ = (
+            infile_groups
+            | pmap(load_chart_group)
+            | where(lambda x: not group_is_paywalled(x))
+            | pmap(save_coarse_group)
+            | run_pipe()
+        )
+
+    finally:
+        if close_db:
+            db_handler.close()
+
+
+def split_coarse_files(files: list[str]) -> tuple[list[str], list[str]]:
     """
-    Parse a list of JSON files into the SQLite DB.
+    Split a list of JSON files into those of day charts and those of month charts.
+    Files of year charts are left out of both.
     """
-    parse_json_data_from_file_pair_list(get_chart_file_groups(infiles), **kwargs)
+    year_files = [file for file in files if re.search(YEAR_FILE_RE, file)]
+    coarse_files = [file for file in files if re.search(COARSE_FILE_RE, file)]
+    day_files = [
+        file for file in files if file not in coarse_files and file not in year_files
+    ]
+
+    if year_files:
+        LOGGER.warning(
+            "Skipping %s files of year charts, which can't be ingested: %s",
+            len(year_files),
+            ", ".join(year_files),
+        )
+
+    return day_files, coarse_files
 
 
-def parse_json_data(input_dir: str = "./", **kwargs):
+def parse_json_data_from_file_list(
+    infiles: list[str], resume: bool = False, **kwargs
+) -> list[ChartFileGroup]:
     """
-    Parse all the json files in `input_dir` into a sqlite DB.
+    Parse a list of JSON files into the SQLite DB. Returns the quarantined groups of
+    day charts, see `parse_json_data_from_file_pair_list`.
+    """
+    day_files, coarse_files = split_coarse_files(infiles)
+
+    quarantined = parse_json_data_from_file_pair_list(
+        get_chart_file_groups(day_files), resume=resume, **kwargs
+    )
+
+    if coarse_files:
+        parse_coarse_json_data_from_file_pair_list(
+            get_chart_file_groups(coarse_files), **kwargs
+        )
+
+    return quarantined
+
+
+def parse_json_data(
+    input_dir: str = "./", resume: bool = False, **kwargs
+) -> list[ChartFileGroup]:
+    """
+    Parse all the json files in `input_dir` into a sqlite DB. Returns the quarantined
+    groups of day charts, see `parse_json_data_from_file_pair_list`.
     """
     LOGGER.info("Finding file groups to ingest in %s...", input_dir)
-    file_groups = get_chart_file_groups(get_json_list(input_dir))
+    day_files, coarse_files = split_coarse_files(get_json_list(input_dir))
+    file_groups = get_chart_file_groups(day_files)
 
     LOGGER.debug("Groups to be ingested: %s", file_groups)
 
-    parse_json_data_from_file_pair_list(file_groups, **kwargs)
+    quarantined = parse_json_data_from_file_pair_list(
+        file_groups, resume=resume, **kwargs
+    )
+
+    if coarse_files:
+        parse_coarse_json_data_from_file_pair_list(
+            get_chart_file_groups(coarse_files), **kwargs
+        )
+
+    return quarantined
@@ -2,22 +2,182 @@
 Manage the connection to the App's database.
 """
 
+import datetime as dt
+import functools
 import os
 import sqlite3
+import stat
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Iterator
+from urllib.request import pathname2url
 
 import pandas as pd
 
-from radiant_net_scraper.config import get_configured_logger
+from radiant_net_scraper.config import DEFAULT_SYSTEM_ID, get_configured_logger
+from radiant_net_scraper.metrics import count_rows, timed
 
 LOGGER = get_configured_logger(__name__)
 
+RAW_DATA_COLUMNS = {
+    "ToConsumer": "REAL",
+    "FromGen": "REAL",
+    "FromGenToBatt": "REAL",
+    "FromGenToGrid": "REAL",
+    "FromGenToConsumer": "REAL",
+    "FromGenToSomewhere": "REAL",
+    "FromGenToWattPilot": "REAL",
+    "FromBattToConsumer": "REAL",
+    "FromGridToConsumer": "REAL",
+    "StateOfCharge": "REAL",
+    "EmergencyPower": "",
+    "time": "INTEGER NOT NULL",
+    "system_id": f"TEXT NOT NULL DEFAULT '{DEFAULT_SYSTEM_ID}'",
+    "year": "INTEGER NOT NULL",
+    "month": "INTEGER NOT NULL",
+    "day": "INTEGER NOT NULL",
+    "hour": "INTEGER NOT NULL",
+    "minute": "INTEGER NOT NULL",
+}
+
+DAILY_AGG_COLUMNS = {
+    "kwh_ToConsumer": "REAL",
+    "kwh_FromGen": "REAL",
+    "kwh_FromGenToBatt": "REAL",
+    "kwh_FromGenToGrid": "REAL",
+    "kwh_FromGenToConsumer": "REAL",
+    "kwh_FromGenToSomewhere": "REAL",
+    "kwh_FromGenToWattPilot": "REAL",
+    "kwh_FromBattToConsumer": "REAL",
+    "kwh_FromGridToConsumer": "REAL",
+    "kwh_EmergencyPower": "",
+    "mean_StateOfCharge": "REAL",
+    # Interval of the charts the row was derived from, "day" for those aggregated from
+    # raw data, or "month" for coarse rows of daily totals.
+    "source": "TEXT NOT NULL DEFAULT 'day'",
+    "system_id": f"TEXT NOT NULL DEFAULT '{DEFAULT_SYSTEM_ID}'",
+    "year": "INTEGER NOT NULL",
+    "month": "INTEGER NOT NULL",
+    "day": "INTEGER NOT NULL",
+}
+
+JOURNAL_COLUMNS = {
+    "path": "TEXT NOT NULL",
+    "system_id": f"TEXT NOT NULL DEFAULT '{DEFAULT_SYSTEM_ID}'",
+    # One of JOURNAL_STATES.
+    "state": "TEXT NOT NULL",
+    "error": "TEXT",
+    "updated_at": "REAL NOT NULL",
+}
+
+# States a group of chart files goes through while being ingested, it is either
+# committed in the end, or quarantined should it fail.
+JOURNAL_STATES = ("pending", "parsed", "committed", "quarantined")
+
+# Expression to compare the date of a row as an integer of the form YYYYMMDD.
+DATE_EXPR = "(year * 10000 + month * 100 + day)"
+
+# SQLite refuses to attach more databases than this at once by default.
+MAX_ATTACHED = 10
+
+
+def path_to_uri(path: str, mode: str = "rwc") -> str:
+    """
+    Convert a file path into an SQLite URI opening it in `mode`.
+    """
+    return f"file:{pathname2url(os.path.abspath(path))}?mode={mode}"
+
+
+def _date_to_int(date: dt.date) -> int:
+    """
+    Convert a date into an integer comparable to `DATE_EXPR`.
+    """
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def _init_connection(db_conn: sqlite3.Connection) -> None:
+    """
+    Set up a fresh connection. Incremental auto-vacuum only takes effect on new files,
+    for which it allows returning space freed by deleting old data bit by bit. Existing
+    files are converted by `Database.convert_to_incremental_vacuum`.
+    """
+    db_conn.row_factory = sqlite3.Row
+    db_conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+def get_shard_path(db_path: str, year: int) -> str:
+    """
+    Get the path of the file holding the raw data of `year` when sharding the DB at
+    `db_path`. Shards live next to the main DB file, e.g.
+    `generation_and_usage.raw_2024.sqlite3`.
+    """
+    stem, ext = os.path.splitext(db_path)
+
+    return f"{stem}.raw_{year}{ext}"
+
+
+def get_shard_years(db_path: str) -> list[int]:
+    """
+    Get the years for which a raw data shard of the DB at `db_path` exists on disk.
+    Only looks at the file system, without opening any of the files.
+    """
+    stem, ext = os.path.splitext(db_path)
+    shard_dir = os.path.dirname(stem) or "."
+    prefix = os.path.basename(stem) + ".raw_"
+
+    years = []
+    for filename in os.listdir(shard_dir):
+        if filename.startswith(prefix) and filename.endswith(ext):
+            year = filename[len(prefix) : len(filename) - len(ext)]
+
+            if year.isdigit():
+                years.append(int(year))
+
+    return sorted(years)
+
+
+def _set_pragmas(db_conn: sqlite3.Connection, pragmas: dict[str, int]) -> None:
+    """
+    Set the integer valued `pragmas`, mapping names to values, on a connection.
+    """
+    for name, value in pragmas.items():
+        db_conn.execute(f"PRAGMA {name} = {int(value)}")
+
+
+def _synchronized(method):
+    """
+    Make a method of `Database` hold its lock, so a single instance can be shared by
+    several threads.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _is_frozen(path: str) -> bool:
+    """
+    Check whether the file at `path` has been made read-only for its owner.
+    """
+    return not os.stat(path).st_mode & stat.S_IWUSR
+
 
 class Database:
     """
-    Class for managing the SQLite DB for storing generation & usage data.
+    Class for managing the SQLite DB for storing generation & usage data. Instances
+    can be shared across threads, their connections are used by one at a time.
     """
 
-    def __init__(self, db_path: str = "./generation_and_usage.sqlite3") -> None:
+    def __init__(
+        self,
+        db_path: str = "./generation_and_usage.sqlite3",
+        shard_by_year: bool = False,
+    ) -> None:
         LOGGER.info("Starting connection to SQLite DB at %s", db_path)
 
         if not os.path.exists(db_path):
@@ -26,13 +186,25 @@ class Database:
         else:
             LOGGER.info("Exsisting file found at %s, it will be modified.", db_path)
 
-        self.db_conn = sqlite3.connect(db_path)
-        self.db_conn.row_factory = sqlite3.Row
+        self.db_path = db_path
+        self.shard_by_year = shard_by_year
+        self._shard_conns: dict[int, sqlite3.Connection] = {}
+        self._pragmas: dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._in_transaction = False
+
+        # Open as URI so shards can later be attached read-only.
+        self.db_conn = sqlite3.connect(
+            path_to_uri(db_path), uri=True, check_same_thread=False
+        )
+        _init_connection(self.db_conn)
 
-        # Technically we don't need to create the table, pd.DataFrame.to_sql could do
-        # the job for us. But I think it is sensible to create the tables beforehand
+        # Tables are created beforehand, as dataframes get inserted into them as is,
         # so errors get raised when there is a mismatch between columns.
-        self._create_raw_data_table(self.db_conn.cursor())
+        # When sharding, raw data lives in the per-year shard files instead.
+        if not self.shard_by_year:
+            self._create_raw_data_table(self.db_conn.cursor())
+
         self._create_daily_agg_table(self.db_conn.cursor())
 
     def _create_table(
@@ -43,12 +215,39 @@ class Database:
         constraints: list[str],
     ) -> None:
         """
-        Create a SQLite table from parameters.
+        Create a SQLite table from parameters. Should the table already exist but
+        lack some of the columns, it gets rebuilt with the new schema, keeping the data
+        of the columns present in both and filling new ones with their defaults.
         """
         columns = [" ".join([key, value]) for key, value in column_dict.items()]
 
         command_body = ", ".join(columns + constraints)
 
+        existing_columns = [
+            row[1] for row in db_cursor.execute(f"PRAGMA table_info({table_name})")
+        ]
+
+        if existing_columns and not set(column_dict) <= set(existing_columns):
+            kept_columns = ", ".join(
+                col for col in existing_columns if col in column_dict
+            )
+
+            LOGGER.info("Migrating table %s to the current schema...", table_name)
+
+            db_cursor.executescript(
+                f"""
+                BEGIN;
+                ALTER TABLE {table_name} RENAME TO {table_name}_old;
+                CREATE TABLE {table_name} ({command_body});
+                INSERT INTO {table_name} ({kept_columns})
+                    SELECT {kept_columns} FROM {table_name}_old;
+                DROP TABLE {table_name}_old;
+                COMMIT;
+                """
+            )
+
+            return
+
         command = f"CREATE TABLE IF NOT EXISTS {table_name} ({command_body})"
 
         db_cursor.execute(command)
@@ -59,63 +258,188 @@ class Database:
         """
         table_name = "raw_data"
 
-        column_dict = {
-            "ToConsumer": "REAL",
-            "FromGen": "REAL",
-            "FromGenToBatt": "REAL",
-            "FromGenToGrid": "REAL",
-            "FromGenToConsumer": "REAL",
-            "FromGenToSomewhere": "REAL",
-            "FromGenToWattPilot": "REAL",
-            "FromBattToConsumer": "REAL",
-            "FromGridToConsumer": "REAL",
-            "StateOfCharge": "REAL",
-            "EmergencyPower": "",
-            "time": "INTEGER NOT NULL UNIQUE",
-            "year": "INTEGER NOT NULL",
-            "month": "INTEGER NOT NULL",
-            "day": "INTEGER NOT NULL",
-            "hour": "INTEGER NOT NULL",
-            "minute": "INTEGER NOT NULL",
-        }
-
-        constraints = ["PRIMARY KEY (time)"]
+        column_dict = RAW_DATA_COLUMNS
+
+        constraints = ["PRIMARY KEY (system_id, time)"]
 
         self._create_table(db_cursor, table_name, column_dict, constraints)
 
+        db_cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table_name}_system_day "
+            f"ON {table_name} (system_id, year, month, day)"
+        )
+
     def _create_daily_agg_table(self, db_cursor: sqlite3.Cursor) -> None:
         """
         Create the table containing data aggregated for each day.
         """
         table_name = "daily_aggregated"
 
-        column_dict = {
-            "kwh_ToConsumer": "REAL",
-            "kwh_FromGen": "REAL",
-            "kwh_FromGenToBatt": "REAL",
-            "kwh_FromGenToGrid": "REAL",
-            "kwh_FromGenToConsumer": "REAL",
-            "kwh_FromGenToSomewhere": "REAL",
-            "kwh_FromGenToWattPilot": "REAL",
-            "kwh_FromBattToConsumer": "REAL",
-            "kwh_FromGridToConsumer": "REAL",
-            "kwh_EmergencyPower": "",
-            "mean_StateOfCharge": "REAL",
-            "year": "INTEGER NOT NULL",
-            "month": "INTEGER NOT NULL",
-            "day": "INTEGER NOT NULL",
-        }
-
-        constraints = ["PRIMARY KEY (year, month, day)"]
+        column_dict = DAILY_AGG_COLUMNS
+
+        constraints = ["PRIMARY KEY (system_id, year, month, day)"]
+
+        self._create_table(db_cursor, table_name, column_dict, constraints)
+
+    def _create_hourly_agg_table(self, db_cursor: sqlite3.Cursor) -> None:
+        """
+        Create the table containing raw data downsampled to hourly buckets.
+        """
+        table_name = "hourly_aggregated"
+
+        column_dict = {**DAILY_AGG_COLUMNS, "hour": "INTEGER NOT NULL"}
+
+        constraints = ["PRIMARY KEY (system_id, year, month, day, hour)"]
+
+        self._create_table(db_cursor, table_name, column_dict, constraints)
+
+    def _create_journal_table(self, db_cursor: sqlite3.Cursor) -> None:
+        """
+        Create the table recording how far the ingestion of each group of chart files
+        got.
+        """
+        table_name = "ingest_journal"
+
+        column_dict = JOURNAL_COLUMNS
+
+        constraints = ["PRIMARY KEY (system_id, path)"]
 
         self._create_table(db_cursor, table_name, column_dict, constraints)
 
-    def _insert_df(self, df: pd.DataFrame, table_name: str) -> None:
+    def get_shard_path(self, year: int) -> str:
+        """
+        Get the path of the file holding the raw data of `year` when sharding.
+        """
+        return get_shard_path(self.db_path, year)
+
+    def get_shard_years(self) -> list[int]:
+        """
+        Get the years for which a raw data shard exists on disk.
+        """
+        return get_shard_years(self.db_path)
+
+    def _get_shard_conn(self, year: int) -> sqlite3.Connection:
+        """
+        Get the connection to the shard of `year`, creating the shard if needed.
+        """
+        if year not in self._shard_conns:
+            shard_path = self.get_shard_path(year)
+
+            if os.path.exists(shard_path) and _is_frozen(shard_path):
+                raise PermissionError(
+                    f"The raw data shard for {year} at {shard_path} is read-only, "
+                    f"refusing to write to it. Make it writable again if you really "
+                    f"want to modify data from {year}."
+                )
+
+            LOGGER.debug("Opening raw data shard for %s at %s.", year, shard_path)
+
+            shard_conn = sqlite3.connect(shard_path, check_same_thread=False)
+            _init_connection(shard_conn)
+            _set_pragmas(shard_conn, self._pragmas)
+            self._create_raw_data_table(shard_conn.cursor())
+
+            self._shard_conns[year] = shard_conn
+
+        return self._shard_conns[year]
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Make the writes within the block, across the DB and its shards, in a single
+        transaction. It is committed once the block is left, or rolled back should it
+        raise, even when interrupted. Other threads are held off until then, and
+        transactions opened within the block become part of it. Raw data can't be read
+        within the block when sharding, as shards can't be attached in a transaction.
+        """
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+
+            self._in_transaction = True
+
+            try:
+                yield
+
+                # The DB goes last, so its journal never claims what a shard failed to
+                # commit.
+                for db_conn in [*self._shard_conns.values(), self.db_conn]:
+                    db_conn.commit()
+
+            except BaseException:
+                for db_conn in [*self._shard_conns.values(), self.db_conn]:
+                    db_conn.rollback()
+
+                raise
+
+            finally:
+                self._in_transaction = False
+
+    @contextmanager
+    def _writing(self, db_conn: sqlite3.Connection) -> Iterator[None]:
+        """
+        Commit the writes made on `db_conn` within the block, or roll them back should
+        it raise, unless they are part of an open `transaction`.
+        """
+        if self._in_transaction:
+            yield
+            return
+
+        with db_conn:
+            yield
+
+    @_synchronized
+    def freeze_shards(self, before_year: int) -> list[str]:
+        """
+        Make the shards of all years before `before_year` read-only, so they can be
+        backed up or copied independently without fear of them changing. Returns the
+        paths of the frozen shards.
+        """
+        frozen = []
+
+        for year in self.get_shard_years():
+            shard_path = self.get_shard_path(year)
+
+            if year >= before_year or _is_frozen(shard_path):
+                continue
+
+            if year in self._shard_conns:
+                self._shard_conns.pop(year).close()
+
+            mode = os.stat(shard_path).st_mode
+            os.chmod(shard_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+            LOGGER.info("Froze raw data shard for %s at %s.", year, shard_path)
+            frozen.append(shard_path)
+
+        return frozen
+
+    @timed("insert_df")
+    def _insert_df(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        db_conn: sqlite3.Connection | None = None,
+    ) -> None:
         """
-        Insert a dataframe into the database.
+        Insert a dataframe into the database. Rows are inserted by hand rather than
+        with `pd.DataFrame.to_sql`, as that commits on its own.
         """
+        db_conn = db_conn or self.db_conn
+
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join(["?"] * len(df.columns))
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False)
+
         try:
-            df.to_sql(table_name, self.db_conn, if_exists="append", index=False)
+            with self._writing(db_conn):
+                db_conn.executemany(
+                    f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})",
+                    rows,
+                )
+
+            count_rows("insert_df", len(df))
         except sqlite3.IntegrityError as e:
             if "UNIQUE constraint failed" in str(e):
                 warning = (
@@ -130,14 +454,417 @@ class Database:
             else:
                 raise e
 
-    def insert_raw_data_df(self, raw_data_df: pd.DataFrame) -> None:
+    @_synchronized
+    def insert_raw_data_df(
+        self, raw_data_df: pd.DataFrame, system_id: str = DEFAULT_SYSTEM_ID
+    ) -> None:
+        """
+        Insert data of the PV system `system_id` into the raw_data table. When
+        sharding, rows are routed to the shard of their `year`.
+        """
+        raw_data_df = raw_data_df.assign(system_id=system_id)
+
+        if not self.shard_by_year:
+            self._insert_df(raw_data_df, "raw_data")
+            return
+
+        for year, year_df in raw_data_df.groupby("year"):
+            self._insert_df(year_df, "raw_data", self._get_shard_conn(int(year)))
+
+    @_synchronized
+    def insert_daily_agg_df(
+        self, daily_agg_df: pd.DataFrame, system_id: str = DEFAULT_SYSTEM_ID
+    ) -> None:
+        """
+        Insert data of the PV system `system_id` into the daily_aggregated table. Coarse
+        rows of the same days get replaced, as rows aggregated from raw data are more
+        detailed.
+        """
+        with self._writing(self.db_conn):
+            self.db_conn.executemany(
+                "DELETE FROM daily_aggregated WHERE system_id = ? AND year = ? "
+                "AND month = ? AND day = ? AND source != 'day'",
+                [
+                    (system_id, *map(int, row))
+                    for row in daily_agg_df[["year", "month", "day"]].itertuples(
+                        index=False
+                    )
+                ],
+            )
+
+        self._insert_df(daily_agg_df.assign(system_id=system_id), "daily_aggregated")
+
+    @_synchronized
+    def upsert_coarse_daily_agg_df(
+        self, daily_agg_df: pd.DataFrame, system_id: str = DEFAULT_SYSTEM_ID
+    ) -> None:
+        """
+        Insert daily totals of the PV system `system_id` taken from coarse charts into
+        the daily_aggregated table, marked by their `source`. Earlier coarse rows get
+        updated, rows aggregated from raw data are left alone.
+        """
+        daily_agg_df = daily_agg_df.assign(system_id=system_id)
+
+        columns = ", ".join(daily_agg_df.columns)
+        placeholders = ", ".join(["?"] * len(daily_agg_df.columns))
+        updates = ", ".join(
+            f"{col} = excluded.{col}"
+            for col in daily_agg_df.columns
+            if col not in ("system_id", "year", "month", "day")
+        )
+        rows = daily_agg_df.astype(object).where(daily_agg_df.notna(), None)
+
+        with self._writing(self.db_conn):
+            self.db_conn.executemany(
+                f"INSERT INTO daily_aggregated ({columns}) VALUES ({placeholders}) "
+                "ON CONFLICT (system_id, year, month, day) "
+                f"DO UPDATE SET {updates} WHERE daily_aggregated.source != 'day'",
+                rows.itertuples(index=False),
+            )
+
+    def _select_raw(
+        self, select: str, where: str, params: list, years: list[int]
+    ) -> pd.DataFrame:
+        """
+        Run a select on the raw data. When sharding, the shards of `years` get attached
+        read-only in chunks, and the select is run on the union of their tables.
+        """
+        if not self.shard_by_year:
+            return pd.read_sql_query(
+                f"SELECT {select} FROM raw_data WHERE {where}",
+                self.db_conn,
+                params=params,
+            )
+
+        years = [year for year in years if os.path.exists(self.get_shard_path(year))]
+
+        chunk_dfs = []
+        for i in range(0, len(years), MAX_ATTACHED):
+            chunk_years = years[i : i + MAX_ATTACHED]
+            schemas = [f"shard_{year}" for year in chunk_years]
+
+            for year, schema in zip(chunk_years, schemas):
+                shard_uri = path_to_uri(self.get_shard_path(year), mode="ro")
+                self.db_conn.execute(f"ATTACH DATABASE ? AS {schema}", (shard_uri,))
+
+            try:
+                query = " UNION ALL ".join(
+                    f"SELECT {select} FROM {schema}.raw_data WHERE {where}"
+                    for schema in schemas
+                )
+
+                chunk_dfs.append(
+                    pd.read_sql_query(query, self.db_conn, params=params * len(schemas))
+                )
+
+            finally:
+                for schema in schemas:
+                    self.db_conn.execute(f"DETACH DATABASE {schema}")
+
+        if not chunk_dfs:
+            return pd.DataFrame(columns=list(RAW_DATA_COLUMNS))
+
+        return pd.concat(chunk_dfs, ignore_index=True)
+
+    @_synchronized
+    def get_raw_data_df(
+        self, start: dt.date, end: dt.date, system_id: str | None = None
+    ) -> pd.DataFrame:
+        """
+        Get the raw data of all days between `start` and `end` (both inclusive), of
+        either all PV systems or only `system_id`. When sharding, only the shards
+        covering the range get attached, and the query is run as a union across them.
+        """
+        where = f"{DATE_EXPR} BETWEEN ? AND ?"
+        params = [_date_to_int(start), _date_to_int(end)]
+
+        if system_id is not None:
+            where += " AND system_id = ?"
+            params.append(system_id)
+
+        raw_df = self._select_raw(
+            "*", where, params, list(range(start.year, end.year + 1))
+        )
+
+        return raw_df.sort_values("time", ignore_index=True)
+
+    @_synchronized
+    def get_latest_raw_time(
+        self, date: dt.date, system_id: str = DEFAULT_SYSTEM_ID
+    ) -> int | None:
+        """
+        Get the timestamp of the latest raw data row of the PV system `system_id` on
+        `date`, or None if there is none.
+        """
+        latest_df = self._select_raw(
+            "MAX(time) AS time",
+            f"{DATE_EXPR} = ? AND system_id = ?",
+            [_date_to_int(date), system_id],
+            [date.year],
+        )
+        latest = latest_df["time"].max()
+
+        return None if pd.isna(latest) else int(latest)
+
+    @_synchronized
+    def get_raw_days(self, before: dt.date, limit: int | None = None) -> list[dt.date]:
+        """
+        Get the (at most `limit` oldest) days before `before` for which raw data is
+        present. Days in frozen shards are left out, as they can't be modified.
+        """
+        years = (
+            [
+                year
+                for year in self.get_shard_years()
+                if year <= before.year and not _is_frozen(self.get_shard_path(year))
+            ]
+            if self.shard_by_year
+            else []
+        )
+
+        days_df = self._select_raw(
+            "DISTINCT year, month, day",
+            f"{DATE_EXPR} < ?",
+            [_date_to_int(before)],
+            years,
+        )
+
+        days = sorted(
+            {dt.date(*map(int, row)) for row in days_df.itertuples(index=False)}
+        )
+
+        return days[:limit] if limit is not None else days
+
+    @_synchronized
+    def get_daily_agg_days(
+        self,
+        start: dt.date,
+        end: dt.date,
+        system_id: str = DEFAULT_SYSTEM_ID,
+        source: str | None = "day",
+    ) -> set[dt.date]:
+        """
+        Get the days between `start` and `end` (both inclusive) for which the PV
+        system `system_id` has daily aggregates, by default only those aggregated from
+        raw data. Pass `source=None` to include coarse rows.
+        """
+        command = (
+            "SELECT year, month, day FROM daily_aggregated "
+            f"WHERE {DATE_EXPR} BETWEEN ? AND ? AND system_id = ?"
+        )
+        params = (_date_to_int(start), _date_to_int(end), system_id)
+
+        if source is not None:
+            command += " AND source = ?"
+            params += (source,)
+
+        rows = self.db_conn.execute(command, params)
+
+        return {dt.date(*row) for row in rows}
+
+    @_synchronized
+    def get_first_daily_agg_day(
+        self, system_id: str = DEFAULT_SYSTEM_ID
+    ) -> dt.date | None:
         """
-        Insert data into the raw_data table.
+        Get the earliest day for which the PV system `system_id` has a daily
+        aggregate, or None if it has none.
         """
-        self._insert_df(raw_data_df, "raw_data")
+        row = self.db_conn.execute(
+            "SELECT year, month, day FROM daily_aggregated WHERE system_id = ? "
+            f"ORDER BY {DATE_EXPR} LIMIT 1",
+            (system_id,),
+        ).fetchone()
 
-    def insert_daily_agg_df(self, daily_agg_df: pd.DataFrame) -> None:
+        return dt.date(*row) if row is not None else None
+
+    @_synchronized
+    def delete_daily_agg(
+        self, start: dt.date, end: dt.date, system_id: str | None = None
+    ) -> int:
+        """
+        Delete the daily aggregates of all days between `start` and `end` (both
+        inclusive), of either all PV systems or only `system_id`. Returns the number of
+        deleted rows.
+        """
+        command = f"DELETE FROM daily_aggregated WHERE {DATE_EXPR} BETWEEN ? AND ?"
+        params = (_date_to_int(start), _date_to_int(end))
+
+        if system_id is not None:
+            command += " AND system_id = ?"
+            params += (system_id,)
+
+        with self._writing(self.db_conn):
+            return self.db_conn.execute(command, params).rowcount
+
+    @_synchronized
+    def delete_raw_data(
+        self, start: dt.date, end: dt.date, system_id: str | None = None
+    ) -> int:
+        """
+        Delete the raw data of all days between `start` and `end` (both inclusive), of
+        either all PV systems or only `system_id`. Returns the number of deleted rows.
+        """
+        command = f"DELETE FROM raw_data WHERE {DATE_EXPR} BETWEEN ? AND ?"
+        params = (_date_to_int(start), _date_to_int(end))
+
+        if system_id is not None:
+            command += " AND system_id = ?"
+            params += (system_id,)
+
+        if not self.shard_by_year:
+            conns = [self.db_conn]
+
+        else:
+            conns = [
+                self._get_shard_conn(year)
+                for year in range(start.year, end.year + 1)
+                if os.path.exists(self.get_shard_path(year))
+            ]
+
+        n_deleted = 0
+        for db_conn in conns:
+            with self._writing(db_conn):
+                n_deleted += db_conn.execute(command, params).rowcount
+
+        return n_deleted
+
+    @_synchronized
+    def upsert_hourly_agg_df(self, hourly_agg_df: pd.DataFrame) -> None:
+        """
+        Insert data into the hourly_aggregated table, replacing rows already present
+        for the same hour.
+        """
+        self._create_hourly_agg_table(self.db_conn.cursor())
+        self._upsert_df(hourly_agg_df, "hourly_aggregated")
+
+    def _upsert_df(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        db_conn: sqlite3.Connection | None = None,
+    ) -> None:
+        """
+        Insert a dataframe into the database, replacing rows with conflicting keys.
+        """
+        db_conn = db_conn or self.db_conn
+
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join(["?"] * len(df.columns))
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False)
+
+        with self._writing(db_conn):
+            db_conn.executemany(
+                f"INSERT OR REPLACE INTO {table_name} ({columns}) "
+                f"VALUES ({placeholders})",
+                rows,
+            )
+
+    @_synchronized
+    def get_journal_states(
+        self, paths: list[str], system_id: str = DEFAULT_SYSTEM_ID
+    ) -> dict[str, str]:
+        """
+        Get the journaled states of the chart file groups of the PV system `system_id`
+        identified by `paths`. Groups never journaled are left out.
+        """
+        self._create_journal_table(self.db_conn.cursor())
+
+        rows = self.db_conn.execute(
+            "SELECT path, state FROM ingest_journal WHERE system_id = ?", (system_id,)
+        )
+        paths = set(paths)
+
+        return {path: state for path, state in rows if path in paths}
+
+    @_synchronized
+    def set_journal_state(
+        self,
+        paths: list[str],
+        state: str,
+        system_id: str = DEFAULT_SYSTEM_ID,
+        error: str | None = None,
+    ) -> None:
+        """
+        Record that the chart file groups of the PV system `system_id` identified by
+        `paths` reached `state`, along with the `error` that got them quarantined.
+        """
+        if state not in JOURNAL_STATES:
+            raise ValueError(f"Unknown journal state {state}.")
+
+        self._create_journal_table(self.db_conn.cursor())
+        updated_at = time.time()
+
+        with self._writing(self.db_conn):
+            self.db_conn.executemany(
+                "INSERT OR REPLACE INTO ingest_journal "
+                "(path, system_id, state, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(path, system_id, state, error, updated_at) for path in paths],
+            )
+
+    @_synchronized
+    def incremental_vacuum(self, pages: int | None = None) -> None:
+        """
+        Return up to `pages` free pages (all if None) of the DB and its opened shards
+        to the file system. Only has an effect on DBs with incremental auto-vacuum,
+        i.e. those created by this class or converted by
+        `convert_to_incremental_vacuum`.
+        """
+        command = "PRAGMA incremental_vacuum" + (f"({pages})" if pages else "")
+
+        # Run as a script, as executing the pragma as a statement only frees a single
+        # page.
+        for db_conn in [self.db_conn, *self._shard_conns.values()]:
+            db_conn.executescript(command)
+
+    @_synchronized
+    def convert_to_incremental_vacuum(self) -> list[str]:
         """
-        Insert data into the  table.
+        Switch the DB and its writable shards created without incremental auto-vacuum
+        over to it. The setting only takes effect on existing files once they are
+        rebuilt by a full VACUUM, which takes a while on big files, but is only needed
+        once. Returns the paths of the converted files.
         """
-        self._insert_df(daily_agg_df, "daily_aggregated")
+        conns = {self.db_path: self.db_conn}
+
+        for year in self.get_shard_years():
+            shard_path = self.get_shard_path(year)
+
+            if not _is_frozen(shard_path):
+                conns[shard_path] = self._get_shard_conn(year)
+
+        converted = []
+        for path, db_conn in conns.items():
+            # 2 means incremental.
+            if db_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+
+            LOGGER.info("Converting %s to incremental auto-vacuum...", path)
+
+            db_conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            db_conn.execute("VACUUM")
+            converted.append(path)
+
+        return converted
+
+    @_synchronized
+    def set_pragmas(self, pragmas: dict[str, int]) -> None:
+        """
+        Set the integer valued `pragmas`, e.g. `cache_size`, on the connections to the
+        DB and its opened shards, and on those to shards opened later on.
+        """
+        self._pragmas = dict(pragmas)
+
+        for db_conn in [self.db_conn, *self._shard_conns.values()]:
+            _set_pragmas(db_conn, self._pragmas)
+
+    @_synchronized
+    def close(self) -> None:
+        """
+        Close the connections to the DB and all opened shards.
+        """
+        for shard_conn in self._shard_conns.values():
+            shard_conn.close()
+
+        self._shard_conns = {}
+        self.db_conn.close()
@@ -0,0 +1,139 @@
+"""
+Write raw data files safely, and verify them when reading them back.
+"""
+
+import hashlib
+import os
+
+from typing import Iterable
+
+CHECKSUM_SUFFIX = ".sha256"
+
+
+def checksum_path(path: str) -> str:
+    """
+    Get the path of the sidecar file holding the checksum of the file at `path`.
+    """
+    return path + CHECKSUM_SUFFIX
+
+
+def _read_checksums(path: str) -> list[str]:
+    """
+    Read the checksums listed in the sidecar of the file at `path`, the one of its
+    current content first. Returns an empty list if there is no sidecar.
+    """
+    try:
+        with open(checksum_path(path), "rb") as infile:
+            return infile.read().decode().split()
+
+    except FileNotFoundError:
+        return []
+
+
+def _as_chunks(content: str | bytes | Iterable[bytes]) -> Iterable[bytes]:
+    """
+    Turn the content of a file into the chunks it gets written in.
+    """
+    if isinstance(content, str):
+        return [content.encode("UTF-8")]
+
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return [content]
+
+    return content
+
+
+def _stream_to_file(path: str, chunks: Iterable[bytes]) -> str:
+    """
+    Write `chunks` to the file at `path` one by one, and fsync it. Returns the SHA-256
+    checksum of everything written.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "wb") as outfile:
+        for chunk in chunks:
+            digest.update(chunk)
+            outfile.write(chunk)
+
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    return digest.hexdigest()
+
+
+def write_files_atomically(
+    contents: dict[str, str | bytes | Iterable[bytes]], checksums: bool = True
+) -> None:
+    """
+    Write the contents of a dict mapping file paths to their contents, each alongside
+    a sidecar holding its SHA-256 checksum unless `checksums` is False. Contents may
+    also be given as iterables of chunks, which are streamed to disk rather than held
+    in memory at once. Everything is first written and fsynced to temporary files,
+    which only get renamed to their final paths once all writes succeeded, so neither
+    a crash nor a concurrent reader ever sees a truncated file.
+
+    Sidecars get renamed into place before their files, and also list the checksum of
+    the content a file replaces, so a crash in between leaves a file matching its
+    sidecar either way.
+    """
+    tmp_files = {}
+
+    try:
+        for path, content in contents.items():
+            tmp_files[path] = path + ".tmp"
+            checksum = _stream_to_file(tmp_files[path], _as_chunks(content))
+
+            if checksums:
+                previous = _read_checksums(path)[:1] if os.path.exists(path) else []
+                sidecar_path = checksum_path(path)
+                tmp_files[sidecar_path] = sidecar_path + ".tmp"
+                _stream_to_file(
+                    tmp_files[sidecar_path],
+                    ["\n".join([checksum, *previous]).encode()],
+                )
+
+        for path in sorted(
+            tmp_files, key=lambda path: not path.endswith(CHECKSUM_SUFFIX)
+        ):
+            os.replace(tmp_files[path], path)
+
+        # Persist the renames themselves.
+        for dir_path in {os.path.dirname(path) or "." for path in tmp_files}:
+            dir_fd = os.open(dir_path, os.O_RDONLY)
+
+            try:
+                os.fsync(dir_fd)
+
+            finally:
+                os.close(dir_fd)
+
+    finally:
+        for tmp_path in tmp_files.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def read_verified(path: str) -> bytes:
+    """
+    Read the file at `path`, checking it against its checksum sidecar if there is one.
+    Files written before checksums were introduced have none and are read as is.
+    Content matching the checksum of what the file replaced is accepted too, see
+    `write_files_atomically`.
+    """
+    with open(path, "rb") as infile:
+        content = infile.read()
+
+    expected = _read_checksums(path)
+
+    if not expected:
+        return content
+
+    actual = hashlib.sha256(content).hexdigest()
+
+    if actual not in expected:
+        raise ValueError(
+            f"Checksum of {path} doesn't match its sidecar, the file is corrupt "
+            f"(expected {expected[0]}, got {actual})."
+        )
+
+    return content
@@ -2,15 +2,38 @@
 Manage the App's correspondence with Fronius Solarweb.
 """
 
+import asyncio
+import json
+import os
 import re
+import threading
+import time
 from bs4 import BeautifulSoup as bs
 import urllib.parse as ulparse
+import httpx
 import requests as rq
 
-from radiant_net_scraper.config import get_configured_logger, get_fronius_secrets
+from radiant_net_scraper.config import (
+    DEFAULT_SYSTEM_ID,
+    Config,
+    get_configured_logger,
+    get_fronius_secrets,
+    get_session_cookie_path,
+)
+from radiant_net_scraper.metrics import count_bytes, timed
+from radiant_net_scraper.rate_limit import TokenBucket
+from radiant_net_scraper.resilience import (
+    CircuitBreaker,
+    RequestStats,
+    RetryPolicy,
+    async_call_with_retries,
+    call_with_retries,
+)
 
 LOGGER = get_configured_logger(__name__)
 
+CHART_INTERVALS = ("day", "month", "year")
+
 
 class _FroniusSession:
     """Class resonsible for managing the entire correspondence with fronius."""
@@ -21,24 +44,165 @@ class _FroniusSession:
     chart_url = "https://www.solarweb.com/Chart/GetChartNew"
     key_pattern = re.compile(r"(?<=&sessionDataKey=)[a-z0-9\-]*")
 
-    def __init__(self, user, password, fronius_id):
+    def __init__(
+        self,
+        user,
+        password,
+        fronius_id,
+        cookie_path: str | None = None,
+        rate_limiter: TokenBucket | None = None,
+        pool_size: int = 10,
+        timeout: tuple[float, float] = (10, 30),
+        retry_policy: RetryPolicy | None = None,
+        breaker: CircuitBreaker | None = None,
+    ):
         self.session = rq.Session()
+        # Size the connection pool so concurrent chart requests don't queue for or
+        # discard connections.
+        adapter = rq.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
         self.key_pattern = re.compile(r"(?<=&sessionDataKey=)[a-z0-9\-]*")
         self.session_key = None
         self.secret = {"username": user, "password": password, "id": fronius_id}
+        self.validated_at = None
+        self.cookie_path = cookie_path
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker
+        self.stats = RequestStats()
+        self._login_lock = threading.Lock()
+
+        if self.load_cookies():
+            # Don't check the restored cookies now, `get_chart` logs in again should
+            # they be rejected.
+            LOGGER.info("Restored Solarweb session from %s.", self.cookie_path)
+            self.mark_valid()
+            return
 
         LOGGER.info("Logging into Fronius Solarweb at %s...", self.landing_url)
         self.login()
+        self.mark_valid()
         LOGGER.info("... done logging in.")
 
+    def save_cookies(self) -> None:
+        """
+        Save the session's cookies and key to `cookie_path`, readable only by the
+        current user, so later processes can skip logging in.
+        """
+        if self.cookie_path is None:
+            return
+
+        cookie_dir = os.path.dirname(self.cookie_path)
+
+        if cookie_dir and not os.path.exists(cookie_dir):
+            os.makedirs(cookie_dir, mode=0o700)
+
+        session_state = {
+            "username": self.secret["username"],
+            "session_key": self.session_key,
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                    "secure": cookie.secure,
+                }
+                for cookie in self.session.cookies
+            ],
+        }
+
+        tmp_path = self.cookie_path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        with os.fdopen(fd, "w", encoding="UTF-8") as outfile:
+            json.dump(session_state, outfile)
+
+        os.replace(tmp_path, self.cookie_path)
+
+        LOGGER.debug("Saved session cookies to %s.", self.cookie_path)
+
+    def load_cookies(self) -> bool:
+        """
+        Load cookies and key saved by `save_cookies` into the session. Returns whether
+        there was anything usable to load.
+        """
+        if self.cookie_path is None or not os.path.exists(self.cookie_path):
+            return False
+
+        try:
+            with open(self.cookie_path, encoding="UTF-8") as infile:
+                session_state = json.load(infile)
+
+            if session_state["username"] != self.secret["username"]:
+                LOGGER.info(
+                    "Saved session at %s belongs to a different user, ignoring it.",
+                    self.cookie_path,
+                )
+                return False
+
+            for cookie in session_state["cookies"]:
+                self.session.cookies.set(**cookie)
+
+            self.session_key = session_state["session_key"]
+
+        except (ValueError, KeyError, TypeError) as e:
+            LOGGER.warning(
+                "Couldn't load saved session from %s, ignoring it: %s",
+                self.cookie_path,
+                e,
+            )
+            self.session.cookies.clear()
+            return False
+
+        return bool(session_state["cookies"])
+
+    def _request(self, method: str, url: str, **kwargs) -> rq.Response:
+        """
+        Make a request through the session, with a (connect, read) timeout, retrying
+        transient failures and backing off while Solarweb seems to be down.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        return call_with_retries(
+            lambda: self.session.request(method, url, **kwargs),
+            self.retry_policy,
+            breaker=self.breaker,
+            stats=self.stats,
+        )
+
+    def mark_valid(self) -> None:
+        """
+        Remember that the session was just confirmed to be logged in.
+        """
+        self.validated_at = time.monotonic()
+
+    def is_fresh(self, ttl: float) -> bool:
+        """
+        Check whether the session was confirmed to be logged in within the last `ttl`
+        seconds, in which case it is assumed to still be valid.
+        """
+        return (
+            self.validated_at is not None and time.monotonic() - self.validated_at < ttl
+        )
+
     def is_logged_in(self) -> bool:
         """
         Check whether the session is logged in by requesting the landing page.
         When the request is redirected to the page of the personal PV system, everything
         is fine.
         """
-        landig_page_resp = self.session.get(url=self.landing_url)
+        return self._is_logged_in_response(self._request("GET", self.landing_url))
 
+    def _is_logged_in_response(
+        self, landig_page_resp: rq.Response | httpx.Response
+    ) -> bool:
+        """
+        Check whether the response to requesting the landing page shows the session
+        to be logged in, see `is_logged_in`.
+        """
         landig_page_resp.raise_for_status()
 
         if len(landig_page_resp.history) < 2:
@@ -46,7 +210,7 @@ class _FroniusSession:
             return False
 
         try:
-            query = ulparse.urlparse(landig_page_resp.url).query
+            query = ulparse.urlparse(str(landig_page_resp.url)).query
             page_pv = query.split("=")[1]
 
         except Exception as e:
@@ -57,6 +221,7 @@ class _FroniusSession:
 
         return page_pv == self.secret["id"]
 
+    @timed("login")
     def login(self):
         """Get all necessary data and cookies to perform all operations."""
 
@@ -65,11 +230,11 @@ class _FroniusSession:
             "Getting request verification token by visiting the landing page at %s...",
             self.landing_url,
         )
-        _ = self.session.get(url=self.landing_url)
+        _ = self._request("GET", self.landing_url)
 
         try:
             LOGGER.debug("Attempting to retrieve log-in page at %s...", self.login_url)
-            login_page_resp = self.session.get(self.login_url, allow_redirects=True)
+            login_page_resp = self._request("GET", self.login_url, allow_redirects=True)
             login_page_resp.raise_for_status()
 
         except rq.ConnectionError as e:
@@ -98,8 +263,9 @@ class _FroniusSession:
             "Filling and submitting login form to %s...", self.login_form_post_url
         )
 
-        login_form_resp = self.session.post(
-            url=self.login_form_post_url,
+        login_form_resp = self._request(
+            "POST",
+            self.login_form_post_url,
             data={
                 "username": self.secret["username"],
                 "password": self.secret["password"],
@@ -138,75 +304,411 @@ class _FroniusSession:
             "URL..."
         )
         # We only care about getting the cookies.
-        _ = self.session.post(url=callback_url, data=login_params)
+        _ = self._request("POST", callback_url, data=login_params)
 
         if self.is_logged_in():
             LOGGER.info("Login successfull!")
+            self.save_cookies()
         else:
             raise ValueError(
                 "Something went wrong during the last phase of the login. "
                 "Has something changed at Solarweb?"
             )
 
-    def chart_data(self, fronius_id, date, view: str = "production") -> dict:
+    def close(self) -> None:
+        """
+        Close the connections of the session. Its cookies stay saved, so a later
+        session can pick up where this one left off.
+        """
+        self.session.close()
+
+    def chart_data(
+        self, fronius_id, date, view: str = "production", interval: str = "day"
+    ) -> dict:
         """
-        Construct a dict of values needed to retrieve the daily generation & usage chart
-        from fronius. Use `view` to specify either "production" or "consumption".
+        Construct a dict of values needed to retrieve the generation & usage chart
+        from fronius. Use `view` to specify either "production" or "consumption", and
+        `interval` to get the chart of the "day", "month" or "year" containing `date`.
         """
+        if interval not in CHART_INTERVALS:
+            raise ValueError(
+                f"Unknown chart interval {interval}, use one of {CHART_INTERVALS}."
+            )
+
         return {
             "pvSystemId": fronius_id,
             "year": date.year,
             "month": date.month,
             "day": date.day,
-            "interval": "day",
+            "interval": interval,
             "view": view,
         }
 
-    def get_chart(self, date, chart_type: str = "production") -> dict:
+    @timed("get_chart")
+    def get_chart(
+        self,
+        date,
+        chart_type: str = "production",
+        fronius_id: str | None = None,
+        interval: str = "day",
+        raw: bool = False,
+    ) -> dict | bytes:
         """
-        Retrieve the daily generation & usage chart from fronius. See `chart_data` for
-        values of `chart_type`.
+        Retrieve the generation & usage chart from fronius. See `chart_data` for
+        values of `chart_type` and `interval`. `fronius_id` selects the PV system for
+        accounts with multiple systems, by default the one the session was created for
+        is used. With `raw`, the undecoded JSON body is returned, for when it only
+        gets saved anyway.
         """
         LOGGER.debug(
-            "Retrieving daily %s statistics data from %s...",
+            "Retrieving %s %s statistics data from %s...",
+            interval,
             chart_type,
             self.chart_url,
         )
 
-        chart_resp = self.session.get(
-            url=self.chart_url,
+        fronius_id = fronius_id or self.secret["id"]
+        requested_at = self.validated_at
+
+        chart = self._request_chart(date, chart_type, fronius_id, interval, raw)
+
+        if chart is None:
+            self.login_again(requested_at)
+            chart = self._request_chart(date, chart_type, fronius_id, interval, raw)
+
+            if chart is None:
+                raise ValueError(
+                    f"Couldn't retrieve {interval} {chart_type} chart for {date} "
+                    f"even after logging in again. Has something changed at Solarweb?"
+                )
+
+        # A chart getting through is as good a proof of being logged in as any.
+        self.mark_valid()
+
+        return chart
+
+    def revalidate(self, ttl: float) -> None:
+        """
+        Make sure the session is logged in, unless it was confirmed within the last
+        `ttl` seconds. Like with `login_again`, concurrent callers finding the session
+        stale at once wait for the first of them to check, and log in if needed.
+        """
+        if self.is_fresh(ttl):
+            return
+
+        with self._login_lock:
+            # Confirmed by another caller while waiting for the lock.
+            if self.is_fresh(ttl):
+                return
+
+            if not self.is_logged_in():
+                self.login()
+
+            self.mark_valid()
+
+    def login_again(self, requested_at: float | None) -> None:
+        """
+        Log in again after a chart request made while the session was last confirmed
+        at `requested_at` got rejected. Concurrent requests all notice the expiry, only
+        the first of them logs in.
+        """
+        with self._login_lock:
+            if self.validated_at == requested_at:
+                LOGGER.info(
+                    "Chart request was rejected, the session seems to have expired. "
+                    "Logging in again..."
+                )
+                self.login()
+                self.mark_valid()
+
+    def _request_chart(
+        self,
+        date,
+        chart_type: str,
+        fronius_id: str,
+        interval: str = "day",
+        raw: bool = False,
+    ) -> dict | bytes | None:
+        """
+        Request a chart, returning None if the response indicates the session is no
+        longer logged in, i.e. if it got redirected (to the login page) or does not
+        contain JSON. With `raw`, the body is only checked to look like a JSON object
+        rather than decoded, full validation is left to the parser.
+        """
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire()
+
+            if waited:
+                LOGGER.debug("Waited %.2fs for the rate limit.", waited)
+
+        chart_resp = self._request(
+            "GET",
+            self.chart_url,
             data=self.chart_data(
-                fronius_id=self.secret["id"], date=date, view=chart_type
+                fronius_id=fronius_id, date=date, view=chart_type, interval=interval
             ),
         )
 
-        # TODO Add handling of case that chart_resp doesn't contain json.
-        return chart_resp.json()
+        return self._chart_from_response(chart_resp, raw)
+
+    def _chart_from_response(
+        self, chart_resp: rq.Response | httpx.Response, raw: bool = False
+    ) -> dict | bytes | None:
+        """
+        Get the chart from the response to a chart request, see `_request_chart`.
+        """
+        if chart_resp.history or chart_resp.status_code in (401, 403):
+            LOGGER.debug(
+                "Chart request ended at %s with status %s.",
+                chart_resp.url,
+                chart_resp.status_code,
+            )
+            return None
+
+        chart_resp.raise_for_status()
+        count_bytes("get_chart", len(chart_resp.content))
+
+        if raw:
+            if not chart_resp.content.lstrip().startswith(b"{"):
+                LOGGER.debug("Chart response from %s is not JSON.", chart_resp.url)
+                return None
+
+            return chart_resp.content
+
+        try:
+            return chart_resp.json()
+
+        except ValueError:
+            LOGGER.debug("Chart response from %s is not JSON.", chart_resp.url)
+            return None
 
 
 class FroniusSession:
     """
-    Singleton wrapper around the Fronius session to always have a single, pre-config'd
-    session.
+    Wrapper around a pool of Fronius sessions to always have a single, pre-config'd
+    session per account.
     """
 
-    _session = None
+    _sessions: dict[str, _FroniusSession] = {}
+    _lock = threading.Lock()
 
     @classmethod
-    def get_session(cls):
+    def get_session(cls, system: dict | None = None) -> _FroniusSession:
         """
-        Getter for the single session object.
+        Getter for the session of the account of `system` (as returned by
+        `get_fronius_systems`), by default of the account in the `secrets` config.
+        Each account gets its own session and rate limit.
         """
-        if cls._session is None:
+        if system is None:
             secrets = get_fronius_secrets()
+            system = {"name": DEFAULT_SYSTEM_ID, **secrets}
+
+        account = system["username"]
+
+        # Keep concurrent callers from logging into the same account twice.
+        with cls._lock:
+            if account not in cls._sessions:
+                scraping_config = Config.get_config()["scraping"]
+                requests_config = Config.get_config()["requests"]
+
+                cls._sessions[account] = _FroniusSession(
+                    user=system["username"],
+                    password=system["password"],
+                    fronius_id=system["fronius-id"],
+                    cookie_path=get_session_cookie_path(account),
+                    rate_limiter=TokenBucket(
+                        rate=scraping_config.getfloat("requests_per_second"),
+                        capacity=scraping_config.getfloat("burst"),
+                    ),
+                    # At least one connection per chart type of a day.
+                    pool_size=max(scraping_config.getint("max_workers"), 2),
+                    timeout=(
+                        requests_config.getfloat("connect_timeout_seconds"),
+                        requests_config.getfloat("read_timeout_seconds"),
+                    ),
+                    retry_policy=RetryPolicy(
+                        max_retries=requests_config.getint("max_retries"),
+                        backoff_base=requests_config.getfloat("backoff_base_seconds"),
+                        backoff_max=requests_config.getfloat("backoff_max_seconds"),
+                    ),
+                    breaker=CircuitBreaker(
+                        failure_threshold=requests_config.getint(
+                            "breaker_failure_threshold"
+                        ),
+                        reset_timeout=requests_config.getfloat("breaker_reset_seconds"),
+                    ),
+                )
+
+        session = cls._sessions[account]
+
+        # Checking costs a round trip, so only do it once the last confirmation is
+        # older than the TTL. Should the session expire in between, `get_chart` notices
+        # and logs in again.
+        session.revalidate(
+            Config.get_config()["session"].getfloat("validity_ttl_seconds")
+        )
+
+        return session
+
+    @classmethod
+    def close_all(cls) -> None:
+        """
+        Close and forget the sessions of all accounts.
+        """
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
 
-            cls._session = _FroniusSession(
-                user=secrets["username"],
-                password=secrets["password"],
-                fronius_id=secrets["fronius-id"],
+            cls._sessions = {}
+
+
+class AsyncFroniusSession:
+    """
+    Asyncio counterpart of `_FroniusSession`, mirroring its API. Requests are made
+    natively on the event loop by an httpx client, which shares the cookie jar of a
+    regular session, and with it the login state, as well as its rate limit, retries
+    and circuit breaker. At most `max_concurrency` requests are in flight at once, over
+    a connection pool of the same size. Logging in is left to the regular session and
+    run in a thread, as it only happens once in a while.
+    """
+
+    def __init__(
+        self,
+        session: _FroniusSession,
+        max_concurrency: int = 256,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.sync_session = session
+        self.max_concurrency = max_concurrency
+        self.client = httpx.AsyncClient(
+            cookies=session.session.cookies,
+            headers=dict(session.session.headers),
+            timeout=httpx.Timeout(session.timeout[1], connect=session.timeout[0]),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            follow_redirects=True,
+            transport=transport,
+        )
+        # Created lazily, so they belong to the running loop.
+        self._semaphore = None
+        self._login_lock = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        See `_FroniusSession._request`.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            return await async_call_with_retries(
+                lambda: self.client.request(method, url, **kwargs),
+                self.sync_session.retry_policy,
+                breaker=self.sync_session.breaker,
+                stats=self.sync_session.stats,
+            )
+
+    async def login(self) -> None:
+        """
+        See `_FroniusSession.login`.
+        """
+        await asyncio.to_thread(self.sync_session.login)
+
+    async def is_logged_in(self) -> bool:
+        """
+        See `_FroniusSession.is_logged_in`.
+        """
+        landing_page_resp = await self._request("GET", self.sync_session.landing_url)
+
+        return self.sync_session._is_logged_in_response(landing_page_resp)
+
+    @timed("get_chart")
+    async def get_chart(
+        self,
+        date,
+        chart_type: str = "production",
+        fronius_id: str | None = None,
+        interval: str = "day",
+        raw: bool = False,
+    ) -> dict | bytes:
+        """
+        See `_FroniusSession.get_chart`.
+        """
+        fronius_id = fronius_id or self.sync_session.secret["id"]
+        requested_at = self.sync_session.validated_at
+
+        chart = await self._request_chart(date, chart_type, fronius_id, interval, raw)
+
+        if chart is None:
+            if self._login_lock is None:
+                self._login_lock = asyncio.Lock()
+
+            # Keep the coroutines noticing the expiry from tying up a thread each.
+            async with self._login_lock:
+                await asyncio.to_thread(self.sync_session.login_again, requested_at)
+
+            chart = await self._request_chart(
+                date, chart_type, fronius_id, interval, raw
+            )
+
+            if chart is None:
+                raise ValueError(
+                    f"Couldn't retrieve {interval} {chart_type} chart for {date} "
+                    f"even after logging in again. Has something changed at Solarweb?"
+                )
+
+        self.sync_session.mark_valid()
+
+        return chart
+
+    async def _request_chart(
+        self,
+        date,
+        chart_type: str,
+        fronius_id: str,
+        interval: str = "day",
+        raw: bool = False,
+    ) -> dict | bytes | None:
+        """
+        See `_FroniusSession._request_chart`.
+        """
+        if self.sync_session.rate_limiter is not None:
+            waited = await self.sync_session.rate_limiter.acquire_async()
+
+            if waited:
+                LOGGER.debug("Waited %.2fs for the rate limit.", waited)
+
+        chart_resp = await self._request(
+            "GET",
+            self.sync_session.chart_url,
+            data=self.sync_session.chart_data(
+                fronius_id=fronius_id, date=date, view=chart_type, interval=interval
+            ),
+        )
+
+        return self.sync_session._chart_from_response(chart_resp, raw)
+
+    async def close(self) -> None:
+        """
+        Close the connections of the client. The regular session stays open.
+        """
+        await self.client.aclose()
+
+    @classmethod
+    async def get_session(
+        cls, system: dict | None = None, max_concurrency: int | None = None
+    ) -> "AsyncFroniusSession":
+        """
+        Get an async session sharing the state of the pre-config'd session of the
+        account of `system`, see `FroniusSession.get_session`.
+        """
+        if max_concurrency is None:
+            max_concurrency = Config.get_config()["scraping"].getint(
+                "async_max_concurrency"
             )
 
-        if not cls._session.is_logged_in():
-            cls._session.login()
+        session = await asyncio.to_thread(FroniusSession.get_session, system)
 
-        return cls._session
+        return cls(session, max_concurrency=max_concurrency)
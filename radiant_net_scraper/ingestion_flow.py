@@ -2,36 +2,465 @@
 Run the full flow of a day's scraping and ingestion into the database.
 """
 
+import asyncio
+import signal
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
 from dataclasses import astuple
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
+from apscheduler.events import EVENT_JOB_ERROR, JobExecutionEvent
+from apscheduler.schedulers.base import BaseScheduler
 from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
 
+from radiant_net_scraper.backup import run_backup
+from radiant_net_scraper.config import (
+    Config,
+    get_chosen_data_path,
+    get_chosen_db_sharding,
+    get_chosen_raw_data_path,
+    get_configured_logger,
+    get_fronius_systems,
+)
+from radiant_net_scraper.context import AppContext
 from radiant_net_scraper.data_parser import parse_json_data_from_file_pair_list
-from radiant_net_scraper.scrape import run_scraper
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.intraday import refresh_intraday
+from radiant_net_scraper.metrics import start_metrics_server
+from radiant_net_scraper.pipeline import run_pipeline
+from radiant_net_scraper.planner import find_gaps, plan_scrape
+from radiant_net_scraper.retention import run_retention
+from radiant_net_scraper.scrape import (
+    async_run_scraper_range,
+    system_output_dir,
+)
+
+LOGGER = get_configured_logger(__name__)
+
+
+def ingest_system_day(
+    system: dict,
+    scraping_kwargs: dict | None = None,
+    parsing_kwargs: dict | None = None,
+    db_handler: Database | None = None,
+) -> None:
+    """
+    Ingest the data of a single PV system from `days_ago`, as well as that of any
+    missing or incomplete days of the `lookback_days` before it, save the raw data,
+    and insert processed data into the app's DB. Days already stored completely are
+    skipped, the others are run through the ingestion pipeline. Without a
+    `db_handler`, the DB given by `parsing_kwargs` is opened for the occasion.
+    """
+    scraping_kwargs = dict(scraping_kwargs or {})
+    parsing_kwargs = parsing_kwargs or {}
+    scraping_config = Config.get_config()["scraping"]
+
+    output_dir = (
+        scraping_kwargs.pop("output_dir", None) or get_chosen_raw_data_path() + "/"
+    )
+    system_dir = system_output_dir(output_dir, system)
+    close_db = db_handler is None
+
+    if close_db:
+        db_handler = Database(
+            db_path=parsing_kwargs.get("db_path", get_chosen_data_path()),
+            shard_by_year=parsing_kwargs.get("shard_by_year", get_chosen_db_sharding()),
+        )
+
+    try:
+        dates = plan_scrape(
+            system_dir,
+            db_handler,
+            days_ago=scraping_kwargs.pop("days_ago", 1),
+            lookback_days=scraping_kwargs.pop(
+                "lookback_days", scraping_config.getint("lookback_days")
+            ),
+            system_id=system["name"],
+        )
+
+        if dates:
+            run_pipeline(
+                dates,
+                db_handler,
+                output_dir=output_dir,
+                system=system,
+                **scraping_kwargs,
+            )
+
+    finally:
+        if close_db:
+            db_handler.close()
 
 
 def ingest_day(
-    scraping_kwargs: dict | None = None, parsing_kwargs: dict | None = None
+    scraping_kwargs: dict | None = None,
+    parsing_kwargs: dict | None = None,
+    systems: list[dict] | None = None,
+    db_handler: Database | None = None,
+) -> None:
+    """
+    Ingest the data from `days_ago` of all configured PV systems (or of `systems`),
+    save the raw data, and insert processed data into the app's DB (or `db_handler`).
+    Systems are ingested concurrently, each account being subject to its own rate
+    limit.
+    """
+    if systems is None:
+        systems = get_fronius_systems()
+
+    with ThreadPoolExecutor(max_workers=len(systems)) as executor:
+        futures = {
+            executor.submit(
+                ingest_system_day, system, scraping_kwargs, parsing_kwargs, db_handler
+            ): system["name"]
+            for system in systems
+        }
+
+    failed = []
+    for future, system_name in futures.items():
+        try:
+            future.result()
+
+        except Exception as e:
+            LOGGER.error("Failed to ingest PV system %s: %s", system_name, e)
+            failed.append(system_name)
+
+    if failed:
+        raise RuntimeError(f"Failed to ingest PV systems {', '.join(failed)}.")
+
+
+def catch_up_system(
+    system: dict,
+    db_handler: Database,
+    output_dir: str,
+    max_days: int,
+    max_workers: int,
 ) -> None:
     """
-    Ingest the data from `days_ago`, save the raw data, and insert processed data
-    into the app's DB.
+    Ingest the days missing from the DB for a single PV system, going back at most
+    `max_days` days, using `max_workers` fetchers.
+    """
+    dates = find_gaps(db_handler, system["name"], max_days=max_days)
+
+    if dates:
+        run_pipeline(
+            dates,
+            db_handler,
+            output_dir=output_dir,
+            system=system,
+            max_workers=max_workers,
+        )
+
+
+def catch_up(
+    systems: list[dict] | None = None,
+    db_handler: Database | None = None,
+    output_dir: str | None = None,
+    max_days: int | None = None,
+    max_workers: int | None = None,
+) -> None:
+    """
+    Ingest the days missing from the app's DB (or `db_handler`) for all configured PV
+    systems (or `systems`), e.g. those passed while the app wasn't running, going
+    back at most `max_days` days. Each system is caught up with only `max_workers`
+    fetchers, so a long backlog doesn't crowd out other jobs.
+    """
+    schedule_config = Config.get_config()["schedule"]
+
+    if systems is None:
+        systems = get_fronius_systems()
+
+    if output_dir is None:
+        output_dir = get_chosen_raw_data_path() + "/"
+
+    if max_days is None:
+        max_days = schedule_config.getint("catch_up_max_days")
+
+    if max_workers is None:
+        max_workers = schedule_config.getint("catch_up_workers")
+
+    close_db = db_handler is None
+
+    if close_db:
+        db_handler = Database(
+            db_path=get_chosen_data_path(), shard_by_year=get_chosen_db_sharding()
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(systems)) as executor:
+            futures = {
+                executor.submit(
+                    catch_up_system,
+                    system,
+                    db_handler,
+                    output_dir,
+                    max_days,
+                    max_workers,
+                ): system["name"]
+                for system in systems
+            }
+
+    finally:
+        if close_db:
+            db_handler.close()
+
+    failed = []
+    for future, system_name in futures.items():
+        try:
+            future.result()
+
+        except Exception as e:
+            LOGGER.error("Failed to catch up on PV system %s: %s", system_name, e)
+            failed.append(system_name)
+
+    if failed:
+        raise RuntimeError(f"Failed to catch up on PV systems {', '.join(failed)}.")
+
+
+async def async_ingest_days(
+    start: date,
+    end: date,
+    scraping_kwargs: dict | None = None,
+    parsing_kwargs: dict | None = None,
+    systems: list[dict] | None = None,
+) -> None:
+    """
+    Async version of `ingest_day` for all days from `start` to `end` (both
+    inclusive). Charts of all systems are fetched concurrently on the event loop, the
+    parsing is run in a thread so it doesn't block the loop.
     """
     scraping_kwargs = scraping_kwargs or {}
     parsing_kwargs = parsing_kwargs or {}
 
-    output_group = run_scraper(**scraping_kwargs)
-    parse_json_data_from_file_pair_list([output_group], **parsing_kwargs)
+    if systems is None:
+        systems = get_fronius_systems()
+
+    async def ingest_system(system: dict) -> None:
+        output_groups = await async_run_scraper_range(
+            start, end, system=system, **scraping_kwargs
+        )
+        await asyncio.to_thread(
+            parse_json_data_from_file_pair_list,
+            output_groups,
+            system_id=system["name"],
+            **parsing_kwargs,
+        )
+
+    await asyncio.gather(*[ingest_system(system) for system in systems])
 
 
 def run_ingestion_continuously() -> None:
     """
-    Use a scheduler to periodically run scraping and ingestion.
+    Use a scheduler to periodically run scraping and ingestion. All jobs share the
+    DB connection and sessions of one `AppContext`, which gets closed once the
+    scheduler is shut down, e.g. by SIGTERM. The config gets reloaded once its files
+    change, or on SIGHUP, and applied without restarting. If enabled, metrics are
+    served over HTTP while running.
+    """
+    with AppContext() as context:
+        metrics_server = None
+
+        if context.config["metrics"].getboolean("enabled"):
+            metrics_server = start_metrics_server()
+
+        context.warm_up()
+
+        scheduler = BlockingScheduler()
+        schedule_jobs(scheduler, context)
+
+        applied = {"config": context.config}
+
+        def apply_config(config: ConfigParser) -> None:
+            apply_schedule(scheduler, context, config, previous=applied["config"])
+            applied["config"] = config
+
+        Config.subscribe(apply_config)
+        shutdown_threads = []
+
+        def shut_down(signum: int, _) -> None:
+            LOGGER.info(
+                "Received signal %s, shutting down once running jobs are done...",
+                signal.Signals(signum).name,
+            )
+            # Not from within the handler, which might interrupt the scheduler while
+            # it holds its locks, and would block on the running jobs.
+            if not shutdown_threads:
+                shutdown_threads.append(threading.Thread(target=scheduler.shutdown))
+                shutdown_threads[0].start()
+
+        def reload_config(signum: int, _) -> None:
+            LOGGER.info(
+                "Received signal %s, reloading the config...",
+                signal.Signals(signum).name,
+            )
+            # Not from within the handler, which might interrupt the scheduler while
+            # it holds its locks.
+            threading.Thread(target=Config.reload, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shut_down)
+
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, reload_config)
+
+        try:
+            scheduler.start()
+
+        finally:
+            # Let running jobs finish before their context gets closed.
+            for thread in shutdown_threads:
+                thread.join()
+
+            Config.unsubscribe(apply_config)
+
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+
+
+def _section_changed(
+    config: ConfigParser, previous: ConfigParser | None, section: str
+) -> bool:
     """
-    scheduler = BlockingScheduler()
+    Check whether a section of the config differs from that of the `previous` one.
+    """
+    return previous is None or dict(config[section]) != dict(previous[section])
+
+
+def apply_schedule(
+    scheduler: BaseScheduler,
+    context: AppContext,
+    config: ConfigParser,
+    previous: ConfigParser | None = None,
+) -> None:
+    """
+    Add the recurring jobs enabled in `config` to `scheduler`, running them with the
+    resources of `context`. Given the `previous` config, only jobs whose settings
+    changed get rescheduled, and those disabled since get removed.
+    """
+    if _section_changed(config, previous, "schedule"):
+        schedule_config = config["schedule"]
+
+        # Run at the same local time every day, no matter when the app was started.
+        # Jitter keeps many installations from hitting Solarweb at the same second,
+        # and runs missed by less than the grace time (e.g. while suspended) still
+        # happen, but only once.
+        hour, minute = map(int, schedule_config["daily_time"].split(":"))
+
+        scheduler.add_job(
+            ingest_day,
+            trigger=CronTrigger(
+                hour=hour,
+                minute=minute,
+                jitter=schedule_config.getint("jitter_seconds"),
+            ),
+            id="ingest_day",
+            replace_existing=True,
+            coalesce=True,
+            misfire_grace_time=schedule_config.getint("misfire_grace_seconds"),
+            max_instances=1,
+            kwargs={
+                "scraping_kwargs": {"output_dir": context.raw_data_dir},
+                "systems": context.systems,
+                "db_handler": context.db,
+            },
+        )
+
+        scheduler.add_job(
+            Config.reload_if_changed,
+            trigger="interval",
+            seconds=schedule_config.getint("config_check_seconds"),
+            id="config_check",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+
+    periodic_jobs = {
+        "retention": (
+            run_retention,
+            {"minutes": config["retention"].getint("interval_minutes")},
+            {"db_handler": context.db},
+        ),
+        "intraday": (
+            refresh_intraday,
+            {"minutes": config["intraday"].getint("interval_minutes")},
+            {
+                "output_dir": context.raw_data_dir,
+                "systems": context.systems,
+                "db_handler": context.db,
+            },
+        ),
+        "backup": (
+            run_backup,
+            {"hours": config["backup"].getint("interval_hours")},
+            {},
+        ),
+    }
+
+    for job_id, (func, interval, kwargs) in periodic_jobs.items():
+        if not _section_changed(config, previous, job_id):
+            continue
+
+        if config[job_id].getboolean("enabled"):
+            # Never run alongside itself, each run only handles a bounded batch anyway.
+            scheduler.add_job(
+                func,
+                trigger="interval",
+                id=job_id,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                kwargs=kwargs,
+                **interval,
+            )
+
+        elif scheduler.get_job(job_id) is not None:
+            scheduler.remove_job(job_id)
+
+
+def schedule_jobs(scheduler: BaseScheduler, context: AppContext) -> None:
+    """
+    Add all jobs enabled in the config to `scheduler`, running them with the
+    resources of `context`.
+    """
+    # Fill in whatever was missed while the app wasn't running right away, instead
+    # of waiting for the first daily run, which only looks back a few days.
+    scheduler.add_job(
+        catch_up,
+        trigger="date",
+        run_date=datetime.now() + timedelta(seconds=5),
+        id="catch_up",
+        kwargs={
+            "systems": context.systems,
+            "db_handler": context.db,
+            "output_dir": context.raw_data_dir,
+        },
+    )
+
+    apply_schedule(scheduler, context, context.config)
+
+    def retry_failed_ingestion(event: JobExecutionEvent) -> None:
+        # Don't wait a whole day for the next attempt, transient failures are usually
+        # over within minutes.
+        if not event.job_id.startswith("ingest_day"):
+            return
+
+        retry_minutes = context.config["scraping"].getint("retry_failed_ingest_minutes")
 
-    later = datetime.now() + timedelta(seconds=5)
+        LOGGER.warning(
+            "Ingestion failed: %s. Retrying in %s minutes.",
+            event.exception,
+            retry_minutes,
+        )
+        scheduler.add_job(
+            ingest_day,
+            trigger="date",
+            run_date=datetime.now() + timedelta(minutes=retry_minutes),
+            id="ingest_day_retry",
+            replace_existing=True,
+            kwargs=scheduler.get_job("ingest_day").kwargs,
+        )
 
-    scheduler.add_job(ingest_day, trigger="interval", days=1, next_run_time=later)
-    scheduler.start()
+    scheduler.add_listener(retry_failed_ingestion, EVENT_JOB_ERROR)
@@ -0,0 +1,156 @@
+"""
+Keep today's data in the database up to date while the day is still ongoing.
+"""
+
+import datetime as dt
+
+from radiant_net_scraper.config import (
+    get_chosen_data_path,
+    get_chosen_db_sharding,
+    get_chosen_raw_data_path,
+    get_configured_logger,
+    get_fronius_systems,
+)
+from radiant_net_scraper.data_parser import (
+    group_is_paywalled,
+    load_chart_group,
+    merge_chart_group_data,
+    parse_chart_group_data,
+)
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.scrape import save_day_charts_to_files, system_output_dir
+from radiant_net_scraper.types import OutputDataFrames
+
+LOGGER = get_configured_logger(__name__)
+
+
+def scrape_day_data(
+    date: dt.date, output_dir: str, system: dict | None = None
+) -> OutputDataFrames | None:
+    """
+    Scrape the charts of `date`, save them as the day's latest snapshot, and parse
+    them. Returns None if the charts hold no data.
+    """
+    group = load_chart_group(save_day_charts_to_files(date, output_dir, system=system))
+
+    if group_is_paywalled(group):
+        LOGGER.warning("Charts of %s are paywalled, nothing to ingest.", date)
+        return None
+
+    return merge_chart_group_data(parse_chart_group_data(group))
+
+
+def insert_new_rows(
+    db_handler: Database, data: OutputDataFrames, date: dt.date, system_id: str
+) -> int:
+    """
+    Insert only those raw rows of `data` later than the latest already stored for
+    `date`. Returns the number of inserted rows.
+    """
+    latest = db_handler.get_latest_raw_time(date, system_id)
+    new_df = data.raw if latest is None else data.raw[data.raw["time"] > latest]
+
+    if not new_df.empty:
+        db_handler.insert_raw_data_df(new_df, system_id=system_id)
+
+    return len(new_df)
+
+
+def refresh_day(
+    db_handler: Database,
+    date: dt.date,
+    output_dir: str,
+    system: dict,
+    finalise: bool = False,
+) -> int:
+    """
+    Fetch the current charts of `date` for `system` and insert the raw rows added
+    since the last refresh. With `finalise`, i.e. once the day is over, its daily
+    aggregate gets inserted as well, in the same transaction as the last raw rows.
+    Returns the number of inserted raw rows.
+    """
+    data = scrape_day_data(date, system_output_dir(output_dir, system), system)
+
+    if data is None:
+        return 0
+
+    with db_handler.transaction():
+        n_new = insert_new_rows(db_handler, data, date, system["name"])
+
+        if finalise:
+            db_handler.insert_daily_agg_df(data.aggregated, system_id=system["name"])
+
+    LOGGER.info(
+        "Inserted %s new rows of %s for PV system %s.", n_new, date, system["name"]
+    )
+
+    if finalise:
+        LOGGER.info("Finalised %s for PV system %s.", date, system["name"])
+
+    return n_new
+
+
+def needs_finalising(db_handler: Database, date: dt.date, system_id: str) -> bool:
+    """
+    Check whether `date` was refreshed during the day, but not finalised afterwards.
+    """
+    if db_handler.get_latest_raw_time(date, system_id) is None:
+        return False
+
+    return date not in db_handler.get_daily_agg_days(date, date, system_id)
+
+
+def refresh_intraday(
+    output_dir: str | None = None,
+    systems: list[dict] | None = None,
+    today: dt.date | None = None,
+    db_path: str | None = None,
+    shard_by_year: bool | None = None,
+    db_handler: Database | None = None,
+) -> None:
+    """
+    Refresh today's data of all configured PV systems (or of `systems`). Should
+    yesterday have been refreshed but not yet finalised, that is done first, so the
+    day gets its complete data and daily aggregate right after it closes. Without a
+    `db_handler`, the DB at `db_path` is opened for the occasion.
+    """
+    if output_dir is None:
+        output_dir = get_chosen_raw_data_path() + "/"
+
+    if systems is None:
+        systems = get_fronius_systems()
+
+    today = today or dt.date.today()
+    yesterday = today - dt.timedelta(days=1)
+
+    close_db = db_handler is None
+
+    if close_db:
+        if db_path is None:
+            db_path = get_chosen_data_path()
+
+        if shard_by_year is None:
+            shard_by_year = get_chosen_db_sharding()
+
+        db_handler = Database(db_path=db_path, shard_by_year=shard_by_year)
+
+    try:
+        for system in systems:
+            try:
+                if needs_finalising(db_handler, yesterday, system["name"]):
+                    refresh_day(
+                        db_handler, yesterday, output_dir, system, finalise=True
+                    )
+
+                refresh_day(db_handler, today, output_dir, system)
+
+            except Exception as e:
+                LOGGER.error(
+                    "Failed to refresh intraday data of PV system %s: %s",
+                    system["name"],
+                    e,
+                )
+
+    finally:
+        if close_db:
+            db_handler.close()
@@ -0,0 +1,263 @@
+"""
+Queue days to ingest in an SQLite file, so several worker processes, even on different
+machines sharing a volume, can split a backfill between them.
+
+Workers claim a job by taking a lease on it, which they have to renew by heartbeats
+while working. Should a worker crash, its lease runs out, and the job gets claimed
+again by another one.
+"""
+
+import datetime as dt
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass
+from typing import Callable
+
+from radiant_net_scraper.config import get_configured_logger
+
+LOGGER = get_configured_logger(__name__)
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+
+@dataclass
+class Job:
+    """
+    A day of a PV system to ingest.
+    """
+
+    system_id: str
+    date: dt.date
+    attempts: int
+
+
+def default_worker_id() -> str:
+    """
+    Get an ID telling apart the workers of all processes on all machines.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """
+    Queue of days to ingest, kept in the SQLite file at `path`. Leases last
+    `lease_seconds`, jobs are given up on after failing `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._clock = clock
+
+        # Transactions are managed explicitly, so claims can take the write lock
+        # right away. Other processes wait for it instead of failing.
+        self.db_conn = sqlite3.connect(
+            path, isolation_level=None, timeout=60, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+
+        self.db_conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "system_id TEXT NOT NULL, "
+            "date TEXT NOT NULL, "
+            "state TEXT NOT NULL DEFAULT 'queued', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "worker TEXT, "
+            "lease_until REAL, "
+            "error TEXT, "
+            "updated_at REAL NOT NULL, "
+            "PRIMARY KEY (system_id, date))"
+        )
+
+    def _execute(self, command: str, params: tuple = ()) -> sqlite3.Cursor:
+        """
+        Execute a single command, which SQLite runs as a transaction of its own.
+        """
+        with self._lock:
+            return self.db_conn.execute(command, params)
+
+    def enqueue(self, dates: list[dt.date], system_id: str) -> int:
+        """
+        Queue the ingestion of `dates` of the PV system `system_id`. Days already
+        queued, running or done are left alone, failed ones are queued again. Returns
+        the number of queued days.
+        """
+        with self._lock:
+            self.db_conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                n_queued = self.db_conn.executemany(
+                    "INSERT INTO jobs (system_id, date, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (system_id, date) DO UPDATE SET state = 'queued', "
+                    "attempts = 0, error = NULL, updated_at = excluded.updated_at "
+                    "WHERE state = 'failed'",
+                    [(system_id, date.isoformat(), self._clock()) for date in dates],
+                ).rowcount
+
+            except BaseException:
+                self.db_conn.execute("ROLLBACK")
+                raise
+
+            self.db_conn.execute("COMMIT")
+
+        LOGGER.info("Queued %s days of PV system %s.", n_queued, system_id)
+
+        return n_queued
+
+    def claim(self, worker_id: str, system_ids: list[str] | None = None) -> Job | None:
+        """
+        Claim the earliest queued job for `worker_id`, or one whose lease ran out, of
+        either any PV system or only those of `system_ids`. Returns None once there are
+        no more jobs to claim.
+        """
+        now = self._clock()
+        where = "(state = 'queued' OR (state = 'running' AND lease_until < ?))"
+        params = (now,)
+
+        if system_ids is not None:
+            where += f" AND system_id IN ({', '.join(['?'] * len(system_ids))})"
+            params += tuple(system_ids)
+
+        with self._lock:
+            # Take the write lock before looking, so no other worker can claim the
+            # same job in between.
+            self.db_conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                # Jobs whose workers keep crashing are given up on, like failing ones.
+                self.db_conn.execute(
+                    "UPDATE jobs SET state = 'failed', lease_until = NULL, "
+                    "error = 'The lease ran out on every attempt.', updated_at = ? "
+                    "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+
+                row = self.db_conn.execute(
+                    f"SELECT system_id, date, attempts FROM jobs WHERE {where} "
+                    "ORDER BY date, system_id LIMIT 1",
+                    params,
+                ).fetchone()
+
+                if row is not None:
+                    self.db_conn.execute(
+                        "UPDATE jobs SET state = 'running', worker = ?, "
+                        "lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                        "WHERE system_id = ? AND date = ?",
+                        (worker_id, now + self.lease_seconds, now, row[0], row[1]),
+                    )
+
+            except BaseException:
+                self.db_conn.execute("ROLLBACK")
+                raise
+
+            self.db_conn.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return Job(
+            system_id=row[0], date=dt.date.fromisoformat(row[1]), attempts=row[2] + 1
+        )
+
+    def _update_held(
+        self, job: Job, worker_id: str, updates: str, params: tuple
+    ) -> bool:
+        """
+        Update the row of `job`, as long as `worker_id` still holds its lease. Returns
+        whether it did.
+        """
+        cursor = self._execute(
+            f"UPDATE jobs SET {updates}, updated_at = ? "
+            "WHERE system_id = ? AND date = ? AND state = 'running' AND worker = ?",
+            (*params, self._clock(), job.system_id, job.date.isoformat(), worker_id),
+        )
+
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job: Job, worker_id: str) -> bool:
+        """
+        Renew the lease of `worker_id` on `job`. Returns False if the lease was lost,
+        i.e. ran out and the job got claimed by another worker.
+        """
+        return self._update_held(
+            job, worker_id, "lease_until = ?", (self._clock() + self.lease_seconds,)
+        )
+
+    def complete(self, job: Job, worker_id: str) -> bool:
+        """
+        Mark `job` as done. Returns False if `worker_id` had lost its lease on it.
+        """
+        return self._update_held(
+            job, worker_id, "state = 'done', lease_until = NULL, error = NULL", ()
+        )
+
+    def fail(self, job: Job, worker_id: str, error: str) -> bool:
+        """
+        Mark `job` as failed with `error`, queuing it again unless it ran out of
+        attempts. Returns False if `worker_id` had lost its lease on it.
+        """
+        state = "failed" if job.attempts >= self.max_attempts else "queued"
+
+        return self._update_held(
+            job, worker_id, "state = ?, lease_until = NULL, error = ?", (state, error)
+        )
+
+    def counts(self) -> dict[str, int]:
+        """
+        Get the number of jobs in each state.
+        """
+        rows = self._execute("SELECT state, COUNT(1) FROM jobs GROUP BY state")
+
+        return {state: 0 for state in JOB_STATES} | dict(rows.fetchall())
+
+    def close(self) -> None:
+        """
+        Close the connection to the queue's file.
+        """
+        self.db_conn.close()
+
+
+class Heartbeat:
+    """
+    Keep renewing the lease of `worker_id` on `job` in a background thread, every
+    third of the lease's duration, until stopped.
+    """
+
+    def __init__(self, job_queue: JobQueue, job: Job, worker_id: str) -> None:
+        self.job_queue = job_queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.job_queue.lease_seconds / 3):
+            try:
+                if not self.job_queue.heartbeat(self.job, self.worker_id):
+                    LOGGER.warning("Lost the lease on %s.", self.job)
+                    self.lost = True
+                    return
+
+            except sqlite3.Error as e:
+                LOGGER.warning("Failed to renew the lease on %s: %s", self.job, e)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
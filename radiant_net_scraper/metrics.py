@@ -0,0 +1,419 @@
+"""
+Count and time what the app spends its time on, and expose the numbers in the text
+format Prometheus scrapes, optionally over HTTP.
+
+Stages of the ingestion, like logging in or parsing a chart, get timed by decorating
+the function doing them with `timed`. Bytes and rows they handle are counted with
+`count_bytes` and `count_rows`.
+"""
+
+import functools
+import inspect
+import threading
+import time
+import tracemalloc
+
+from radiant_net_scraper.config import Config, get_configured_logger
+
+LOGGER = get_configured_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the buckets of duration histograms, spanning everything
+# from parsing a chart to a login.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple) -> str:
+    """
+    Format labels as they follow the name of a sample.
+    """
+    if not label_names:
+        return ""
+
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(label_names, label_values)
+    ]
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """
+    Format a sample's value, integers without a decimal point.
+    """
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    Thread-safe counter of a value that only goes up, per combination of labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Add `amount` to the count of `labels`.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Get the count of `labels`.
+        """
+        with self._lock:
+            return self._values.get(tuple(labels[name] for name in self.label_names), 0)
+
+    def snapshot(self) -> dict[tuple, float]:
+        """
+        Get the counts of all labels.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> list[str]:
+        """
+        Render the counts of all labels as lines of samples.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    """
+    Thread-safe value that may go up and down, per combination of labels.
+    """
+
+    kind = "gauge"
+
+    def set_max(self, value: float, **labels) -> None:
+        """
+        Raise the value of `labels` to `value`, unless it is higher already.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def clear(self) -> None:
+        """
+        Forget the values of all labels.
+        """
+        with self._lock:
+            self._values = {}
+
+
+class Histogram:
+    """
+    Thread-safe histogram of observed values, per combination of labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = (*sorted(buckets), float("inf"))
+        # Maps labels to the counts per bucket, their sum and their count.
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record `value` for `labels`.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+            bucket_counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[i] += 1
+
+            self._values[key] = (bucket_counts, total + value, count + 1)
+
+    def count(self, **labels) -> int:
+        """
+        Get the number of values recorded for `labels`.
+        """
+        with self._lock:
+            key = tuple(labels[name] for name in self.label_names)
+
+            return self._values.get(key, ([], 0.0, 0))[2]
+
+    def snapshot(self) -> dict[tuple, tuple[float, int]]:
+        """
+        Get the sums and counts of the values of all labels.
+        """
+        with self._lock:
+            return {
+                key: (total, count) for key, (_, total, count) in self._values.items()
+            }
+
+    def samples(self) -> list[str]:
+        """
+        Render the buckets, sums and counts of all labels as lines of samples.
+        """
+        with self._lock:
+            values = sorted(
+                (key, (list(bucket_counts), total, count))
+                for key, (bucket_counts, total, count) in self._values.items()
+            )
+
+        samples = []
+        label_names = (*self.label_names, "le")
+
+        for key, (bucket_counts, total, count) in values:
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = _format_labels(label_names, (*key, _format_value(upper_bound)))
+                samples.append(f"{self.name}_bucket{labels} {bucket_count}")
+
+            labels = _format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {count}")
+
+        return samples
+
+
+class Registry:
+    """
+    Collection of the metrics of a process, by name.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, metric_class: type, name: str, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+
+            metric = self._metrics[name]
+
+        if not isinstance(metric, metric_class):
+            raise ValueError(f"Metric {name} is a {metric.kind} already.")
+
+        return metric
+
+    def counter(
+        self, name: str, help_text: str, label_names: tuple[str, ...] = ()
+    ) -> Counter:
+        """
+        Get the counter called `name`, adding it if it doesn't exist yet.
+        """
+        return self._get_or_add(Counter, name, help_text, label_names)
+
+    def gauge(
+        self, name: str, help_text: str, label_names: tuple[str, ...] = ()
+    ) -> Gauge:
+        """
+        Get the gauge called `name`, adding it if it doesn't exist yet.
+        """
+        return self._get_or_add(Gauge, name, help_text, label_names)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ) -> Histogram:
+        """
+        Get the histogram called `name`, adding it with `buckets` if it doesn't exist
+        yet.
+        """
+        return self._get_or_add(Histogram, name, help_text, label_names, buckets)
+
+    def render(self) -> str:
+        """
+        Render all metrics in the text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+
+        lines = []
+
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "radiant_net_stage_duration_seconds",
+    "Time spent per call of a stage of the ingestion.",
+    ("stage",),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "radiant_net_stage_errors_total",
+    "Calls of a stage of the ingestion that raised an error.",
+    ("stage",),
+)
+STAGE_BYTES = REGISTRY.counter(
+    "radiant_net_stage_bytes_total",
+    "Bytes handled by a stage of the ingestion.",
+    ("stage",),
+)
+STAGE_ROWS = REGISTRY.counter(
+    "radiant_net_stage_rows_total",
+    "Rows handled by a stage of the ingestion.",
+    ("stage",),
+)
+STAGE_TRACED_MEMORY = REGISTRY.gauge(
+    "radiant_net_stage_traced_memory_bytes",
+    "Most memory traced at the end of a call of a stage, while profiling memory.",
+    ("stage",),
+)
+
+
+def timed(stage: str):
+    """
+    Decorate a function so its calls get timed as `stage`, and those raising an
+    error counted. Coroutine functions are timed until their coroutine is done.
+    """
+
+    def record(started: float, failed: bool) -> None:
+        if failed:
+            STAGE_ERRORS.inc(stage=stage)
+
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+        if tracemalloc.is_tracing():
+            STAGE_TRACED_MEMORY.set_max(tracemalloc.get_traced_memory()[0], stage=stage)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+
+                try:
+                    result = await func(*args, **kwargs)
+
+                except BaseException:
+                    record(started, failed=True)
+                    raise
+
+                record(started, failed=False)
+
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+
+            try:
+                result = func(*args, **kwargs)
+
+            except BaseException:
+                record(started, failed=True)
+                raise
+
+            record(started, failed=False)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def count_bytes(stage: str, n_bytes: int) -> None:
+    """
+    Count `n_bytes` handled by `stage`.
+    """
+    STAGE_BYTES.inc(n_bytes, stage=stage)
+
+
+def count_rows(stage: str, n_rows: int) -> None:
+    """
+    Count `n_rows` handled by `stage`.
+    """
+    STAGE_ROWS.inc(n_rows, stage=stage)
+
+
+def start_metrics_server(host: str | None = None, port: int | None = None):
+    """
+    Serve the metrics at `/metrics` on `host` and `port`, by default those given by
+    the `metrics` section of the config, in a background thread. Returns the server,
+    call its `shutdown` to stop it.
+    """
+    # Imported here, so only processes serving metrics pay for importing it.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = REGISTRY.render().encode("UTF-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            LOGGER.debug(
+                "Metrics request from %s: " + format, self.client_address[0], *args
+            )
+
+    metrics_config = Config.get_config()["metrics"]
+
+    if host is None:
+        host = metrics_config["host"]
+
+    if port is None:
+        port = metrics_config.getint("port")
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    LOGGER.info("Serving metrics at http://%s:%s/metrics", *server.server_address[:2])
+
+    return server
@@ -0,0 +1,300 @@
+"""
+Ingest days in a pipeline of stages running side by side: fetcher threads retrieve
+and save the charts, parser workers turn them into dataframes, and a single writer
+inserts those into the DB. Stages are connected by bounded queues, so a slow stage
+holds back the ones before it instead of letting work pile up in memory.
+"""
+
+import datetime as dt
+import json
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from radiant_net_scraper.config import Config, get_configured_logger
+from radiant_net_scraper.data_parser import (
+    group_is_paywalled,
+    merge_chart_group_data,
+    parse_chart_group_data,
+    save_usage_dataframe_dict,
+)
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.fronius_session import FroniusSession
+from radiant_net_scraper.scrape import (
+    CHART_TYPES,
+    save_day_charts,
+    scrape_daily_data,
+    system_output_dir,
+)
+from radiant_net_scraper.types import ChartGroup, OutputDataFrames
+
+LOGGER = get_configured_logger(__name__)
+
+# Put into a queue once per consumer, telling it that no more items will follow.
+_DONE = object()
+
+
+class StageStats:
+    """
+    Thread-safe counters for the items handled by a stage of the pipeline.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.n_done = 0
+        self.n_failed = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds: float, failed: bool = False) -> None:
+        """
+        Count an item that took the stage `busy_seconds` to handle.
+        """
+        with self._lock:
+            self.busy_seconds += busy_seconds
+
+            if failed:
+                self.n_failed += 1
+            else:
+                self.n_done += 1
+
+    def finish(self) -> None:
+        """
+        Mark the stage as done with all its items.
+        """
+        self.finished_at = time.monotonic()
+
+    @property
+    def throughput(self) -> float:
+        """
+        Items handled per second of the stage's wall time.
+        """
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+
+        return self.n_done / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.n_done} done, {self.n_failed} failed, "
+            f"{self.throughput:.2f}/s, {self.busy_seconds:.1f}s busy"
+        )
+
+
+def fetch_day_charts(
+    date: dt.date, output_dir: str, system: dict | None = None
+) -> dict[str, bytes]:
+    """
+    Retrieve all chart types of `date` concurrently, save them to `output_dir` for the
+    record once all of them succeeded, and return their contents, mapping chart types
+    to JSON bodies.
+    """
+    with ThreadPoolExecutor(max_workers=len(CHART_TYPES)) as executor:
+        futures = {
+            chart_type: executor.submit(
+                scrape_daily_data, date, chart_type, system=system
+            )
+            for chart_type in CHART_TYPES
+        }
+
+    # Raises the error of the first failed chart, if any.
+    contents = {chart_type: future.result() for chart_type, future in futures.items()}
+    save_day_charts(date, output_dir, contents)
+
+    return contents
+
+
+def parse_day_charts(contents: dict[str, bytes]) -> OutputDataFrames | None:
+    """
+    Parse the JSON bodies of a day's charts into the day's dataframes, or return None
+    if they are paywalled.
+    """
+    group = ChartGroup(
+        **{chart_type: json.loads(content) for chart_type, content in contents.items()}
+    )
+
+    if group_is_paywalled(group):
+        return None
+
+    return merge_chart_group_data(parse_chart_group_data(group))
+
+
+def _run_worker(
+    stats: StageStats,
+    inbox: queue.Queue,
+    outbox: queue.Queue | None,
+    handle: Callable,
+) -> None:
+    """
+    Handle the (date, payload) items of `inbox` until told that there are no more,
+    passing on the results to `outbox`. Failures are logged and end the item's way
+    through the pipeline.
+    """
+    while (item := inbox.get()) is not _DONE:
+        date, payload = item
+        started = time.monotonic()
+
+        try:
+            result = handle(date, payload)
+
+        except Exception as e:
+            LOGGER.error("%s of %s failed: %s", stats.name, date, e)
+            stats.record(time.monotonic() - started, failed=True)
+            continue
+
+        stats.record(time.monotonic() - started)
+
+        if outbox is not None:
+            # Blocks while the next stage is behind, holding this one back.
+            outbox.put((date, result))
+
+
+def _start_workers(n_workers: int, target: Callable, *args) -> list[threading.Thread]:
+    """
+    Start `n_workers` threads running `target` with `args`.
+    """
+    workers = [
+        threading.Thread(target=target, args=args, daemon=True)
+        for _ in range(n_workers)
+    ]
+
+    for worker in workers:
+        worker.start()
+
+    return workers
+
+
+def _close_stage(
+    workers: list[threading.Thread],
+    stats: StageStats,
+    outbox: queue.Queue,
+    n_consumers: int,
+) -> None:
+    """
+    Wait for the `workers` of a stage to finish, then tell the next stage's
+    `n_consumers` that there is nothing more to come.
+    """
+    for worker in workers:
+        worker.join()
+
+    stats.finish()
+
+    for _ in range(n_consumers):
+        outbox.put(_DONE)
+
+
+def run_pipeline(
+    dates: list[dt.date],
+    db_handler: Database,
+    output_dir: str,
+    system: dict,
+    max_workers: int | None = None,
+    parse_workers: int | None = None,
+    queue_size: int | None = None,
+) -> dict[str, StageStats]:
+    """
+    Scrape, parse and insert the data of `dates` of the PV system `system`, using
+    `max_workers` fetchers and `parse_workers` parsers. The stored data of each day
+    is replaced by what was scraped, unless the day's charts are paywalled. Charts are
+    handed from stage to stage in memory, the saved files are only kept for the
+    record. Days failing in any stage are logged and left out. Returns the stats of
+    each stage.
+    """
+    scraping_config = Config.get_config()["scraping"]
+
+    if max_workers is None:
+        max_workers = scraping_config.getint("max_workers")
+
+    if parse_workers is None:
+        parse_workers = scraping_config.getint("parse_workers")
+
+    if queue_size is None:
+        queue_size = scraping_config.getint("queue_size")
+
+    system_dir = system_output_dir(output_dir, system)
+    system_id = system["name"]
+
+    # Log in up front, so the fetchers don't race each other to do it.
+    FroniusSession.get_session(system)
+
+    date_queue = queue.Queue()
+    parse_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    for date in dates:
+        date_queue.put((date, None))
+
+    for _ in range(max_workers):
+        date_queue.put(_DONE)
+
+    stats = {name: StageStats(name) for name in ("fetch", "parse", "write")}
+
+    LOGGER.info(
+        "Ingesting %s days of PV system %s with %s fetchers and %s parsers...",
+        len(dates),
+        system_id,
+        max_workers,
+        parse_workers,
+    )
+
+    fetchers = _start_workers(
+        max_workers,
+        _run_worker,
+        stats["fetch"],
+        date_queue,
+        parse_queue,
+        lambda date, _: fetch_day_charts(date, system_dir, system),
+    )
+    parsers = _start_workers(
+        parse_workers,
+        _run_worker,
+        stats["parse"],
+        parse_queue,
+        write_queue,
+        lambda _, contents: parse_day_charts(contents),
+    )
+
+    closers = [
+        threading.Thread(
+            target=_close_stage,
+            args=(fetchers, stats["fetch"], parse_queue, parse_workers),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_close_stage,
+            args=(parsers, stats["parse"], write_queue, 1),
+            daemon=True,
+        ),
+    ]
+
+    for closer in closers:
+        closer.start()
+
+    def write_day(date: dt.date, data: OutputDataFrames | None) -> None:
+        # Paywalled charts hold no data, the stored data of the day is kept then.
+        if data is None:
+            LOGGER.warning("Charts of %s are paywalled, nothing to ingest.", date)
+            return
+
+        # Replace the stored data of the day all at once, or not at all.
+        with db_handler.transaction():
+            db_handler.delete_raw_data(date, date, system_id=system_id)
+            db_handler.delete_daily_agg(date, date, system_id=system_id)
+            save_usage_dataframe_dict(data, db_handler, system_id=system_id)
+
+    # The writer runs in this thread, keeping writes to SQLite, which can't run in
+    # parallel anyway, in a single place.
+    _run_worker(stats["write"], write_queue, None, write_day)
+    stats["write"].finish()
+
+    for closer in closers:
+        closer.join()
+
+    for stage_stats in stats.values():
+        LOGGER.info("Pipeline stage %s", stage_stats)
+
+    return stats
@@ -0,0 +1,140 @@
+"""
+Work out which days still need to be scraped, based on what is already stored.
+"""
+
+import datetime as dt
+
+from radiant_net_scraper.archive import stored_mtime
+from radiant_net_scraper.config import DEFAULT_SYSTEM_ID, get_configured_logger
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.scrape import CHART_TYPES, chart_file_path, date_range
+
+LOGGER = get_configured_logger(__name__)
+
+
+def day_files_state(date: dt.date, output_dir: str) -> str:
+    """
+    Get the state of the chart files of `date` in `output_dir`, whether plain or
+    archived: "missing" if none of them exist, "complete" if all of them were written
+    after the day was over, and "incomplete" otherwise, e.g. for a day scraped while
+    it was still ongoing.
+    """
+    mtimes = [
+        stored_mtime(chart_file_path(date, output_dir, chart_type))
+        for chart_type in CHART_TYPES
+    ]
+
+    if all(mtime is None for mtime in mtimes):
+        return "missing"
+
+    day_over = dt.datetime.combine(date + dt.timedelta(days=1), dt.time()).timestamp()
+
+    if all(mtime is not None and mtime >= day_over for mtime in mtimes):
+        return "complete"
+
+    return "incomplete"
+
+
+def plan_days(
+    start: dt.date,
+    end: dt.date,
+    output_dir: str,
+    stored_days: set[dt.date] | None = None,
+    today: dt.date | None = None,
+) -> list[dt.date]:
+    """
+    List the days from `start` to `end` (both inclusive) which need to be scraped.
+    Past days are immutable, so a day is skipped once its files in `output_dir` are
+    complete, or, if there are no files (e.g. because they were cleaned up), once it
+    is among the `stored_days` in the DB. Today is never complete.
+    """
+    today = today or dt.date.today()
+    stored_days = stored_days or set()
+
+    planned = []
+    for date in date_range(start, end):
+        if date < today:
+            files_state = day_files_state(date, output_dir)
+
+            if files_state == "complete" or (
+                files_state == "missing" and date in stored_days
+            ):
+                continue
+
+        planned.append(date)
+
+    return planned
+
+
+def plan_scrape(
+    output_dir: str,
+    db_handler: Database,
+    days_ago: int = 1,
+    lookback_days: int = 7,
+    system_id: str = DEFAULT_SYSTEM_ID,
+    today: dt.date | None = None,
+) -> list[dt.date]:
+    """
+    List the days which need to be scraped for the PV system `system_id`, looking
+    back `lookback_days` days from `days_ago` days ago, so days missed because of
+    failed runs get caught up on automatically.
+    """
+    today = today or dt.date.today()
+    end = today - dt.timedelta(days=days_ago)
+    start = end - dt.timedelta(days=lookback_days - 1)
+
+    planned = plan_days(
+        start,
+        end,
+        output_dir,
+        stored_days=db_handler.get_daily_agg_days(start, end, system_id),
+        today=today,
+    )
+
+    LOGGER.info(
+        "%s of %s days from %s to %s need scraping for PV system %s.",
+        len(planned),
+        (end - start).days + 1,
+        start,
+        end,
+        system_id,
+    )
+
+    return planned
+
+
+def find_gaps(
+    db_handler: Database,
+    system_id: str = DEFAULT_SYSTEM_ID,
+    max_days: int = 30,
+    today: dt.date | None = None,
+) -> list[dt.date]:
+    """
+    List the days up to yesterday, going back at most `max_days` days, for which the
+    PV system `system_id` has no daily aggregate in the DB, e.g. because the app
+    wasn't running. Days before the first stored one are not gaps, so a fresh DB only
+    gets yesterday.
+    """
+    today = today or dt.date.today()
+    end = today - dt.timedelta(days=1)
+    first_day = db_handler.get_first_daily_agg_day(system_id)
+
+    if first_day is None:
+        start = end
+    else:
+        start = max(first_day, today - dt.timedelta(days=max_days))
+
+    gaps = sorted(
+        set(date_range(start, end))
+        - db_handler.get_daily_agg_days(start, end, system_id)
+    )
+
+    LOGGER.info(
+        "Found %s days missing from %s to %s for PV system %s.",
+        len(gaps),
+        start,
+        end,
+        system_id,
+    )
+
+    return gaps
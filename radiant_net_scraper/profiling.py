@@ -0,0 +1,247 @@
+"""
+Profile the CPU time or memory a command spends, for the `--profile` option of the
+command line tools. Profiles get written to a file for closer inspection, and
+summarized along with the stages timed by `metrics` once the command is done.
+"""
+
+import argparse
+import cProfile
+import datetime as dt
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+from radiant_net_scraper import metrics
+from radiant_net_scraper.config import get_configured_logger
+
+LOGGER = get_configured_logger(__name__)
+
+PROFILE_MODES = ("cpu", "mem")
+
+# Number of functions or source lines to list in summaries.
+TOP_N = 15
+
+
+def add_profile_arguments(argparser: argparse.ArgumentParser) -> None:
+    """
+    Add the `--profile` and `--profile-output` options to a command's arguments.
+    """
+    argparser.add_argument(
+        "--profile",
+        nargs="?",
+        const="cpu",
+        default=None,
+        choices=PROFILE_MODES,
+        help=(
+            "Profile the CPU time (the default) or the memory the command spends, "
+            "write the profile to a file, and print a summary when done."
+        ),
+    )
+
+    argparser.add_argument(
+        "--profile-output",
+        default=None,
+        type=str,
+        help=(
+            "File to write the profile to, a pstats file for `cpu`, a tracemalloc "
+            "snapshot for `mem` (default: named after the command and the time)."
+        ),
+    )
+
+
+def default_profile_path(command: str, mode: str) -> str:
+    """
+    Get the path a profile of `command` in `mode` gets written to by default.
+    """
+    suffix = ".pstats" if mode == "cpu" else ".tracemalloc"
+
+    return f"{command}-{dt.datetime.now():%Y%m%dT%H%M%S}{suffix}"
+
+
+def _stage_totals() -> dict[str, dict[str, float]]:
+    """
+    Get how many calls, seconds, errors, bytes and rows each stage took so far.
+    """
+    totals = {}
+
+    for (stage,), (seconds, calls) in metrics.STAGE_SECONDS.snapshot().items():
+        totals[stage] = {"calls": calls, "seconds": seconds}
+
+    for key, metric in [
+        ("errors", metrics.STAGE_ERRORS),
+        ("bytes", metrics.STAGE_BYTES),
+        ("rows", metrics.STAGE_ROWS),
+    ]:
+        for (stage,), value in metric.snapshot().items():
+            totals.setdefault(stage, {"calls": 0, "seconds": 0.0})[key] = value
+
+    return totals
+
+
+def format_stage_report(
+    before: dict[str, dict[str, float]],
+    after: dict[str, dict[str, float]],
+    wall_seconds: float,
+) -> list[str]:
+    """
+    Describe what each stage did between the stage totals `before` and `after`, and
+    the throughput of rows inserted and chart files loaded and fetched.
+    """
+    lines = []
+
+    def delta(stage: str, key: str) -> float:
+        return after.get(stage, {}).get(key, 0) - before.get(stage, {}).get(key, 0)
+
+    for stage in sorted(after):
+        calls = delta(stage, "calls")
+
+        if not calls:
+            continue
+
+        line = f"  {stage}: {calls:.0f} calls, {delta(stage, 'seconds'):.2f}s"
+
+        for key in ("bytes", "rows", "errors"):
+            if delta(stage, key):
+                line += f", {delta(stage, key):.0f} {key}"
+
+        lines.append(line)
+
+    wall_seconds = max(wall_seconds, 1e-9)
+
+    lines.append(
+        f"  {delta('insert_df', 'rows') / wall_seconds:.1f} rows/s inserted, "
+        f"{delta('load_daily_usage_json', 'calls') / wall_seconds:.1f} files/s "
+        f"loaded, {delta('get_chart', 'calls') / wall_seconds:.1f} charts/s fetched"
+    )
+
+    return lines
+
+
+@contextmanager
+def _profile_cpu(output_path: str, stream: TextIO) -> Iterator[None]:
+    """
+    Profile the CPU time of the current thread and of the threads started meanwhile.
+    """
+    profiles = [cProfile.Profile()]
+    profiles_lock = threading.Lock()
+
+    def profile_thread(*_) -> None:
+        # Called on the first event of each new thread, swapping itself out for a
+        # profile of the thread's own.
+        profile = cProfile.Profile()
+
+        with profiles_lock:
+            profiles.append(profile)
+
+        profile.enable()
+
+    threading.setprofile(profile_thread)
+    profiles[0].enable()
+
+    try:
+        yield
+
+    finally:
+        profiles[0].disable()
+        threading.setprofile(None)
+
+        summary = io.StringIO()
+
+        with profiles_lock:
+            stats = pstats.Stats(*profiles, stream=summary)
+
+        stats.dump_stats(output_path)
+
+        print(
+            f"CPU profile of {len(profiles)} threads written to {output_path}, "
+            "top functions by cumulative time:",
+            file=stream,
+        )
+
+        stats.sort_stats("cumulative").print_stats(TOP_N)
+        # Skip the header repeating the file name and the total number of calls.
+        print(summary.getvalue().split("\n\n", 2)[-1].rstrip(), file=stream)
+
+
+@contextmanager
+def _profile_memory(output_path: str, stream: TextIO) -> Iterator[None]:
+    """
+    Trace the memory allocated by all threads.
+    """
+    metrics.STAGE_TRACED_MEMORY.clear()
+    tracemalloc.start()
+
+    try:
+        yield
+
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        snapshot.dump(output_path)
+        stage_memory = metrics.STAGE_TRACED_MEMORY.snapshot()
+
+        print(
+            f"Memory snapshot written to {output_path}, peak traced memory "
+            f"{peak / 2**20:.1f} MiB.",
+            file=stream,
+        )
+
+        if stage_memory:
+            print("Most memory traced at the end of a stage:", file=stream)
+
+            for (stage,), value in sorted(stage_memory.items()):
+                print(f"  {stage}: {value / 2**20:.1f} MiB", file=stream)
+
+        print("Top allocations still held, by line:", file=stream)
+
+        for statistic in snapshot.statistics("lineno")[:TOP_N]:
+            print(f"  {statistic}", file=stream)
+
+
+@contextmanager
+def profiled(
+    mode: str | None,
+    command: str,
+    output_path: str | None = None,
+    stream: TextIO | None = None,
+) -> Iterator[None]:
+    """
+    Profile the block of `command` in `mode`, one of `PROFILE_MODES`, or not at all
+    if it is None. The profile is written to `output_path`, by default one named
+    after the command, and summarized to `stream`, by default stderr.
+    """
+    if mode is None:
+        yield
+        return
+
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {mode}.")
+
+    output_path = output_path or default_profile_path(command, mode)
+    stream = stream or sys.stderr
+    profile = _profile_cpu if mode == "cpu" else _profile_memory
+
+    LOGGER.info("Profiling the %s of %s into %s.", mode, command, output_path)
+
+    stages_before = _stage_totals()
+    started = time.perf_counter()
+
+    try:
+        with profile(output_path, stream):
+            yield
+
+    finally:
+        wall_seconds = time.perf_counter() - started
+
+        print(f"Stages during {wall_seconds:.2f}s of {command}:", file=stream)
+
+        for line in format_stage_report(stages_before, _stage_totals(), wall_seconds):
+            print(line, file=stream)
@@ -0,0 +1,84 @@
+"""
+Limit the rate at which requests are sent to a service provider.
+"""
+
+import asyncio
+import threading
+import time
+
+from typing import Callable
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, allowing bursts of up to `capacity` requests, and
+    `rate` requests per second on average.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError(f"The rate needs to be positive, got {rate}.")
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        """
+        Add the tokens accumulated since the last refill.
+        """
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def _take(self, tokens: float) -> float:
+        """
+        Take `tokens` from the bucket if enough are available, and return 0. Otherwise
+        take none, and return the seconds until there will be enough.
+        """
+        with self._lock:
+            self._refill()
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take `tokens` from the bucket, blocking until enough are available. Returns
+        the number of seconds spent waiting.
+        """
+        waited = 0.0
+
+        while wait := self._take(tokens):
+            self._sleep(wait)
+            waited += wait
+
+        return waited
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        Async version of `acquire`, which waits without blocking the event loop, so
+        the same bucket can limit threads and coroutines alike.
+        """
+        waited = 0.0
+
+        while wait := self._take(tokens):
+            await asyncio.sleep(wait)
+            waited += wait
+
+        return waited
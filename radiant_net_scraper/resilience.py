@@ -0,0 +1,339 @@
+"""
+Make requests to a service provider resilient against transient failures.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from collections import Counter
+from typing import Awaitable, Callable
+
+import httpx
+import requests as rq
+
+from radiant_net_scraper.config import get_configured_logger
+
+LOGGER = get_configured_logger(__name__)
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of making a request while the service is considered down.
+    """
+
+
+class RetryableStatusError(rq.HTTPError):
+    """
+    Raised for responses whose status indicates a transient failure.
+    """
+
+
+class RequestStats:
+    """
+    Thread-safe counters for the outcomes of requests.
+    """
+
+    def __init__(self) -> None:
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, outcome: str) -> None:
+        """
+        Count one occurrence of `outcome`.
+        """
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def snapshot(self) -> dict[str, int]:
+        """
+        Get a copy of the current counts.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a service after `failure_threshold` consecutive failures. After
+    `reset_timeout` seconds a single trial call is let through, closing the circuit
+    again if it succeeds.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        One of "closed", "open" or "half-open".
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+
+        return "open"
+
+    def before_call(self) -> None:
+        """
+        Raise a `CircuitOpenError` if calls are currently not allowed.
+        """
+        with self._lock:
+            state = self._state()
+
+            if state == "open":
+                raise CircuitOpenError(
+                    f"Circuit is open after {self._failures} consecutive failures, "
+                    f"not trying again for another "
+                    f"{self.reset_timeout - (self._clock() - self._opened_at):.0f}s."
+                )
+
+            if state == "half-open":
+                # Let only this call through, until it either succeeds or fails.
+                self._opened_at = self._clock()
+
+    def record_success(self) -> None:
+        """
+        Register a successful call, closing the circuit.
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        """
+        Register a failed call, opening the circuit if there were too many.
+        """
+        with self._lock:
+            self._failures += 1
+
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    LOGGER.warning(
+                        "%s consecutive failed requests, pausing requests for %ss.",
+                        self._failures,
+                        self.reset_timeout,
+                    )
+
+                self._opened_at = self._clock()
+
+
+class RetryPolicy:
+    """
+    Retry up to `max_retries` times, waiting a random time of up to
+    `backoff_base * 2 ** attempt` (capped at `backoff_max`) seconds in between.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 4,
+        backoff_base: float = 2,
+        backoff_max: float = 60,
+    ) -> None:
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt: int) -> float:
+        """
+        Get the time to wait before retry number `attempt` (starting at 0).
+        """
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**attempt)
+        )
+
+
+# Errors of requests made by httpx, rather than requests, that count as timeouts or as
+# failures to connect.
+HTTPX_TIMEOUTS = (httpx.TimeoutException,)
+HTTPX_CONNECTION_ERRORS = (httpx.NetworkError, httpx.RemoteProtocolError)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check whether a request failed in a way that is worth retrying.
+    """
+    return isinstance(
+        error,
+        (
+            rq.Timeout,
+            rq.ConnectionError,
+            RetryableStatusError,
+            *HTTPX_TIMEOUTS,
+            *HTTPX_CONNECTION_ERRORS,
+        ),
+    )
+
+
+def outcome_of(error: Exception) -> str:
+    """
+    Get the name under which the failure of a request is counted.
+    """
+    if isinstance(error, (rq.Timeout, *HTTPX_TIMEOUTS)):
+        return "timeout"
+
+    if isinstance(error, (rq.ConnectionError, *HTTPX_CONNECTION_ERRORS)):
+        return "connection_error"
+
+    if isinstance(error, RetryableStatusError):
+        return "server_error"
+
+    return "error"
+
+
+def _before_attempt(breaker: CircuitBreaker | None, stats: RequestStats) -> None:
+    """
+    Raise a `CircuitOpenError` if `breaker` doesn't allow another attempt.
+    """
+    if breaker is not None:
+        try:
+            breaker.before_call()
+
+        except CircuitOpenError:
+            stats.increment("circuit_open")
+            raise
+
+
+def _check_status(response: rq.Response | httpx.Response) -> None:
+    """
+    Raise a `RetryableStatusError` if the status of `response` is a 5xx or 429.
+    """
+    if response.status_code >= 500 or response.status_code == 429:
+        raise RetryableStatusError(
+            f"{response.status_code} response from {response.url}",
+            response=response,
+        )
+
+
+def _retry_delay(
+    error: Exception,
+    attempt: int,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None,
+    stats: RequestStats,
+) -> float | None:
+    """
+    Register that attempt number `attempt` failed with `error`, and get the seconds to
+    wait before retrying, or None if it shouldn't be retried.
+    """
+    stats.increment(outcome_of(error))
+
+    if not is_retryable(error):
+        return None
+
+    if breaker is not None:
+        breaker.record_failure()
+
+    if attempt == policy.max_retries:
+        stats.increment("gave_up")
+        return None
+
+    delay = policy.delay(attempt)
+    LOGGER.info("Request failed (%s), retrying in %.1fs...", error, delay)
+    stats.increment("retry")
+
+    return delay
+
+
+def _record_success(breaker: CircuitBreaker | None, stats: RequestStats) -> None:
+    """
+    Register a successful attempt.
+    """
+    if breaker is not None:
+        breaker.record_success()
+
+    stats.increment("success")
+
+
+def call_with_retries(
+    func: Callable[[], rq.Response],
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None = None,
+    stats: RequestStats | None = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> rq.Response:
+    """
+    Call `func` to make a request, retrying transient failures according to `policy`.
+    Responses with a 5xx or 429 status count as transient failures. All calls are
+    subject to `breaker`, and their outcomes are counted in `stats`.
+    """
+    stats = stats or RequestStats()
+
+    for attempt in range(policy.max_retries + 1):
+        _before_attempt(breaker, stats)
+
+        try:
+            response = func()
+            _check_status(response)
+
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, stats)
+
+            if delay is None:
+                raise
+
+            sleep(delay)
+
+            continue
+
+        _record_success(breaker, stats)
+
+        return response
+
+    # Not reachable, the loop either returns or raises.
+    raise AssertionError("Retry loop exited without result.")
+
+
+async def async_call_with_retries(
+    func: Callable[[], Awaitable[httpx.Response]],
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None = None,
+    stats: RequestStats | None = None,
+    sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+) -> httpx.Response:
+    """
+    Async version of `call_with_retries`, awaiting `func` and the waits in between
+    retries, so other requests go on meanwhile.
+    """
+    stats = stats or RequestStats()
+
+    for attempt in range(policy.max_retries + 1):
+        _before_attempt(breaker, stats)
+
+        try:
+            response = await func()
+            _check_status(response)
+
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, stats)
+
+            if delay is None:
+                raise
+
+            await sleep(delay)
+
+            continue
+
+        _record_success(breaker, stats)
+
+        return response
+
+    # Not reachable, the loop either returns or raises.
+    raise AssertionError("Retry loop exited without result.")
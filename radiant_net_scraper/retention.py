@@ -0,0 +1,131 @@
+"""
+Keep the database small by downsampling old raw data into hourly buckets.
+"""
+
+import datetime as dt
+
+from radiant_net_scraper.config import (
+    Config,
+    get_chosen_data_path,
+    get_chosen_db_sharding,
+    get_configured_logger,
+)
+from radiant_net_scraper.data_parser import aggregate_usage_df
+from radiant_net_scraper.database import Database
+
+LOGGER = get_configured_logger(__name__)
+
+
+def downsample_day(db_handler: Database, date: dt.date) -> int:
+    """
+    Aggregate the raw data of `date` into hourly buckets, then delete the raw rows.
+    The kWh of each row are calculated over the full day just as for the daily
+    aggregates, so the hourly kWh sum up to exactly the daily ones. Returns the number
+    of deleted raw rows.
+    """
+    raw_df = db_handler.get_raw_data_df(date, date)
+
+    if raw_df.empty:
+        return 0
+
+    # The kWh depend on the time to the next row, so each system is aggregated on its
+    # own.
+    hourly_dfs = [
+        aggregate_usage_df(
+            system_df.dropna(axis=1, how="all"),
+            time_cols=("system_id", "year", "month", "day", "hour"),
+        )
+        for _, system_df in raw_df.groupby("system_id")
+    ]
+
+    # Replace the raw rows by the hourly ones all at once, or not at all.
+    with db_handler.transaction():
+        for hourly_df in hourly_dfs:
+            db_handler.upsert_hourly_agg_df(hourly_df)
+
+        return db_handler.delete_raw_data(date, date)
+
+
+def enforce_retention(
+    db_handler: Database,
+    raw_max_age_days: int = 730,
+    batch_days: int = 14,
+    vacuum_pages: int | None = 1000,
+    freeze_shards_after_years: int | None = None,
+    today: dt.date | None = None,
+) -> list[dt.date]:
+    """
+    Downsample the raw data of at most `batch_days` of the days older than
+    `raw_max_age_days`, oldest first, and give back up to `vacuum_pages` freed pages to
+    the file system. Returns the downsampled days. Bounding each run keeps it short
+    enough to be run next to ingestion; repeated runs work through any backlog.
+
+    When sharding, the shards of all years more than `freeze_shards_after_years`
+    before the current one get frozen first, see `Database.freeze_shards`. Their raw
+    data is kept as it is from then on. DBs created before incremental auto-vacuum
+    was used get converted to it on the first run, so freed pages can be given back.
+    """
+    today = today or dt.date.today()
+    cutoff = today - dt.timedelta(days=raw_max_age_days)
+
+    if db_handler.shard_by_year and freeze_shards_after_years is not None:
+        db_handler.freeze_shards(before_year=today.year - freeze_shards_after_years)
+
+    db_handler.convert_to_incremental_vacuum()
+
+    days = db_handler.get_raw_days(before=cutoff, limit=batch_days)
+
+    if not days:
+        LOGGER.debug("No raw data older than %s, nothing to downsample.", cutoff)
+        return []
+
+    LOGGER.info("Downsampling raw data of %s days before %s...", len(days), cutoff)
+
+    done = []
+    for date in days:
+        try:
+            n_deleted = downsample_day(db_handler, date)
+
+        except PermissionError as e:
+            # Frozen shards are meant to stay untouched.
+            LOGGER.warning("Skipping downsampling of %s: %s", date, e)
+            continue
+
+        LOGGER.debug("Replaced %s raw rows of %s by hourly buckets.", n_deleted, date)
+        done.append(date)
+
+    db_handler.incremental_vacuum(vacuum_pages)
+
+    LOGGER.info("... done downsampling %s days.", len(done))
+
+    return done
+
+
+def run_retention(db_handler: Database | None = None) -> list[dt.date]:
+    """
+    Enforce the retention policy as given by the config on the app's DB, or on
+    `db_handler` if given.
+    """
+    retention_config = Config.get_config()["retention"]
+    freeze_after = retention_config.get("freeze_shards_after_years", fallback=None)
+    close_db = db_handler is None
+
+    if close_db:
+        db_handler = Database(
+            db_path=get_chosen_data_path(), shard_by_year=get_chosen_db_sharding()
+        )
+
+    try:
+        return enforce_retention(
+            db_handler,
+            raw_max_age_days=retention_config.getint("raw_max_age_days"),
+            batch_days=retention_config.getint("batch_days"),
+            vacuum_pages=retention_config.getint("vacuum_pages"),
+            freeze_shards_after_years=(
+                int(freeze_after) if freeze_after is not None else None
+            ),
+        )
+
+    finally:
+        if close_db:
+            db_handler.close()
@@ -2,49 +2,163 @@
 Retrieve data from a PV-System service provider.
 """
 
-import json
+import asyncio
+import os
 import datetime as dt
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from radiant_net_scraper.config import (
+    DEFAULT_SYSTEM_ID,
+    Config,
     get_chosen_raw_data_path,
     get_configured_logger,
+    get_raw_data_archive_codec,
 )
-from radiant_net_scraper.fronius_session import FroniusSession
+from radiant_net_scraper.archive import write_chart_files
+from radiant_net_scraper.fronius_session import AsyncFroniusSession, FroniusSession
 from radiant_net_scraper.types import ChartFileGroup
 
 LOGGER = get_configured_logger(__name__)
 
+CHART_TYPES = ("production", "consumption")
+
+
+def scrape_daily_data(
+    *get_chart_args, system: dict | None = None, **get_chart_kwars
+) -> bytes:
+    """
+    Use a login session to obtain the daily data chart for a given date as the JSON
+    body of the response, without decoding it. `system` selects the PV system (see
+    `get_fronius_systems`), by default the one configured in the `secrets` section is
+    used.
+    """
+    fsession = FroniusSession.get_session(system)
+
+    if system is not None:
+        get_chart_kwars["fronius_id"] = system["fronius-id"]
+
+    return fsession.get_chart(*get_chart_args, raw=True, **get_chart_kwars)
+
 
-def scrape_daily_data(*get_chart_args, **get_chart_kwars) -> str:
+def system_output_dir(output_dir: str, system: dict | None = None) -> str:
     """
-    Use a login session to obtain the daily data chart for a given date as a serialized
-    JSON dict.
+    Get the dir the files of `system` get saved to. To keep existing dirs valid, files
+    of the default system go directly into `output_dir`, those of other systems into a
+    subdir named after them.
     """
-    fsession = FroniusSession.get_session()
+    if system is None or system["name"] == DEFAULT_SYSTEM_ID:
+        return output_dir
 
-    return json.dumps(fsession.get_chart(*get_chart_args, **get_chart_kwars))
+    system_dir = output_dir + system["name"] + "/"
+    os.makedirs(system_dir, exist_ok=True)
+
+    return system_dir
+
+
+def chart_file_path(date: dt.date, output_dir: str, chart_type: str) -> str:
+    """
+    Get the path of the file the chart of a given date and type is saved to.
+    """
+    return output_dir + date.strftime(f"%Y%m%d_{chart_type}.json")
+
+
+def coarse_chart_file_path(
+    date: dt.date, output_dir: str, chart_type: str, interval: str = "month"
+) -> str:
+    """
+    Get the path of the file the chart of the month or year containing `date` is saved
+    to.
+    """
+    date_format = "%Y%m" if interval == "month" else "%Y"
+
+    return output_dir + date.strftime(f"{date_format}_{interval}_{chart_type}.json")
+
+
+def save_chart_files(contents: dict[str, bytes]) -> dict[str, str]:
+    """
+    Save chart files, mapping paths to contents, as plain files or into monthly
+    archives, depending on the config. Returns a dict mapping the given paths to where
+    the charts ended up.
+    """
+    return write_chart_files(contents, codec=get_raw_data_archive_codec())
 
 
 def save_chart_to_file(
-    date: dt.date, output_dir: str, chart_type: str = "production"
+    date: dt.date,
+    output_dir: str,
+    chart_type: str = "production",
+    system: dict | None = None,
 ) -> str:
     """
     Retrieve the chart data for a given date and type and save it to a JSON file.
     """
     LOGGER.info("Starting retrieval for day %s...", date)
 
-    json_out = scrape_daily_data(date, chart_type)
+    chart_content = scrape_daily_data(date, chart_type, system=system)
 
-    output_file = output_dir + date.strftime(f"%Y%m%d_{chart_type}.json")
+    output_file = chart_file_path(date, output_dir, chart_type)
     LOGGER.info("... done retrieving day %s, saving JSON to %s.", date, output_file)
 
-    with open(output_file, "w", encoding="UTF-8") as outfile:
-        outfile.write(json_out)
+    return save_chart_files({output_file: chart_content})[output_file]
+
+
+def save_day_charts(
+    date: dt.date, output_dir: str, charts: dict[str, bytes]
+) -> ChartFileGroup:
+    """
+    Save the `charts` of a given date, mapping chart types to contents, to JSON files,
+    all of them at once, so either all or none of them end up on disk.
+    """
+    output_files = {
+        chart_type: chart_file_path(date, output_dir, chart_type)
+        for chart_type in CHART_TYPES
+    }
+
+    LOGGER.info("Saving JSON of day %s to %s.", date, output_files)
+
+    stored_paths = save_chart_files(
+        {output_files[chart_type]: charts[chart_type] for chart_type in CHART_TYPES}
+    )
 
-    return output_file
+    return ChartFileGroup(
+        **{chart_type: stored_paths[path] for chart_type, path in output_files.items()}
+    )
 
 
-def run_scraper(output_dir: str | None = None, days_ago: int = 1) -> ChartFileGroup:
+def save_day_charts_to_files(
+    date: dt.date, output_dir: str, system: dict | None = None
+) -> ChartFileGroup:
+    """
+    Retrieve all chart types for a given date concurrently, and save them to JSON files
+    once all of them succeeded.
+    """
+    LOGGER.info("Starting retrieval for day %s...", date)
+
+    # Log in before spawning threads, so they don't race each other to do it.
+    FroniusSession.get_session(system)
+
+    with ThreadPoolExecutor(max_workers=len(CHART_TYPES)) as executor:
+        futures = {
+            chart_type: executor.submit(
+                scrape_daily_data, date, chart_type, system=system
+            )
+            for chart_type in CHART_TYPES
+        }
+
+    LOGGER.info("... done retrieving day %s.", date)
+
+    # Raises the error of the first failed chart, if any.
+    return save_day_charts(
+        date,
+        output_dir,
+        {chart_type: future.result() for chart_type, future in futures.items()},
+    )
+
+
+def run_scraper(
+    output_dir: str | None = None, days_ago: int = 1, system: dict | None = None
+) -> ChartFileGroup:
     """
     Determine the date for which data should be retrieved and save the data for that
     date to disk.
@@ -54,13 +168,268 @@ def run_scraper(output_dir: str | None = None, days_ago: int = 1) -> ChartFileGr
 
     date_to_parse = dt.date.today() - dt.timedelta(days=days_ago)
 
-    chart_types = ("production", "consumption")
+    return save_day_charts_to_files(
+        date=date_to_parse,
+        output_dir=system_output_dir(output_dir, system),
+        system=system,
+    )
 
-    return ChartFileGroup(
-        *[
-            save_chart_to_file(
-                date=date_to_parse, output_dir=output_dir, chart_type=chart_type
+
+def run_coarse_scraper_range(
+    start: dt.date,
+    end: dt.date,
+    output_dir: str | None = None,
+    system: dict | None = None,
+) -> list[ChartFileGroup]:
+    """
+    Save the month charts covering all dates from `start` to `end` (both inclusive) to
+    disk. Each of them holds the daily totals of a whole month, which makes them the
+    cheap way to backfill daily aggregates: a year takes 24 requests instead of 730.
+    Months for which a chart couldn't be retrieved are logged and left out.
+    """
+    if output_dir is None:
+        output_dir = get_chosen_raw_data_path() + "/"
+
+    output_dir = system_output_dir(output_dir, system)
+    fronius_id = system["fronius-id"] if system is not None else None
+    months = sorted({date.replace(day=1) for date in date_range(start, end)})
+
+    LOGGER.info(
+        "Scraping month charts of %s months from %s to %s...", len(months), start, end
+    )
+
+    output_groups = []
+    for month in months:
+        try:
+            charts = {
+                chart_type: FroniusSession.get_session(system).get_chart(
+                    month, chart_type, fronius_id=fronius_id, interval="month", raw=True
+                )
+                for chart_type in CHART_TYPES
+            }
+
+        except Exception as e:
+            LOGGER.error("Failed to scrape month charts of %s: %s", month, e)
+            continue
+
+        output_files = {
+            chart_type: coarse_chart_file_path(month, output_dir, chart_type)
+            for chart_type in CHART_TYPES
+        }
+        stored_paths = save_chart_files(
+            {output_files[chart_type]: chart for chart_type, chart in charts.items()}
+        )
+        output_groups.append(
+            ChartFileGroup(
+                **{
+                    chart_type: stored_paths[path]
+                    for chart_type, path in output_files.items()
+                }
             )
-            for chart_type in chart_types
+        )
+
+    return output_groups
+
+
+def date_range(start: dt.date, end: dt.date) -> list[dt.date]:
+    """
+    List all dates from `start` to `end`, both inclusive.
+    """
+    return [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def run_scraper_range(
+    start: dt.date,
+    end: dt.date,
+    output_dir: str | None = None,
+    max_workers: int | None = None,
+    system: dict | None = None,
+) -> list[ChartFileGroup]:
+    """
+    Save the data for all dates from `start` to `end` (both inclusive) to disk, see
+    `run_scraper_dates`.
+    """
+    return run_scraper_dates(
+        date_range(start, end),
+        output_dir=output_dir,
+        max_workers=max_workers,
+        system=system,
+    )
+
+
+def run_scraper_dates(
+    dates: list[dt.date],
+    output_dir: str | None = None,
+    max_workers: int | None = None,
+    system: dict | None = None,
+) -> list[ChartFileGroup]:
+    """
+    Save the data for all `dates` to disk. Charts are fetched over a pool of
+    `max_workers` threads sharing one logged-in session, whose rate limiter keeps
+    Solarweb from throttling us. The charts of a day are written together once all of
+    them arrived, just like `save_day_charts_to_files` does, so an interrupted backfill
+    never leaves half a day behind. Days for which a chart couldn't be retrieved are
+    logged and left out of the returned groups.
+    """
+    if output_dir is None:
+        output_dir = get_chosen_raw_data_path() + "/"
+
+    if max_workers is None:
+        max_workers = Config.get_config()["scraping"].getint("max_workers")
+
+    if not dates:
+        return []
+
+    output_dir = system_output_dir(output_dir, system)
+
+    # Log in up front, so the workers don't race each other to do it.
+    FroniusSession.get_session(system)
+
+    n_charts = len(dates) * len(CHART_TYPES)
+    # Bodies of the charts of days still waiting for their other charts.
+    chart_contents = {date: {} for date in dates}
+    output_groups = {}
+    failed_dates = set()
+
+    LOGGER.info(
+        "Scraping %s charts for %s days from %s to %s using %s workers...",
+        n_charts,
+        len(dates),
+        min(dates),
+        max(dates),
+        max_workers,
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for date in dates:
+            for chart_type in CHART_TYPES:
+                future = executor.submit(
+                    scrape_daily_data, date, chart_type, system=system
+                )
+                futures[future] = (date, chart_type)
+
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            date, chart_type = futures[future]
+
+            try:
+                chart_contents[date][chart_type] = future.result()
+
+                # Days with a failed chart never get complete, and aren't written.
+                if len(chart_contents[date]) == len(CHART_TYPES):
+                    output_groups[date] = save_day_charts(
+                        date, output_dir, chart_contents.pop(date)
+                    )
+
+            except Exception as e:
+                LOGGER.error("Failed to scrape %s chart of %s: %s", chart_type, date, e)
+                failed_dates.add(date)
+
+            # Report in steps of about 5%, otherwise long backfills drown the log.
+            if n_done % max(1, n_charts // 20) == 0 or n_done == n_charts:
+                LOGGER.info("Progress: %s/%s charts scraped.", n_done, n_charts)
+
+    if failed_dates:
+        LOGGER.warning(
+            "Failed to scrape %s of %s days: %s",
+            len(failed_dates),
+            len(dates),
+            ", ".join(str(date) for date in sorted(failed_dates)),
+        )
+
+    return [output_groups[date] for date in dates if date in output_groups]
+
+
+async def async_save_day_charts_to_files(
+    asession: AsyncFroniusSession,
+    date: dt.date,
+    output_dir: str,
+    system: dict | None = None,
+) -> ChartFileGroup:
+    """
+    Async version of `save_day_charts_to_files`, using an already opened session.
+    """
+    fronius_id = system["fronius-id"] if system is not None else None
+
+    charts = await asyncio.gather(
+        *[
+            asession.get_chart(date, chart_type, fronius_id, raw=True)
+            for chart_type in CHART_TYPES
         ]
     )
+
+    output_files = {
+        chart_type: chart_file_path(date, output_dir, chart_type)
+        for chart_type in CHART_TYPES
+    }
+
+    LOGGER.info("Done retrieving day %s, saving JSON to %s.", date, output_files)
+
+    stored_paths = await asyncio.to_thread(
+        save_chart_files,
+        {
+            output_files[chart_type]: chart
+            for chart_type, chart in zip(CHART_TYPES, charts)
+        },
+    )
+
+    return ChartFileGroup(
+        **{chart_type: stored_paths[path] for chart_type, path in output_files.items()}
+    )
+
+
+async def async_run_scraper_range(
+    start: dt.date,
+    end: dt.date,
+    output_dir: str | None = None,
+    max_concurrency: int | None = None,
+    system: dict | None = None,
+) -> list[ChartFileGroup]:
+    """
+    Async version of `run_scraper_range`, where the number of charts in flight at once
+    is limited by `max_concurrency` rather than a number of worker threads.
+    """
+    if output_dir is None:
+        output_dir = get_chosen_raw_data_path() + "/"
+
+    output_dir = system_output_dir(output_dir, system)
+    asession = await AsyncFroniusSession.get_session(
+        system, max_concurrency=max_concurrency
+    )
+    dates = date_range(start, end)
+
+    LOGGER.info(
+        "Scraping %s days from %s to %s with up to %s charts in flight...",
+        len(dates),
+        start,
+        end,
+        asession.max_concurrency,
+    )
+
+    try:
+        results = await asyncio.gather(
+            *[
+                async_save_day_charts_to_files(asession, date, output_dir, system)
+                for date in dates
+            ],
+            return_exceptions=True,
+        )
+
+    finally:
+        await asession.close()
+
+    failed_dates = []
+    for date, result in zip(dates, results):
+        if isinstance(result, Exception):
+            LOGGER.error("Failed to scrape %s: %s", date, result)
+            failed_dates.append(date)
+
+    if failed_dates:
+        LOGGER.warning(
+            "Failed to scrape %s of %s days: %s",
+            len(failed_dates),
+            len(dates),
+            ", ".join(str(date) for date in failed_dates),
+        )
+
+    return [result for result in results if isinstance(result, ChartFileGroup)]
@@ -4,14 +4,24 @@ Wrappers around functions providing command line functionality with argument par
 support.
 """
 import argparse
+import datetime as dt
+import json
+import signal
+import threading
 
 from radiant_net_scraper.config import (
+    DEFAULT_SYSTEM_ID,
     get_chosen_data_path,
+    get_fronius_systems,
     get_chosen_raw_data_path,
     print_app_path_json,
 )
-from radiant_net_scraper.scrape import run_scraper
-from radiant_net_scraper import data_parser
+from radiant_net_scraper.archive import CODECS, convert_dir
+from radiant_net_scraper.profiling import add_profile_arguments, profiled
+
+# Modules pulling in heavy dependencies, like pandas or requests, are imported by the
+# commands needing them once their arguments are parsed, so the other commands, and
+# `--help`, start quickly.
 
 
 def show_app_paths():
@@ -65,9 +75,138 @@ def scrape():
         ),
     )
 
+    argparser.add_argument(
+        "--from",
+        dest="from_date",
+        default=None,
+        type=dt.date.fromisoformat,
+        help=(
+            "First date (YYYY-MM-DD) of a range of days to scrape. If provided, "
+            "`--days-ago` is ignored."
+        ),
+    )
+    argparser.add_argument(
+        "--to",
+        dest="to_date",
+        default=None,
+        type=dt.date.fromisoformat,
+        help=(
+            "Last date (YYYY-MM-DD) of the range of days to scrape (default: "
+            "yesterday). Only used together with `--from`."
+        ),
+    )
+    argparser.add_argument(
+        "--workers",
+        "-w",
+        default=None,
+        type=int,
+        help=(
+            "Number of charts to fetch concurrently when scraping a range of days "
+            "(default: `max_workers`, or `async_max_concurrency` with "
+            "`--ingest-async`, in the `scraping` section of the config)."
+        ),
+    )
+    argparser.add_argument(
+        "--ingest-async",
+        action="store_true",
+        help=(
+            "Scrape the range of days given by `--from` and `--to` of all systems at "
+            "once on an asyncio client, which keeps hundreds of charts in flight "
+            "without a thread each, and ingest them into the database right away."
+        ),
+    )
+
+    argparser.add_argument(
+        "--interval",
+        default="day",
+        choices=["day", "month"],
+        help=(
+            "Interval of the charts to scrape (default: %(default)s). Month charts "
+            "only hold daily totals, but cover a whole month per request, which makes "
+            "them the cheap way to backfill the daily aggregates of long ranges."
+        ),
+    )
+
+    argparser.add_argument(
+        "--system",
+        "-s",
+        dest="systems",
+        action="append",
+        default=None,
+        help=(
+            "Name of a configured PV system to scrape, may be given multiple times "
+            "(default: all configured systems)."
+        ),
+    )
+
+    add_profile_arguments(argparser)
+
     args = argparser.parse_args()
 
-    run_scraper(**vars(args))
+    from radiant_net_scraper.scrape import (
+        run_coarse_scraper_range,
+        run_scraper,
+        run_scraper_range,
+    )
+
+    systems = get_fronius_systems()
+
+    if args.systems:
+        unknown = set(args.systems) - {system["name"] for system in systems}
+
+        if unknown:
+            argparser.error(f"Unknown PV systems: {', '.join(sorted(unknown))}.")
+
+        systems = [system for system in systems if system["name"] in args.systems]
+
+    if args.ingest_async:
+        if args.from_date is None or args.interval != "day":
+            argparser.error("`--ingest-async` only works with `--from` and day charts.")
+
+        import asyncio
+
+        from radiant_net_scraper.ingestion_flow import async_ingest_days
+
+        with profiled(args.profile, "radiant-net-scraper", args.profile_output):
+            asyncio.run(
+                async_ingest_days(
+                    start=args.from_date,
+                    end=args.to_date or dt.date.today() - dt.timedelta(days=1),
+                    scraping_kwargs={
+                        "output_dir": args.output_dir,
+                        "max_concurrency": args.workers,
+                    },
+                    systems=systems,
+                )
+            )
+
+        return
+
+    with profiled(args.profile, "radiant-net-scraper", args.profile_output):
+        for system in systems:
+            if args.interval == "month":
+                last_date = dt.date.today() - dt.timedelta(days=args.days_ago)
+
+                run_coarse_scraper_range(
+                    start=args.from_date or last_date,
+                    end=args.to_date or last_date,
+                    output_dir=args.output_dir,
+                    system=system,
+                )
+
+            elif args.from_date is not None:
+                run_scraper_range(
+                    start=args.from_date,
+                    end=args.to_date or dt.date.today() - dt.timedelta(days=1),
+                    output_dir=args.output_dir,
+                    max_workers=args.workers,
+                    system=system,
+                )
+
+            else:
+                run_scraper(
+                    output_dir=args.output_dir, days_ago=args.days_ago, system=system
+                )
 
 
 def parse_json_files():
@@ -104,12 +243,279 @@ def parse_json_files():
         help="Dir to which the database will be saved (default: %(default)s).",
     )
 
+    argparser.add_argument(
+        "--system-id",
+        "-s",
+        default=DEFAULT_SYSTEM_ID,
+        type=str,
+        help=(
+            "Name of the PV system the files belong to, rows in the database get "
+            "tagged with it (default: %(default)s)."
+        ),
+    )
+
+    argparser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue where the last run stopped, skipping files it already committed "
+            "or quarantined."
+        ),
+    )
+
+    argparser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep running after parsing `--input-dir`, ingesting chart files as soon "
+            "as they get written to it, until interrupted or terminated."
+        ),
+    )
+
+    add_profile_arguments(argparser)
+
+    args = argparser.parse_args()
+
+    from radiant_net_scraper import data_parser
+
+    with profiled(args.profile, "radiant-net-parser", args.profile_output):
+        if args.watch:
+            if args.input_files:
+                argparser.error("`--watch` only works with `--input-dir`.")
+
+            from radiant_net_scraper.watch import watch_dir
+
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            db_handler = data_parser.open_database(db_path=args.output_db)
+
+            try:
+                watch_dir(
+                    args.input_dir, db_handler, system_id=args.system_id, stop=stop
+                )
+
+            except KeyboardInterrupt:
+                pass
+
+            finally:
+                db_handler.close()
+
+            return
+
+        if args.input_files:
+            quarantined = data_parser.parse_json_data_from_file_list(
+                db_path=args.output_db,
+                infiles=args.input_files,
+                system_id=args.system_id,
+                resume=args.resume,
+            )
+
+        else:
+            quarantined = data_parser.parse_json_data(
+                db_path=args.output_db,
+                input_dir=args.input_dir,
+                system_id=args.system_id,
+                resume=args.resume,
+            )
+
+        for group in quarantined:
+            print(f"Quarantined {group.production}")
+
+
+def backup():
+    """
+    Take a consistent snapshot of the database without pausing writers.
+    """
+    argparser = argparse.ArgumentParser(
+        "RadiantNet Backup",
+        description=(
+            "Snapshot the database into a new timestamped dir inside the target dir. "
+            "Files unchanged since the previous snapshot get hard-linked instead of "
+            "copied."
+        ),
+    )
+
+    argparser.add_argument(
+        "--target-dir",
+        "-t",
+        default=None,
+        type=str,
+        help=(
+            "Dir in which to put the snapshot (default: `target_dir` in the `backup` "
+            "section of the config)."
+        ),
+    )
+
+    args = argparser.parse_args()
+
+    from radiant_net_scraper.backup import run_backup
+
+    print(run_backup(target_dir=args.target_dir))
+
+
+def archive_raw_data():
+    """
+    Move existing raw JSON files into compressed monthly archives.
+    """
+    argparser = argparse.ArgumentParser(
+        "RadiantNet Archive",
+        description=(
+            "Move the raw JSON files in a dir into compressed monthly archives, which "
+            "the parser reads just like the plain files. The plain files are removed "
+            "once their archive has been written and read back."
+        ),
+    )
+
+    argparser.add_argument(
+        "--input-dir",
+        "-i",
+        default=get_chosen_raw_data_path(),
+        type=str,
+        help="Dir holding the JSON files to archive (default: %(default)s).",
+    )
+
+    argparser.add_argument(
+        "--codec",
+        "-c",
+        default="gzip",
+        choices=sorted(CODECS),
+        help="Compression to use (default: %(default)s).",
+    )
+
+    argparser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the plain files after archiving them.",
+    )
+
+    args = argparser.parse_args()
+
+    n_archived = convert_dir(args.input_dir, codec=args.codec, keep=args.keep)
+
+    print(f"Archived {n_archived} files in {args.input_dir}.")
+
+
+def work():
+    """
+    Process ingestion jobs from the job queue until it is empty.
+    """
+    argparser = argparse.ArgumentParser(
+        "RadiantNet Worker",
+        description=(
+            "Claim days from the job queue and ingest them until no more are left. "
+            "Any number of workers can share a queue, also across machines sharing a "
+            "volume, to split the work of a big backfill between them."
+        ),
+    )
+
+    argparser.add_argument(
+        "--queue",
+        "-q",
+        default=None,
+        type=str,
+        help=(
+            "Path of the queue's SQLite file (default: `path` in the `queue` section "
+            "of the config, or next to the database)."
+        ),
+    )
+
+    argparser.add_argument(
+        "--from",
+        dest="from_date",
+        default=None,
+        type=dt.date.fromisoformat,
+        help="First date (YYYY-MM-DD) of a range of days to queue before working.",
+    )
+    argparser.add_argument(
+        "--to",
+        dest="to_date",
+        default=None,
+        type=dt.date.fromisoformat,
+        help=(
+            "Last date (YYYY-MM-DD) of the range of days to queue (default: "
+            "yesterday). Only used together with `--from`."
+        ),
+    )
+
+    argparser.add_argument(
+        "--system",
+        "-s",
+        dest="systems",
+        action="append",
+        default=None,
+        help=(
+            "Name of a configured PV system to queue and work on days of, may be "
+            "given multiple times (default: all configured systems)."
+        ),
+    )
+
+    argparser.add_argument(
+        "--enqueue-only",
+        action="store_true",
+        help="Only queue the days given by `--from` and `--to`, don't work on them.",
+    )
+
+    add_profile_arguments(argparser)
+
+    args = argparser.parse_args()
+
+    from radiant_net_scraper.context import AppContext
+    from radiant_net_scraper.scrape import date_range
+    from radiant_net_scraper.worker import open_job_queue, run_worker
+
+    systems = get_fronius_systems()
+
+    if args.systems:
+        unknown = set(args.systems) - {system["name"] for system in systems}
+
+        if unknown:
+            argparser.error(f"Unknown PV systems: {', '.join(sorted(unknown))}.")
+
+        systems = [system for system in systems if system["name"] in args.systems]
+
+    job_queue = open_job_queue(args.queue)
+
+    with profiled(args.profile, "radiant-net-worker", args.profile_output):
+        try:
+            if args.from_date is not None:
+                dates = date_range(
+                    args.from_date,
+                    args.to_date or dt.date.today() - dt.timedelta(days=1),
+                )
+
+                for system in systems:
+                    job_queue.enqueue(dates, system["name"])
+
+            if not args.enqueue_only:
+                # Only log into the chosen systems, and leave the jobs of the others
+                # to workers of their own.
+                with AppContext(systems=systems) as context:
+                    context.warm_up()
+                    run_worker(job_queue, context, system_ids=args.systems)
+
+            print(json.dumps(job_queue.counts()))
+
+        finally:
+            job_queue.close()
+
+
+def run():
+    """
+    Run the scraper continuously, ingesting each day once it is over.
+    """
+    argparser = argparse.ArgumentParser(
+        "RadiantNet Run",
+        description=(
+            "Run the scraper continuously, scraping and ingesting each day into the "
+            "database once it is over, and catching up on missed days at start-up."
+        ),
+    )
+
+    add_profile_arguments(argparser)
+
     args = argparser.parse_args()
 
-    if args.input_files:
-        data_parser.parse_json_data_from_file_list(
-            db_path=args.output_db, infiles=args.input_files
-        )
+    from radiant_net_scraper.ingestion_flow import run_ingestion_continuously
 
-    else:
-        data_parser.parse_json_data(db_path=args.output_db, input_dir=args.input_dir)
+    with profiled(args.profile, "radiant-net-run", args.profile_output):
+        run_ingestion_continuously()
@@ -0,0 +1,336 @@
+"""
+Watch a raw data dir and ingest chart files as soon as they have been written.
+
+Changes are picked up through inotify on Linux, and by polling the dir's entries
+elsewhere. Chart files are collected into groups, which get ingested once complete,
+or, should a chart be missing, once they have been left alone for a while.
+"""
+
+import ctypes
+import ctypes.util
+import glob
+import os
+import re
+import select
+import struct
+import threading
+import time
+
+from radiant_net_scraper.archive import ARCHIVE_SUFFIX, read_index, stored_mtime
+from radiant_net_scraper.config import (
+    DEFAULT_SYSTEM_ID,
+    Config,
+    get_configured_logger,
+)
+from radiant_net_scraper.data_parser import (
+    get_chart_file_groups,
+    parse_coarse_json_data_from_file_pair_list,
+    parse_json_data,
+    parse_json_data_from_file_pair_list,
+    split_coarse_files,
+)
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.files import CHECKSUM_SUFFIX
+from radiant_net_scraper.scrape import CHART_TYPES
+
+LOGGER = get_configured_logger(__name__)
+
+# Files are complete once closed after writing, or once renamed into place.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+CHART_TYPE_RE = re.compile(r"_(consumption|production)(?=\.json$)")
+
+
+class InotifyWatcher:
+    """
+    Report the names of files written in `dir_path`, as told by inotify.
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Failed to initialise inotify.")
+
+        if (
+            libc.inotify_add_watch(
+                self._fd, os.fsencode(dir_path), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            < 0
+        ):
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"Failed to watch {dir_path}.")
+
+    def changes(self, timeout: float) -> set[str]:
+        """
+        Wait up to `timeout` seconds for files to be written, and return their names.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+
+        if not readable:
+            return set()
+
+        buffer = os.read(self._fd, 64 * 1024)
+        names = set()
+        offset = 0
+
+        while offset < len(buffer):
+            _, _, _, name_length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            names.add(os.fsdecode(buffer[offset : offset + name_length].rstrip(b"\0")))
+            offset += name_length
+
+        return names
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Report the names of files changed in `dir_path`, by comparing the modification
+    times and sizes of its entries every `interval` seconds.
+    """
+
+    def __init__(self, dir_path: str, interval: float = 2) -> None:
+        self.dir_path = dir_path
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        with os.scandir(self.dir_path) as entries:
+            return {
+                entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in entries
+                if entry.is_file()
+            }
+
+    def changes(self, timeout: float) -> set[str]:
+        """
+        Wait up to `timeout` seconds, at least one interval, and return the names of
+        files changed in the meantime.
+        """
+        time.sleep(max(min(timeout, self.interval), 0))
+        snapshot = self._scan()
+        changed = {
+            name
+            for name, signature in snapshot.items()
+            if self._snapshot.get(name) != signature
+        }
+        self._snapshot = snapshot
+
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(
+    dir_path: str, poll_interval: float = 2
+) -> InotifyWatcher | PollingWatcher:
+    """
+    Watch `dir_path` through inotify where available, and by polling otherwise.
+    """
+    try:
+        return InotifyWatcher(dir_path)
+
+    except (OSError, AttributeError, TypeError) as e:
+        LOGGER.info("inotify unavailable (%s), polling %s instead.", e, dir_path)
+        return PollingWatcher(dir_path, interval=poll_interval)
+
+
+def _group_key(path: str) -> str:
+    """
+    Get the key shared by the paths of all chart types of a group.
+    """
+    return CHART_TYPE_RE.sub("", path)
+
+
+class GroupCollector:
+    """
+    Collect changed chart files into the groups they belong to. Complete groups are
+    released once none of their files, checksums included, changed for
+    `settle_seconds`. Partial groups get released after `debounce_seconds`, in case
+    the missing chart never comes.
+    """
+
+    def __init__(self, settle_seconds: float = 1, debounce_seconds: float = 30) -> None:
+        self.settle_seconds = settle_seconds
+        self.debounce_seconds = debounce_seconds
+        self._groups: dict[str, tuple[set[str], float]] = {}
+
+    def add(self, paths: set[str], now: float) -> None:
+        """
+        Register that the chart files at `paths` changed at `now`.
+        """
+        for path in paths:
+            key = _group_key(path)
+            group_paths, _ = self._groups.get(key, (set(), now))
+            self._groups[key] = (group_paths | {path}, now)
+
+    def ready(self, now: float) -> list[str]:
+        """
+        Take the files of all groups due at `now`. Charts of a group that didn't
+        change, but were stored before, get taken along.
+        """
+        paths = []
+
+        for key, (group_paths, changed_at) in list(self._groups.items()):
+            stem = key[: -len(".json")]
+            chart_paths = {f"{stem}_{chart_type}.json" for chart_type in CHART_TYPES}
+            present = group_paths | {
+                path
+                for path in chart_paths - group_paths
+                if stored_mtime(path) is not None
+            }
+
+            if present >= chart_paths:
+                wait = self.settle_seconds
+            else:
+                wait = self.debounce_seconds
+
+            if now - changed_at >= wait:
+                paths.extend(sorted(present))
+                del self._groups[key]
+
+        return paths
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+
+def _archive_signatures(archive_path: str) -> dict[str, tuple]:
+    """
+    Map the names of the charts in the archive at `archive_path` to signatures that
+    change whenever a chart gets written again.
+    """
+    try:
+        index = read_index(archive_path)
+
+    except (OSError, ValueError) as e:
+        LOGGER.warning("Failed to read the index of %s: %s", archive_path, e)
+        return {}
+
+    return {name: (entry["sha256"], entry["mtime"]) for name, entry in index.items()}
+
+
+def changed_paths(
+    input_dir: str, names: set[str], archives: dict[str, dict[str, tuple]]
+) -> set[str]:
+    """
+    Turn the `names` of files changed in `input_dir` into the paths of the chart files
+    that changed. Changed archives are compared with their signatures in `archives`,
+    which get updated, and expand to the virtual paths of their changed charts.
+    """
+    paths = set()
+
+    for name in names:
+        # Checksums get renamed into place along with their charts, count them as
+        # changes of their charts.
+        if name.endswith(CHECKSUM_SUFFIX):
+            name = name[: -len(CHECKSUM_SUFFIX)]
+
+        path = os.path.join(input_dir, name)
+
+        if name.endswith(".json"):
+            paths.add(path)
+
+        elif name.endswith(ARCHIVE_SUFFIX):
+            signatures = _archive_signatures(path)
+            known = archives.get(path, {})
+            paths.update(
+                os.path.join(path, member)
+                for member, signature in signatures.items()
+                if known.get(member) != signature
+            )
+            archives[path] = signatures
+
+    return paths
+
+
+def ingest_paths(paths: list[str], db_handler: Database, system_id: str) -> None:
+    """
+    Ingest the chart files at `paths`, replacing the stored data of their days.
+    Groups failing to ingest get quarantined, see `parse_json_data_from_file_pair_list`.
+    """
+    day_files, coarse_files = split_coarse_files(paths)
+
+    LOGGER.info("Ingesting %s new chart files...", len(paths))
+
+    if day_files:
+        parse_json_data_from_file_pair_list(
+            get_chart_file_groups(day_files),
+            system_id=system_id,
+            db_handler=db_handler,
+            replace=True,
+        )
+
+    if coarse_files:
+        parse_coarse_json_data_from_file_pair_list(
+            get_chart_file_groups(coarse_files),
+            system_id=system_id,
+            db_handler=db_handler,
+        )
+
+
+def watch_dir(
+    input_dir: str,
+    db_handler: Database,
+    system_id: str = DEFAULT_SYSTEM_ID,
+    debounce_seconds: float | None = None,
+    poll_interval: float | None = None,
+    settle_seconds: float | None = None,
+    stop: threading.Event | None = None,
+) -> None:
+    """
+    Ingest chart files of the PV system `system_id` into `db_handler` as they get
+    written to `input_dir`, until `stop` is set. Whatever is in the dir already and
+    wasn't ingested before gets ingested first.
+    """
+    watch_config = Config.get_config()["watch"]
+
+    if debounce_seconds is None:
+        debounce_seconds = watch_config.getfloat("debounce_seconds")
+
+    if poll_interval is None:
+        poll_interval = watch_config.getfloat("poll_interval_seconds")
+
+    if settle_seconds is None:
+        settle_seconds = watch_config.getfloat("settle_seconds")
+
+    stop = stop or threading.Event()
+
+    # Start watching before catching up, so nothing written meanwhile gets missed.
+    watcher = make_watcher(input_dir, poll_interval=poll_interval)
+    collector = GroupCollector(
+        settle_seconds=settle_seconds, debounce_seconds=debounce_seconds
+    )
+    archives = {
+        archive_path: _archive_signatures(archive_path)
+        for archive_path in glob.glob(f"{input_dir}/*{ARCHIVE_SUFFIX}")
+    }
+
+    try:
+        parse_json_data(
+            input_dir, resume=True, system_id=system_id, db_handler=db_handler
+        )
+
+        LOGGER.info("Watching %s for new chart files...", input_dir)
+
+        while not stop.is_set():
+            names = watcher.changes(timeout=min(settle_seconds, poll_interval))
+            now = time.monotonic()
+            collector.add(changed_paths(input_dir, names, archives), now)
+
+            if paths := collector.ready(now):
+                ingest_paths(paths, db_handler, system_id)
+
+    finally:
+        watcher.close()
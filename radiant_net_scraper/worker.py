@@ -0,0 +1,93 @@
+"""
+Work through the jobs of a job queue, see `job_queue`.
+"""
+
+from radiant_net_scraper.config import (
+    Config,
+    get_chosen_queue_path,
+    get_configured_logger,
+)
+from radiant_net_scraper.context import AppContext
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.job_queue import Heartbeat, Job, JobQueue, default_worker_id
+from radiant_net_scraper.pipeline import run_pipeline
+
+LOGGER = get_configured_logger(__name__)
+
+
+def open_job_queue(queue_path: str | None = None) -> JobQueue:
+    """
+    Open the job queue at `queue_path`, by default the one given by the config.
+    """
+    queue_config = Config.get_config()["queue"]
+
+    return JobQueue(
+        queue_path or get_chosen_queue_path(),
+        lease_seconds=queue_config.getfloat("lease_seconds"),
+        max_attempts=queue_config.getint("max_attempts"),
+    )
+
+
+def ingest_job(
+    job: Job, db_handler: Database, output_dir: str, systems: list[dict]
+) -> None:
+    """
+    Scrape and ingest the day of `job`, raising an error should that fail.
+    """
+    system = next(
+        (system for system in systems if system["name"] == job.system_id), None
+    )
+
+    if system is None:
+        raise ValueError(f"PV system {job.system_id} is not configured.")
+
+    stats = run_pipeline(
+        [job.date], db_handler, output_dir=output_dir, system=system, max_workers=1
+    )
+
+    if stats["write"].n_done != 1:
+        raise RuntimeError(
+            f"Failed to ingest {job.date} of PV system {job.system_id}, see the log."
+        )
+
+
+def run_worker(
+    job_queue: JobQueue,
+    context: AppContext,
+    worker_id: str | None = None,
+    system_ids: list[str] | None = None,
+) -> int:
+    """
+    Claim and ingest jobs from `job_queue` with the resources of `context`, until
+    there are no more. Only jobs of the PV systems `system_ids` are claimed if given,
+    leaving the others to other workers. Returns the number of completed jobs.
+    """
+    worker_id = worker_id or default_worker_id()
+    n_done = 0
+
+    LOGGER.info("Worker %s starting on queue %s.", worker_id, job_queue.path)
+
+    while (job := job_queue.claim(worker_id, system_ids)) is not None:
+        LOGGER.info("Worker %s claimed %s.", worker_id, job)
+
+        try:
+            with Heartbeat(job_queue, job, worker_id):
+                ingest_job(job, context.db, context.raw_data_dir, context.systems)
+
+        except Exception as e:
+            LOGGER.error("Job %s failed: %s", job, e)
+            job_queue.fail(job, worker_id, str(e))
+            continue
+
+        if job_queue.complete(job, worker_id):
+            n_done += 1
+
+        else:
+            # The job was taken over, it gets ingested again, which is harmless.
+            LOGGER.warning("Worker %s lost its lease on %s.", worker_id, job)
+
+    LOGGER.info(
+        "Worker %s done after %s jobs, queue: %s", worker_id, n_done, job_queue.counts()
+    )
+
+    return n_done
@@ -3,13 +3,16 @@ Fixtures shared across all tests.
 """
 
 from dataclasses import astuple
+import json
 from json import load
 import os
 from pytest_cases import fixture
 import re
+import time
 
+import radiant_net_scraper.config as config
 import radiant_net_scraper.fronius_session as fsession
-from radiant_net_scraper.fronius_session import _FroniusSession
+from radiant_net_scraper.fronius_session import AsyncFroniusSession, _FroniusSession
 from test_infra.common_test_infra import arbitrary_json_test_group
 
 
@@ -22,6 +25,8 @@ def arbitrary_file_dummy_fronius_session(monkeypatch) -> None:
     dummy_secrets = {"username": "dummy", "password": "dummy", "fronius-id": "dummy"}
 
     monkeypatch.setattr(fsession, "get_fronius_secrets", lambda: dummy_secrets)
+    monkeypatch.setattr(config, "get_fronius_secrets", lambda: dummy_secrets)
+    monkeypatch.setattr(fsession, "get_session_cookie_path", lambda *args: None)
 
     arbitrary_chart_pair = {}
     chart_type_re = re.compile(r"_(consumption|production).json")
@@ -45,10 +50,34 @@ def arbitrary_file_dummy_fronius_session(monkeypatch) -> None:
         arbitrary_chart_pair[chart_type] = chart_data
 
     monkeypatch.setattr(_FroniusSession, "login", lambda *args, **kwargs: None)
-    monkeypatch.setattr(
-        _FroniusSession,
-        "get_chart",
-        lambda self, date, chart_type: arbitrary_chart_pair[chart_type],
-    )
+
+    def get_chart(
+        self, date, chart_type, fronius_id=None, interval="day", raw=False
+    ) -> dict | bytes:
+        chart = arbitrary_chart_pair[chart_type]
+
+        return json.dumps(chart).encode() if raw else chart
+
+    monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+    async def async_get_chart(self, *args, **kwargs) -> dict | bytes:
+        return get_chart(self.sync_session, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncFroniusSession, "get_chart", async_get_chart)
 
     return None
+
+
+@fixture
+def test_data_timezone(monkeypatch) -> None:
+    """
+    Use the time zone the test data was recorded in as the local one. Rows are split
+    into days in local time, and only there the test files don't share any days.
+    """
+    monkeypatch.setenv("TZ", "Europe/Vienna")
+    time.tzset()
+
+    yield
+
+    monkeypatch.undo()
+    time.tzset()
@@ -0,0 +1,199 @@
+import datetime as dt
+import multiprocessing
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from test_infra.common_test_infra import arbitrary_json_test_group
+
+from radiant_net_scraper import archive, data_parser, scrape
+from radiant_net_scraper.archive import (
+    convert_dir,
+    read_index,
+    read_member,
+    write_chart_files,
+)
+from radiant_net_scraper.files import checksum_path, write_files_atomically
+from radiant_net_scraper.planner import day_files_state
+
+
+def copy_test_days(output_dir: str, dates: list[dt.date]) -> None:
+    """
+    Copy a pair of test chart files into `output_dir` for each of `dates`.
+    """
+    group = arbitrary_json_test_group()
+
+    for date in dates:
+        for chart_type in scrape.CHART_TYPES:
+            shutil.copy(
+                getattr(group, chart_type),
+                scrape.chart_file_path(date, output_dir, chart_type),
+            )
+
+
+def count_raw_rows(db_path: str) -> int:
+    return (
+        sqlite3.connect(db_path).execute("SELECT COUNT(1) FROM raw_data").fetchone()[0]
+    )
+
+
+class TestWriteChartFiles:
+    @pytest.mark.parametrize("codec", ["gzip", "lzma"])
+    def test_round_trip(self, tmp_path, codec):
+        """
+        Test that charts end up in their month's archive and can be read back.
+        """
+        paths = [
+            f"{str(tmp_path)}/20240501_production.json",
+            f"{str(tmp_path)}/20240502_production.json",
+            f"{str(tmp_path)}/20240601_production.json",
+        ]
+
+        stored = write_chart_files({path: b'{"a": 1}' for path in paths}, codec=codec)
+
+        assert sorted(os.listdir(tmp_path)) == [
+            "202405.archive",
+            "202405.archive.lock",
+            "202406.archive",
+            "202406.archive.lock",
+        ]
+        assert (
+            stored[paths[0]]
+            == f"{str(tmp_path)}/202405.archive/20240501_production.json"
+        )
+
+        archive_path = f"{str(tmp_path)}/202405.archive"
+        assert sorted(read_index(archive_path)) == [
+            "20240501_production.json",
+            "20240502_production.json",
+        ]
+        assert read_member(archive_path, "20240502_production.json") == b'{"a": 1}'
+
+    def test_replace(self, tmp_path):
+        """
+        Test that writing a chart again replaces it, keeping the others.
+        """
+        path = f"{str(tmp_path)}/20240501_production.json"
+        other = f"{str(tmp_path)}/20240502_production.json"
+
+        write_chart_files({path: b"{}", other: b'{"b": 2}'}, codec="gzip")
+        write_chart_files({path: b'{"a": 1}'}, codec="gzip")
+
+        archive_path = f"{str(tmp_path)}/202405.archive"
+        assert read_member(archive_path, "20240501_production.json") == b'{"a": 1}'
+        assert read_member(archive_path, "20240502_production.json") == b'{"b": 2}'
+
+    @pytest.mark.skipif(archive.fcntl is None, reason="needs fcntl")
+    def test_concurrent_processes(self, tmp_path):
+        """
+        Test that processes writing to the same archive at once don't lose each
+        other's charts.
+        """
+        paths = [
+            f"{str(tmp_path)}/202405{day:02}_production.json" for day in range(1, 9)
+        ]
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=write_chart_files, args=({path: b"{}"}, "gzip"))
+            for path in paths
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        assert [process.exitcode for process in processes] == [0] * len(paths)
+        assert sorted(read_index(f"{str(tmp_path)}/202405.archive")) == sorted(
+            os.path.basename(path) for path in paths
+        )
+
+    def test_index_cache_bounded(self, tmp_path, monkeypatch):
+        """
+        Test that only the most recently read archive indices stay cached.
+        """
+        monkeypatch.setattr(archive, "INDEX_CACHE_SIZE", 2)
+        monkeypatch.setattr(archive, "_index_cache", archive.OrderedDict())
+        paths = [
+            f"{str(tmp_path)}/2024{month:02}01_production.json" for month in (1, 2, 3)
+        ]
+
+        write_chart_files({path: b"{}" for path in paths}, codec="gzip")
+
+        for month in (1, 2, 3, 2):
+            read_index(f"{str(tmp_path)}/2024{month:02}.archive")
+
+        assert list(archive._index_cache) == [
+            f"{str(tmp_path)}/202403.archive",
+            f"{str(tmp_path)}/202402.archive",
+        ]
+
+
+class TestConvertDir:
+    def test_parse_archived(self, tmp_path):
+        """
+        Test that converted dirs parse into the same data as plain ones.
+        """
+        plain_dir, archive_dir = tmp_path / "plain", tmp_path / "archive"
+        # The test charts hold the same timestamps whatever their date, so only one day.
+        dates = [dt.date(2024, 5, 1)]
+
+        for output_dir in (plain_dir, archive_dir):
+            output_dir.mkdir()
+            copy_test_days(f"{str(output_dir)}/", dates)
+
+        assert convert_dir(str(archive_dir)) == 2
+        assert sorted(os.listdir(archive_dir)) == [
+            "202405.archive",
+            "202405.archive.lock",
+        ]
+
+        for output_dir in (plain_dir, archive_dir):
+            data_parser.parse_json_data(
+                input_dir=str(output_dir), db_path=f"{str(output_dir)}.sqlite3"
+            )
+
+        assert count_raw_rows(f"{str(archive_dir)}.sqlite3") > 0
+        assert count_raw_rows(f"{str(archive_dir)}.sqlite3") == count_raw_rows(
+            f"{str(plain_dir)}.sqlite3"
+        )
+
+    def test_corrupt_file_kept(self, tmp_path):
+        """
+        Test that files not matching their checksum are neither archived nor removed.
+        """
+        good = f"{str(tmp_path)}/20240501_production.json"
+        corrupt = f"{str(tmp_path)}/20240502_production.json"
+        write_files_atomically({good: b'{"a": 1}', corrupt: b'{"b": 2}'})
+
+        with open(corrupt, "wb") as outfile:
+            outfile.write(b'{"b"')
+
+        assert convert_dir(str(tmp_path)) == 1
+        assert sorted(read_index(f"{str(tmp_path)}/202405.archive")) == [
+            "20240501_production.json"
+        ]
+        assert not os.path.exists(good)
+        assert os.path.exists(corrupt)
+        assert os.path.exists(checksum_path(corrupt))
+
+
+class TestScrapeIntoArchive:
+    def test_planner(self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path):
+        """
+        Test that scraped days go into archives, and are seen there by the planner.
+        """
+        monkeypatch.setattr(scrape, "get_raw_data_archive_codec", lambda: "lzma")
+        output_dir = f"{str(tmp_path)}/"
+        date = dt.date(2024, 5, 1)
+
+        assert day_files_state(date, output_dir) == "missing"
+
+        group = scrape.save_day_charts_to_files(date, output_dir)
+
+        assert sorted(os.listdir(tmp_path)) == ["202405.archive", "202405.archive.lock"]
+        assert data_parser.load_daily_usage_json(group.production)
+        assert day_files_state(date, output_dir) == "complete"
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+
+from test_infra.common_test_infra import check_db, json_test_file_groups
+
+from radiant_net_scraper import backup, data_parser
+
+
+def ingest_test_files(db_path: str, **kwargs) -> None:
+    """
+    Ingest all the test files into the DB at `db_path`.
+    """
+    data_parser.parse_json_data_from_file_pair_list(
+        json_test_file_groups(), db_path=db_path, **kwargs
+    )
+
+
+class TestGetDbFiles:
+    def test_no_side_effects(self, tmp_path):
+        """
+        Test that the shards get listed without touching the DB, e.g. by creating or
+        migrating tables.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        shard_path = f"{str(tmp_path)}/generation_and_usage.raw_2008.sqlite3"
+
+        for path in (db_path, shard_path):
+            sqlite3.connect(path).close()
+
+        assert backup.get_db_files(db_path) == [db_path, shard_path]
+
+        with sqlite3.connect(db_path) as db_conn:
+            assert db_conn.execute("SELECT * FROM sqlite_master").fetchall() == []
+
+
+class TestSnapshotFiles:
+    def test_success(self, tmp_path):
+        """
+        Test that a snapshot contains a usable copy of the DB.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        ingest_test_files(db_path)
+
+        snapshot_dir = backup.snapshot_files(
+            backup.get_db_files(db_path), f"{str(tmp_path)}/backups", pages_per_step=1
+        )
+
+        check_db(f"{snapshot_dir}/generation_and_usage.sqlite3")
+
+    def test_incremental(self, tmp_path):
+        """
+        Test that unchanged files get linked, while changed ones get copied again.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        target_dir = f"{str(tmp_path)}/backups"
+        ingest_test_files(db_path, shard_by_year=True)
+
+        db_files = backup.get_db_files(db_path)
+        shard_name = os.path.basename(db_files[1])
+
+        first = backup.snapshot_files(db_files, target_dir)
+
+        with sqlite3.connect(db_path) as db_conn:
+            db_conn.execute("DELETE FROM daily_aggregated WHERE day = 17")
+
+        second = backup.snapshot_files(db_files, target_dir)
+
+        assert os.path.samefile(f"{first}/{shard_name}", f"{second}/{shard_name}")
+        assert not os.path.samefile(
+            f"{first}/generation_and_usage.sqlite3",
+            f"{second}/generation_and_usage.sqlite3",
+        )
+
+    def test_keep(self, tmp_path):
+        """
+        Test that only the newest `keep` snapshots are retained.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        target_dir = f"{str(tmp_path)}/backups"
+        ingest_test_files(db_path)
+
+        snapshots = [
+            backup.snapshot_files([db_path], target_dir, keep=2) for _ in range(3)
+        ]
+
+        assert backup.list_snapshots(target_dir) == snapshots[1:]
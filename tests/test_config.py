@@ -3,6 +3,8 @@ Tests for the config module.
 """
 
 import configparser as cfp
+import logging
+import os
 
 from json import dump
 from pytest import raises
@@ -196,3 +198,116 @@ class TestInitConfig:
         config._init_config()
 
         assert config.Config.get_config() == expected
+
+
+class TestGetFroniusSystems:
+    """
+    Test config.get_fronius_systems.
+    """
+
+    def make_config(self, config_dict: dict) -> cfp.ConfigParser:
+        config_obj = cfp.ConfigParser(allow_no_value=True)
+        config_obj.read_dict(
+            {"secrets": {"username": "me", "password": "0451", "fronius-id": "1"}}
+        )
+        config_obj.read_dict(config_dict)
+
+        return config_obj
+
+    def test_default(self, monkeypatch):
+        """
+        Test that without system sections, the system in `secrets` is used.
+        """
+        monkeypatch.setattr(config.Config, "_config_obj", self.make_config({}))
+
+        assert config.get_fronius_systems() == [
+            {"name": "default", "username": "me", "password": "0451", "fronius-id": "1"}
+        ]
+
+    def test_systems(self, monkeypatch):
+        """
+        Test that system sections get read, falling back to the `secrets` account.
+        """
+        config_obj = self.make_config(
+            {
+                "system:roof": {"fronius-id": "2"},
+                "system:barn": {
+                    "username": "you",
+                    "password": "1234",
+                    "fronius-id": "3",
+                },
+            }
+        )
+        monkeypatch.setattr(config.Config, "_config_obj", config_obj)
+
+        assert config.get_fronius_systems() == [
+            {"name": "roof", "username": "me", "password": "0451", "fronius-id": "2"},
+            {"name": "barn", "username": "you", "password": "1234", "fronius-id": "3"},
+        ]
+
+    def test_missing_id(self, monkeypatch):
+        """
+        Test that an error gets raised for systems without an ID.
+        """
+        config_obj = self.make_config({"system:roof": {"username": "you"}})
+        monkeypatch.setattr(config.Config, "_config_obj", config_obj)
+
+        with raises(ValueError):
+            config.get_fronius_systems()
+
+
+class TestReload:
+    """
+    Test reloading the config with config.Config.reload_if_changed.
+    """
+
+    def test_reload(self, monkeypatch, tmp_path):
+        """
+        Test that the config is reloaded once a file changed, subscribers get the new
+        config, and a broken file leaves the current config in place.
+        """
+        default_config_path = config.get_config_paths()["default"]
+        user_config_path = tmp_path / "config.json"
+        user_config_path.write_text('{"logging": {"level": "info"}}')
+
+        monkeypatch.setattr(
+            config,
+            "get_config_paths",
+            lambda: {
+                "default": default_config_path,
+                "site": str(tmp_path / "missing.json"),
+                "user": str(user_config_path),
+            },
+        )
+        monkeypatch.setattr(config.Config, "_config_obj", None)
+        monkeypatch.setattr(config.Config, "_subscribers", [])
+        monkeypatch.setattr(logging.getLogger(), "level", logging.getLogger().level)
+
+        received = []
+        config.Config.subscribe(received.append)
+        config.Config.get_config()
+
+        assert not config.Config.reload_if_changed()
+
+        user_config_path.write_text('{"logging": {"level": "debug"}}')
+        os.utime(user_config_path, (0, 0))
+
+        assert config.Config.reload_if_changed()
+        assert received == [config.Config.get_config()]
+        assert config.Config.get_config()["logging"]["level"] == "debug"
+        assert logging.getLogger().level == logging.DEBUG
+        assert not config.Config.reload_if_changed()
+
+        user_config_path.write_text('{"logging": ')
+        os.utime(user_config_path, (1, 1))
+
+        assert not config.Config.reload_if_changed()
+        assert config.Config.get_config()["logging"]["level"] == "debug"
+        assert len(received) == 1
+
+        user_config_path.write_text('{"logging": {"level": "loud"}}')
+        os.utime(user_config_path, (2, 2))
+
+        assert not config.Config.reload_if_changed()
+        assert config.Config.get_config()["logging"]["level"] == "debug"
+        assert len(received) == 1
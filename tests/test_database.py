@@ -0,0 +1,168 @@
+import datetime as dt
+import os
+import stat
+
+import pandas as pd
+import pytest
+import sqlite3
+
+from test_infra.common_test_infra import json_test_file_groups
+
+from radiant_net_scraper import data_parser
+from radiant_net_scraper.database import Database
+
+
+def raw_rows(*dates: dt.date) -> pd.DataFrame:
+    """
+    Construct a minimal raw data frame with a single row for each of `dates`.
+    """
+    return pd.DataFrame(
+        {
+            "FromGen": [1.0] * len(dates),
+            "time": [
+                int(dt.datetime(d.year, d.month, d.day).timestamp() * 1e3)
+                for d in dates
+            ],
+            "year": [d.year for d in dates],
+            "month": [d.month for d in dates],
+            "day": [d.day for d in dates],
+            "hour": [0] * len(dates),
+            "minute": [0] * len(dates),
+        }
+    )
+
+
+class TestShardByYear:
+    def test_ingest(self, tmp_path):
+        """
+        Test that ingesting into a sharded DB puts raw data into per-year files.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+
+        data_parser.parse_json_data_from_file_pair_list(
+            json_test_file_groups(), db_path=db_path, shard_by_year=True
+        )
+
+        db = Database(db_path, shard_by_year=True)
+
+        assert db.get_shard_years() == [2008]
+        assert len(db.get_raw_data_df(dt.date(2008, 1, 1), dt.date(2008, 12, 31))) > 0
+
+    def test_range_query(self, tmp_path):
+        """
+        Test that range queries union across exactly the requested shards.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3", shard_by_year=True)
+        db.insert_raw_data_df(
+            raw_rows(dt.date(2021, 6, 1), dt.date(2022, 6, 1), dt.date(2023, 6, 1))
+        )
+
+        assert db.get_shard_years() == [2021, 2022, 2023]
+
+        range_df = db.get_raw_data_df(dt.date(2021, 6, 1), dt.date(2022, 12, 31))
+        assert list(range_df["year"]) == [2021, 2022]
+
+        assert db.get_raw_data_df(dt.date(2019, 1, 1), dt.date(2019, 12, 31)).empty
+
+    def test_matches_unsharded(self, tmp_path):
+        """
+        Test that sharded and unsharded DBs return the same data.
+        """
+        rows = raw_rows(dt.date(2021, 12, 31), dt.date(2022, 1, 1))
+
+        sharded = Database(f"{str(tmp_path)}/sharded.sqlite3", shard_by_year=True)
+        plain = Database(f"{str(tmp_path)}/plain.sqlite3")
+
+        for db in (sharded, plain):
+            db.insert_raw_data_df(rows)
+
+        start, end = dt.date(2021, 1, 1), dt.date(2022, 12, 31)
+        pd.testing.assert_frame_equal(
+            sharded.get_raw_data_df(start, end)[rows.columns],
+            plain.get_raw_data_df(start, end)[rows.columns],
+        )
+
+    def test_frozen_shard(self, tmp_path):
+        """
+        Test that frozen shards can still be read but are no longer written to.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3", shard_by_year=True)
+        db.insert_raw_data_df(raw_rows(dt.date(2021, 6, 1), dt.date(2022, 6, 1)))
+
+        frozen = db.freeze_shards(before_year=2022)
+
+        assert frozen == [db.get_shard_path(2021)]
+        assert not os.stat(db.get_shard_path(2021)).st_mode & stat.S_IWUSR
+        assert len(db.get_raw_data_df(dt.date(2021, 1, 1), dt.date(2021, 12, 31))) == 1
+
+        with pytest.raises(PermissionError):
+            db.insert_raw_data_df(raw_rows(dt.date(2021, 7, 1)))
+
+
+class TestSystemId:
+    def test_same_time_different_systems(self, tmp_path):
+        """
+        Test that data of different systems with the same timestamps coexist.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        rows = raw_rows(dt.date(2022, 6, 1))
+
+        db.insert_raw_data_df(rows, system_id="roof")
+        db.insert_raw_data_df(rows, system_id="barn")
+
+        day = dt.date(2022, 6, 1)
+        assert len(db.get_raw_data_df(day, day)) == 2
+        assert list(db.get_raw_data_df(day, day, system_id="barn")["system_id"]) == [
+            "barn"
+        ]
+
+        with pytest.raises(Warning):
+            db.insert_raw_data_df(rows, system_id="roof")
+
+    def test_migration(self, tmp_path):
+        """
+        Test that tables created before systems existed get migrated, keeping data.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+
+        with sqlite3.connect(db_path) as db_conn:
+            db_conn.execute(
+                "CREATE TABLE raw_data (FromGen REAL, time INTEGER NOT NULL UNIQUE, "
+                "year INTEGER NOT NULL, month INTEGER NOT NULL, day INTEGER NOT NULL, "
+                "hour INTEGER NOT NULL, minute INTEGER NOT NULL, PRIMARY KEY (time))"
+            )
+            raw_rows(dt.date(2022, 6, 1)).to_sql(
+                "raw_data", db_conn, if_exists="append", index=False
+            )
+
+        db = Database(db_path)
+        day = dt.date(2022, 6, 1)
+
+        assert list(db.get_raw_data_df(day, day)["system_id"]) == ["default"]
+
+        db.insert_raw_data_df(raw_rows(day), system_id="roof")
+        assert len(db.get_raw_data_df(day, day)) == 2
+
+
+class TestTransaction:
+    @pytest.mark.parametrize("shard_by_year", [False, True], ids=["plain", "sharded"])
+    def test_rollback(self, tmp_path, shard_by_year):
+        """
+        Test that writes within a failing transaction are all rolled back, those of
+        one leaving it without errors all committed.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3", shard_by_year=shard_by_year)
+        day = dt.date(2022, 6, 1)
+
+        with db.transaction():
+            db.insert_raw_data_df(raw_rows(day))
+
+        with pytest.raises(KeyboardInterrupt):
+            with db.transaction():
+                db.delete_raw_data(day, day)
+                db.insert_raw_data_df(raw_rows(dt.date(2023, 6, 1)))
+                db.set_journal_state(["chart.json"], "committed")
+                raise KeyboardInterrupt()
+
+        assert len(db.get_raw_data_df(dt.date(2022, 1, 1), dt.date(2023, 12, 31))) == 1
+        assert db.get_journal_states(["chart.json"]) == {}
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from radiant_net_scraper.files import (
+    checksum_path,
+    read_verified,
+    write_files_atomically,
+)
+
+
+class TestWriteFilesAtomically:
+    def test_round_trip(self, tmp_path):
+        """
+        Test that written files can be read back, with their checksums verified.
+        """
+        path = str(tmp_path / "chart.json")
+
+        write_files_atomically({path: b'{"a": 1}'})
+
+        assert read_verified(path) == b'{"a": 1}'
+        assert os.path.exists(checksum_path(path))
+        assert sorted(os.listdir(tmp_path)) == ["chart.json", "chart.json.sha256"]
+
+    def test_chunks(self, tmp_path):
+        """
+        Test that contents given as chunks get streamed to the file.
+        """
+        path = str(tmp_path / "chart.json")
+
+        write_files_atomically({path: iter([b'{"a"', b": 1}"])})
+
+        assert read_verified(path) == b'{"a": 1}'
+
+    def test_crash_between_renames(self, monkeypatch, tmp_path):
+        """
+        Test that a file still matches its sidecar should the process crash between
+        renaming the sidecar and the file into place when overwriting it.
+        """
+        path = str(tmp_path / "chart.json")
+        write_files_atomically({path: b'{"a": 1}'})
+
+        replace = os.replace
+
+        def crash_on_data(src, dst):
+            if dst == path:
+                raise KeyboardInterrupt
+
+            replace(src, dst)
+
+        monkeypatch.setattr(os, "replace", crash_on_data)
+
+        with pytest.raises(KeyboardInterrupt):
+            write_files_atomically({path: b'{"a": 2}'})
+
+        monkeypatch.undo()
+
+        assert read_verified(path) == b'{"a": 1}'
+
+        write_files_atomically({path: b'{"a": 2}'})
+
+        assert read_verified(path) == b'{"a": 2}'
+
+    def test_corrupt(self, tmp_path):
+        """
+        Test that files not matching their checksum are rejected when read.
+        """
+        path = str(tmp_path / "chart.json")
+        write_files_atomically({path: b'{"a": 1}'})
+
+        with open(path, "wb") as outfile:
+            outfile.write(b'{"a": ')
+
+        with pytest.raises(ValueError):
+            read_verified(path)
+
+    def test_no_sidecar(self, tmp_path):
+        """
+        Test that files from before checksums existed are read as they are.
+        """
+        path = tmp_path / "chart.json"
+        path.write_text("{}")
+
+        assert read_verified(str(path)) == b"{}"
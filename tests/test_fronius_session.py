@@ -0,0 +1,322 @@
+import asyncio
+import datetime as dt
+import threading
+import os
+
+import httpx
+import pytest
+import requests as rq
+
+import radiant_net_scraper.fronius_session as fsession
+from radiant_net_scraper.fronius_session import (
+    AsyncFroniusSession,
+    FroniusSession,
+    _FroniusSession,
+)
+from radiant_net_scraper.resilience import RetryPolicy
+
+
+def make_response(content: bytes, redirected: bool = False) -> rq.Response:
+    """
+    Construct a response as returned by `requests`, optionally as the end of a redirect.
+    """
+    response = rq.Response()
+    response.status_code = 200
+    response._content = content
+    response.url = "https://www.solarweb.com/Chart/GetChartNew"
+
+    if redirected:
+        response.url = "https://login.fronius.com/"
+        response.history = [rq.Response()]
+
+    return response
+
+
+@pytest.fixture
+def offline_session(monkeypatch) -> _FroniusSession:
+    """
+    Provide a session which counts logins and doesn't check with Solarweb whether it is
+    logged in.
+    """
+    monkeypatch.setattr(
+        fsession,
+        "get_fronius_secrets",
+        lambda: {"username": "dummy", "password": "dummy", "fronius-id": "dummy"},
+    )
+    monkeypatch.setattr(fsession, "get_session_cookie_path", lambda *args: None)
+    monkeypatch.setattr(FroniusSession, "_sessions", {})
+
+    def count_login(self):
+        self.n_logins = getattr(self, "n_logins", 0) + 1
+
+    def fail_is_logged_in(self):
+        raise AssertionError("Landing page should not have been requested.")
+
+    monkeypatch.setattr(_FroniusSession, "login", count_login)
+    monkeypatch.setattr(_FroniusSession, "is_logged_in", fail_is_logged_in)
+
+    return FroniusSession.get_session()
+
+
+class TestGetSession:
+    def test_cached_validity(self, offline_session):
+        """
+        Test that a freshly validated session gets reused without a round trip.
+        """
+        assert FroniusSession.get_session() is offline_session
+        assert offline_session.n_logins == 1
+
+    def test_expired_validity(self, offline_session, monkeypatch):
+        """
+        Test that the session gets checked again once the TTL has passed.
+        """
+        offline_session.validated_at -= 1e6
+        monkeypatch.setattr(_FroniusSession, "is_logged_in", lambda self: True)
+
+        assert FroniusSession.get_session() is offline_session
+        assert offline_session.is_fresh(60)
+        assert offline_session.n_logins == 1
+
+    def test_concurrent_revalidation(self, offline_session, monkeypatch):
+        """
+        Test that callers finding the session stale at the same time only log in once.
+        """
+        offline_session.validated_at -= 1e6
+        n_checks = []
+
+        def is_logged_out(self):
+            n_checks.append(1)
+            # Give the other callers time to pile up.
+            threading.Event().wait(0.1)
+
+            return False
+
+        monkeypatch.setattr(_FroniusSession, "is_logged_in", is_logged_out)
+
+        callers = [
+            threading.Thread(target=FroniusSession.get_session) for _ in range(8)
+        ]
+
+        for caller in callers:
+            caller.start()
+
+        for caller in callers:
+            caller.join()
+
+        assert len(n_checks) == 1
+        assert offline_session.n_logins == 2
+
+
+class TestGetChart:
+    def test_success(self, offline_session, monkeypatch):
+        """
+        Test that charts get returned without logging in again.
+        """
+        monkeypatch.setattr(
+            offline_session.session,
+            "request",
+            lambda *_, **__: make_response(b'{"a": 1}'),
+        )
+
+        assert offline_session.get_chart(dt.date.today()) == {"a": 1}
+        assert offline_session.n_logins == 1
+
+    @pytest.mark.parametrize(
+        "rejection",
+        [make_response(b"{}", redirected=True), make_response(b"<html></html>")],
+        ids=["redirected", "not_json"],
+    )
+    def test_relogin(self, offline_session, monkeypatch, rejection):
+        """
+        Test that a rejected chart request leads to logging in again and retrying.
+        """
+        responses = [rejection, make_response(b'{"a": 1}')]
+        monkeypatch.setattr(
+            offline_session.session, "request", lambda *_, **__: responses.pop(0)
+        )
+
+        assert offline_session.get_chart(dt.date.today()) == {"a": 1}
+        assert offline_session.n_logins == 2
+
+    def test_persistent_rejection(self, offline_session, monkeypatch):
+        """
+        Test that an error gets raised if logging in again doesn't help.
+        """
+        monkeypatch.setattr(
+            offline_session.session,
+            "request",
+            lambda *_, **__: make_response(b"{}", redirected=True),
+        )
+
+        with pytest.raises(ValueError):
+            offline_session.get_chart(dt.date.today())
+
+    def test_transient_failure(self, offline_session, monkeypatch):
+        """
+        Test that transient failures get retried without logging in again.
+        """
+        unavailable = make_response(b"")
+        unavailable.status_code = 503
+        responses = [rq.ConnectTimeout(), unavailable, make_response(b'{"a": 1}')]
+
+        def respond(*_, **__):
+            response = responses.pop(0)
+
+            if isinstance(response, Exception):
+                raise response
+
+            return response
+
+        monkeypatch.setattr(offline_session.session, "request", respond)
+        offline_session.retry_policy = RetryPolicy(backoff_base=0)
+
+        assert offline_session.get_chart(dt.date.today()) == {"a": 1}
+        assert offline_session.n_logins == 1
+        assert offline_session.stats.snapshot() == {
+            "timeout": 1,
+            "server_error": 1,
+            "retry": 2,
+            "success": 1,
+        }
+
+
+class TestPersistentCookies:
+    def test_round_trip(self, offline_session, tmp_path):
+        """
+        Test that a new session picks up saved cookies instead of logging in.
+        """
+        cookie_path = f"{str(tmp_path)}/session/session.json"
+
+        offline_session.cookie_path = cookie_path
+        offline_session.session_key = "abc-123"
+        offline_session.session.cookies.set("auth", "secret", domain=".solarweb.com")
+        offline_session.save_cookies()
+
+        assert os.stat(cookie_path).st_mode & 0o777 == 0o600
+
+        restored = _FroniusSession("dummy", "dummy", "dummy", cookie_path=cookie_path)
+
+        assert not hasattr(restored, "n_logins")
+        assert restored.session_key == "abc-123"
+        assert restored.session.cookies.get("auth", domain=".solarweb.com") == "secret"
+        assert restored.is_fresh(60)
+
+    def test_other_user(self, offline_session, tmp_path):
+        """
+        Test that saved cookies of a different user are ignored.
+        """
+        cookie_path = f"{str(tmp_path)}/session.json"
+
+        offline_session.cookie_path = cookie_path
+        offline_session.session.cookies.set("auth", "secret", domain=".solarweb.com")
+        offline_session.save_cookies()
+
+        restored = _FroniusSession("other", "dummy", "dummy", cookie_path=cookie_path)
+
+        assert restored.n_logins == 1
+
+
+class TestAsyncFroniusSession:
+    def test_concurrency_limit(self, offline_session):
+        """
+        Test that charts get fetched concurrently on the event loop, but no more than
+        allowed at once.
+        """
+        in_flight = []
+        max_in_flight = []
+
+        async def slow_chart(request: httpx.Request) -> httpx.Response:
+            in_flight.append(request)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(request)
+
+            return httpx.Response(200, content=b'{"chart": 1}')
+
+        offline_session.rate_limiter = None
+        asession = AsyncFroniusSession(
+            offline_session,
+            max_concurrency=3,
+            transport=httpx.MockTransport(slow_chart),
+        )
+
+        async def fetch_all():
+            try:
+                return await asyncio.gather(
+                    *[
+                        asession.get_chart(dt.date(2024, 1, day), "production")
+                        for day in range(1, 11)
+                    ]
+                )
+
+            finally:
+                await asession.close()
+
+        n_threads = threading.active_count()
+        charts = asyncio.run(fetch_all())
+
+        assert charts[0] == {"chart": 1}
+        assert max(max_in_flight) == 3
+        assert threading.active_count() == n_threads
+
+    def test_shared_session_state(self, offline_session):
+        """
+        Test that the cookies of the regular session are sent, and its connection pool
+        is left alone.
+        """
+        adapter = offline_session.session.get_adapter("https://")
+        offline_session.session.cookies.set("auth", "secret", domain=".solarweb.com")
+        cookies = []
+
+        def chart(request: httpx.Request) -> httpx.Response:
+            cookies.append(request.headers.get("cookie"))
+
+            return httpx.Response(200, content=b"{}")
+
+        asession = AsyncFroniusSession(
+            offline_session, transport=httpx.MockTransport(chart)
+        )
+
+        async def fetch():
+            try:
+                return await asession.get_chart(dt.date(2024, 1, 1), raw=True)
+
+            finally:
+                await asession.close()
+
+        assert asyncio.run(fetch()) == b"{}"
+        assert cookies == ["auth=secret"]
+        assert offline_session.session.get_adapter("https://") is adapter
+
+    def test_expired(self, offline_session):
+        """
+        Test that a rejected chart request logs in again through the regular session,
+        and gets retried.
+        """
+        expired = [True]
+
+        def chart(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "login.fronius.com":
+                return httpx.Response(200, content=b"<html></html>")
+
+            if expired.pop() if expired else False:
+                return httpx.Response(
+                    302, headers={"location": "https://login.fronius.com/"}
+                )
+
+            return httpx.Response(200, content=b'{"chart": 1}')
+
+        asession = AsyncFroniusSession(
+            offline_session, transport=httpx.MockTransport(chart)
+        )
+
+        async def fetch():
+            try:
+                return await asession.get_chart(dt.date(2024, 1, 1))
+
+            finally:
+                await asession.close()
+
+        assert asyncio.run(fetch()) == {"chart": 1}
+        # Once when the session was created, and again once it expired.
+        assert offline_session.n_logins == 2
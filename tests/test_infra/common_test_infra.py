@@ -1,5 +1,6 @@
 from itertools import groupby
 from dataclasses import astuple
+import datetime as dt
 import glob
 import os
 import re
@@ -19,9 +20,13 @@ def check_db(expected_db_path: str, expect_rows: bool = True) -> None:
 
     db_conn = sqlite3.connect(expected_db_path)
     db_cursor = db_conn.cursor()
-    table_info = db_cursor.execute(TABLE_QUERY).fetchall()
+    table_info = [
+        table
+        for table in db_cursor.execute(TABLE_QUERY).fetchall()
+        if table[0] != "ingest_journal"
+    ]
 
-    # Ensure the db has the right number of tables
+    # Ensure the db has the right number of data tables
     assert len(table_info) == 2
 
     # Ensure each table contains data.
@@ -83,3 +88,25 @@ def arbitrary_json_test_group() -> ChartFileGroup | None:
             return group
 
     return None
+
+
+def day_chart(date: dt.date, n_points: int, series_id: str) -> dict:
+    """
+    Construct a minimal day chart holding the first `n_points` 5 minute values.
+    """
+    start = dt.datetime.combine(date, dt.time())
+
+    return {
+        "isPremiumFeature": False,
+        "settings": {
+            "series": [
+                {
+                    "id": series_id,
+                    "data": [
+                        [(start + dt.timedelta(minutes=5 * i)).timestamp() * 1e3, 1e3]
+                        for i in range(n_points)
+                    ],
+                }
+            ]
+        },
+    }
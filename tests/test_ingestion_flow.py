@@ -1,11 +1,282 @@
+import asyncio
+import datetime as dt
+import json
 import os
+import signal
+import sqlite3
+import threading
+
+from configparser import ConfigParser
+
+import pandas as pd
+import pytest
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+from test_infra.common_test_infra import day_chart
 
 from radiant_net_scraper import ingestion_flow
+from radiant_net_scraper.config import Config
+from radiant_net_scraper.context import AppContext
+from radiant_net_scraper.fronius_session import _FroniusSession
+
+SYSTEMS = [
+    {"name": "default", "username": "a", "password": "a", "fronius-id": "1"},
+    {"name": "barn", "username": "b", "password": "b", "fronius-id": "2"},
+]
+
+
+@pytest.fixture
+def restored_signal_handlers() -> None:
+    """
+    Restore the handlers of the signals the daemon handles once the test is done.
+    """
+    signums = [signal.SIGTERM]
+
+    if hasattr(signal, "SIGHUP"):
+        signums.append(signal.SIGHUP)
+
+    handlers = {signum: signal.getsignal(signum) for signum in signums}
+
+    try:
+        yield
+
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
 
 
 class TestIngestDay:
     def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
         ingestion_flow.ingest_day(
-            scraping_kwargs={"output_dir": f"{str(tmpdir)}/"},
+            scraping_kwargs={"output_dir": f"{str(tmpdir)}/", "lookback_days": 1},
             parsing_kwargs={"db_path": str(tmpdir) + "/generation_and_usage.sqlite3"},
         )
+
+    def test_skip_complete(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        """
+        Test that days already scraped completely don't get scraped again.
+        """
+        kwargs = {
+            "scraping_kwargs": {"output_dir": f"{str(tmpdir)}/", "lookback_days": 1},
+            "parsing_kwargs": {"db_path": str(tmpdir) + "/db.sqlite3"},
+        }
+
+        ingestion_flow.ingest_day(**kwargs)
+        mtimes = {path: path.mtime() for path in tmpdir.listdir("*.json")}
+
+        ingestion_flow.ingest_day(**kwargs)
+
+        assert {path: path.mtime() for path in tmpdir.listdir("*.json")} == mtimes
+
+
+class TestAsyncIngestDays:
+    def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        db_path = str(tmpdir) + "/generation_and_usage.sqlite3"
+
+        asyncio.run(
+            ingestion_flow.async_ingest_days(
+                dt.date(2024, 1, 1),
+                dt.date(2024, 1, 1),
+                scraping_kwargs={"output_dir": f"{str(tmpdir)}/"},
+                parsing_kwargs={"db_path": db_path},
+            )
+        )
+
+        n_rows = (
+            sqlite3.connect(db_path)
+            .execute("SELECT COUNT(1) FROM raw_data")
+            .fetchone()[0]
+        )
+
+        assert n_rows > 0
+
+
+class TestIngestDayMultiSystem:
+    def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        db_path = str(tmpdir) + "/generation_and_usage.sqlite3"
+
+        ingestion_flow.ingest_day(
+            scraping_kwargs={"output_dir": f"{str(tmpdir)}/", "lookback_days": 1},
+            parsing_kwargs={"db_path": db_path},
+            systems=SYSTEMS,
+        )
+
+        system_ids = (
+            sqlite3.connect(db_path)
+            .execute("SELECT DISTINCT system_id FROM raw_data ORDER BY system_id")
+            .fetchall()
+        )
+
+        assert system_ids == [("barn",), ("default",)]
+        assert len(tmpdir.join("barn").listdir("*.json")) == 2
+
+
+class TestAppContext:
+    def test_shared_db(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        """
+        Test that systems ingested concurrently share the context's DB connection,
+        which stays open until the context is closed.
+        """
+        db_path = str(tmpdir) + "/generation_and_usage.sqlite3"
+
+        with AppContext(db_path=db_path, systems=SYSTEMS) as context:
+            ingestion_flow.ingest_day(
+                scraping_kwargs={"output_dir": f"{str(tmpdir)}/", "lookback_days": 1},
+                systems=context.systems,
+                db_handler=context.db,
+            )
+
+            system_ids = context.db.db_conn.execute(
+                "SELECT DISTINCT system_id FROM raw_data ORDER BY system_id"
+            ).fetchall()
+            assert [tuple(row) for row in system_ids] == [("barn",), ("default",)]
+
+        with pytest.raises(sqlite3.ProgrammingError):
+            context.db.db_conn.execute("SELECT 1")
+
+    def test_sigterm(
+        self,
+        arbitrary_file_dummy_fronius_session,
+        restored_signal_handlers,
+        monkeypatch,
+        tmpdir,
+    ):
+        """
+        Test that SIGTERM shuts the daemon down and closes its context, shutting the
+        scheduler down outside of the signal handler.
+        """
+        contexts = []
+        shutdown_threads = []
+        shutdown = BlockingScheduler.shutdown
+
+        def recorded_shutdown(self, *args, **kwargs):
+            shutdown_threads.append(threading.current_thread())
+            shutdown(self, *args, **kwargs)
+
+        def app_context():
+            contexts.append(
+                AppContext(db_path=str(tmpdir) + "/db.sqlite3", systems=SYSTEMS)
+            )
+
+            return contexts[-1]
+
+        monkeypatch.setattr(ingestion_flow, "AppContext", app_context)
+        monkeypatch.setattr(BlockingScheduler, "shutdown", recorded_shutdown)
+        threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+
+        ingestion_flow.run_ingestion_continuously()
+
+        assert len(shutdown_threads) == 1
+        assert shutdown_threads[0] is not threading.main_thread()
+
+        with pytest.raises(sqlite3.ProgrammingError):
+            contexts[0].db.db_conn.execute("SELECT 1")
+
+
+class TestScheduleJobs:
+    def test_jobs(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        """
+        Test that a catch-up runs on start-up, and the daily run at a fixed time.
+        """
+        scheduler = BlockingScheduler()
+
+        with AppContext(
+            db_path=str(tmpdir) + "/db.sqlite3", systems=SYSTEMS
+        ) as context:
+            ingestion_flow.schedule_jobs(scheduler, context)
+
+        jobs = {job.id: job for job in scheduler.get_jobs()}
+        daily_trigger = jobs["ingest_day"].trigger
+
+        assert set(jobs) == {"catch_up", "config_check", "ingest_day"}
+        assert isinstance(daily_trigger, CronTrigger)
+        assert str(daily_trigger.fields[5]) == "1"
+        assert str(daily_trigger.fields[6]) == "30"
+        assert daily_trigger.jitter == 600
+        assert jobs["ingest_day"].coalesce
+        assert jobs["ingest_day"].misfire_grace_time == 3600
+
+
+class TestApplyConfig:
+    def test_reloaded(self, arbitrary_file_dummy_fronius_session, monkeypatch, tmpdir):
+        """
+        Test that a reloaded config reschedules the jobs whose settings changed, and
+        reaches the DB connection.
+        """
+        scheduler = BackgroundScheduler()
+        scheduler.start(paused=True)
+
+        with AppContext(
+            db_path=str(tmpdir) + "/db.sqlite3", systems=SYSTEMS
+        ) as context:
+            previous = context.config
+            ingestion_flow.schedule_jobs(scheduler, context)
+            config_check_trigger = scheduler.get_job("config_check").trigger
+
+            reloaded = ConfigParser(allow_no_value=True)
+            reloaded.read_dict(previous)
+            reloaded["retention"]["enabled"] = "true"
+            reloaded["database"]["cache_size_kib"] = "4096"
+            monkeypatch.setattr(Config, "_config_obj", reloaded)
+
+            ingestion_flow.apply_schedule(scheduler, context, reloaded, previous)
+            context.apply_config(reloaded)
+
+            cache_size = context.db.db_conn.execute("PRAGMA cache_size").fetchone()[0]
+
+        jobs = {job.id: job for job in scheduler.get_jobs()}
+        scheduler.shutdown(wait=False)
+
+        assert set(jobs) == {"catch_up", "config_check", "ingest_day", "retention"}
+        assert jobs["config_check"].trigger is config_check_trigger
+        assert cache_size == -4096
+
+
+class TestCatchUp:
+    def test_gaps_filled(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmpdir
+    ):
+        """
+        Test that catching up ingests the days missing from the DB.
+        """
+        series_ids = {"production": "FromGen", "consumption": "ToConsumer"}
+
+        def get_chart(
+            self, date, chart_type, fronius_id=None, interval="day", raw=False
+        ):
+            chart = day_chart(date, 12, series_ids[chart_type])
+
+            return json.dumps(chart).encode() if raw else chart
+
+        monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+        today = dt.date.today()
+        first_day = today - dt.timedelta(days=4)
+
+        with AppContext(
+            db_path=str(tmpdir) + "/db.sqlite3", systems=SYSTEMS[:1]
+        ) as context:
+            context.db.insert_daily_agg_df(
+                pd.DataFrame(
+                    {
+                        "kwh_FromGen": [1.0],
+                        "year": [first_day.year],
+                        "month": [first_day.month],
+                        "day": [first_day.day],
+                    }
+                )
+            )
+
+            ingestion_flow.catch_up(
+                systems=context.systems,
+                db_handler=context.db,
+                output_dir=f"{str(tmpdir)}/",
+            )
+
+            stored_days = context.db.get_daily_agg_days(first_day, today)
+
+        assert len(tmpdir.listdir("*_production.json")) == 3
+        assert stored_days == {first_day + dt.timedelta(days=i) for i in range(4)}
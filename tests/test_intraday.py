@@ -0,0 +1,98 @@
+import datetime as dt
+import json
+import sqlite3
+
+import pytest
+
+from test_infra.common_test_infra import day_chart
+
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.fronius_session import _FroniusSession
+from radiant_net_scraper.intraday import refresh_day, refresh_intraday
+
+SYSTEM = {"name": "default", "username": "a", "password": "a", "fronius-id": "1"}
+
+
+class TestRefreshIntraday:
+    def test_delta_and_finalise(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path
+    ):
+        """
+        Test that refreshes only insert new rows, and that the previous day gets
+        finalised once it is over.
+        """
+        n_points = {}
+        series_ids = {"production": "FromGen", "consumption": "ToConsumer"}
+
+        def get_chart(
+            self, date, chart_type, fronius_id=None, interval="day", raw=False
+        ):
+            chart = day_chart(date, n_points[date], series_ids[chart_type])
+
+            return json.dumps(chart).encode() if raw else chart
+
+        monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        day, next_day = dt.date(2024, 6, 1), dt.date(2024, 6, 2)
+
+        def refresh(today):
+            refresh_intraday(
+                output_dir=f"{str(tmp_path)}/",
+                systems=[SYSTEM],
+                today=today,
+                db_path=db_path,
+            )
+
+        def count(table, date):
+            return (
+                sqlite3.connect(db_path)
+                .execute(f"SELECT COUNT(1) FROM {table} WHERE day = ?", (date.day,))
+                .fetchone()[0]
+            )
+
+        n_points[day] = 3
+        refresh(day)
+        assert count("raw_data", day) == 3
+
+        n_points[day] = 5
+        refresh(day)
+        assert count("raw_data", day) == 5
+        assert count("daily_aggregated", day) == 0
+
+        n_points[day] = 288
+        n_points[next_day] = 2
+        refresh(next_day)
+        assert count("raw_data", day) == 288
+        assert count("daily_aggregated", day) == 1
+        assert count("raw_data", next_day) == 2
+
+    def test_failed_finalise_rolled_back(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path
+    ):
+        """
+        Test that a day failing to be finalised doesn't keep its last raw rows either,
+        so it is still found to need finalising.
+        """
+        series_ids = {"production": "FromGen", "consumption": "ToConsumer"}
+
+        def get_chart(
+            self, date, chart_type, fronius_id=None, interval="day", raw=False
+        ):
+            chart = day_chart(date, 288, series_ids[chart_type])
+
+            return json.dumps(chart).encode() if raw else chart
+
+        def failing_insert(*args, **kwargs):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        day = dt.date(2024, 6, 1)
+        monkeypatch.setattr(db, "insert_daily_agg_df", failing_insert)
+
+        with pytest.raises(sqlite3.OperationalError):
+            refresh_day(db, day, f"{str(tmp_path)}/", SYSTEM, finalise=True)
+
+        assert db.get_latest_raw_time(day, SYSTEM["name"]) is None
@@ -0,0 +1,140 @@
+import datetime as dt
+import json
+import threading
+
+from test_infra.common_test_infra import day_chart
+
+from radiant_net_scraper.context import AppContext
+from radiant_net_scraper.fronius_session import _FroniusSession
+from radiant_net_scraper.job_queue import JobQueue
+from radiant_net_scraper.worker import run_worker
+
+SYSTEM = {"name": "default", "username": "a", "password": "a", "fronius-id": "1"}
+SERIES_IDS = {"production": "FromGen", "consumption": "ToConsumer"}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def days(n_days: int) -> list[dt.date]:
+    return [dt.date(2024, 6, 1) + dt.timedelta(days=i) for i in range(n_days)]
+
+
+class TestJobQueue:
+    def test_claim_once(self, tmp_path):
+        """
+        Test that workers with their own connections never claim the same job.
+        """
+        path = f"{str(tmp_path)}/queue.sqlite3"
+        JobQueue(path).enqueue(days(40), "default")
+        claimed = []
+
+        def work(worker_id):
+            job_queue = JobQueue(path)
+
+            while (job := job_queue.claim(worker_id)) is not None:
+                claimed.append(job.date)
+                job_queue.complete(job, worker_id)
+
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        assert sorted(claimed) == days(40)
+        assert JobQueue(path).counts()["done"] == 40
+
+    def test_lease_expiry(self, tmp_path):
+        """
+        Test that jobs of workers no longer renewing their lease get claimed again.
+        """
+        clock = FakeClock()
+        job_queue = JobQueue(f"{str(tmp_path)}/queue.sqlite3", 60, clock=clock)
+        job_queue.enqueue(days(1), "default")
+
+        job = job_queue.claim("crashed")
+        assert job_queue.claim("other") is None
+
+        clock.now += 30
+        assert job_queue.heartbeat(job, "crashed")
+
+        clock.now += 61
+        taken_over = job_queue.claim("other")
+
+        assert taken_over.date == job.date
+        assert taken_over.attempts == 2
+        assert not job_queue.complete(job, "crashed")
+        assert job_queue.complete(taken_over, "other")
+
+    def test_attempts(self, tmp_path):
+        """
+        Test that failed jobs are retried up to `max_attempts` times, and can be
+        queued again afterwards.
+        """
+        job_queue = JobQueue(f"{str(tmp_path)}/queue.sqlite3", max_attempts=2)
+        job_queue.enqueue(days(1), "default")
+
+        for _ in range(2):
+            job_queue.fail(job_queue.claim("worker"), "worker", "Broken.")
+
+        assert job_queue.claim("worker") is None
+        assert job_queue.counts()["failed"] == 1
+
+        assert job_queue.enqueue(days(1), "default") == 1
+        assert job_queue.claim("worker").attempts == 1
+
+    def test_claim_systems(self, tmp_path):
+        """
+        Test that workers limited to some PV systems only claim the jobs of those.
+        """
+        job_queue = JobQueue(f"{str(tmp_path)}/queue.sqlite3")
+        job_queue.enqueue(days(1), "roof")
+        job_queue.enqueue(days(2), "barn")
+
+        claimed = []
+        while (job := job_queue.claim("worker", ["barn"])) is not None:
+            claimed.append(job.system_id)
+
+        assert claimed == ["barn", "barn"]
+        assert job_queue.claim("worker", []) is None
+        assert job_queue.claim("worker").system_id == "roof"
+
+
+class TestRunWorker:
+    def test_success(self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path):
+        """
+        Test that a worker ingests all queued days.
+        """
+
+        def get_chart(
+            self, date, chart_type, fronius_id=None, interval="day", raw=False
+        ):
+            chart = day_chart(date, 12, SERIES_IDS[chart_type])
+
+            return json.dumps(chart).encode() if raw else chart
+
+        monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+        job_queue = JobQueue(f"{str(tmp_path)}/queue.sqlite3")
+        job_queue.enqueue(days(3), "default")
+        job_queue.enqueue(days(1), "unknown")
+
+        with AppContext(
+            db_path=f"{str(tmp_path)}/db.sqlite3",
+            systems=[SYSTEM],
+            raw_data_dir=f"{str(tmp_path)}/",
+        ) as context:
+            assert run_worker(job_queue, context, worker_id="worker") == 3
+            assert context.db.get_daily_agg_days(
+                days(3)[0], days(3)[-1], "default"
+            ) == set(days(3))
+
+        assert job_queue.counts() == {"queued": 0, "running": 0, "done": 3, "failed": 1}
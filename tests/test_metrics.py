@@ -0,0 +1,110 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from test_infra.common_test_infra import json_test_file_groups
+
+from radiant_net_scraper import data_parser, metrics
+
+
+class TestRegistry:
+    def test_render(self):
+        """
+        Test that counters and histograms are rendered in the text exposition format.
+        """
+        registry = metrics.Registry()
+        counter = registry.counter("things_total", "Things.", ("kind",))
+        histogram = registry.histogram("took_seconds", "Took.", buckets=(1, 5))
+
+        counter.inc(kind='a"b')
+        counter.inc(2, kind='a"b')
+        histogram.observe(0.5)
+        histogram.observe(3)
+
+        assert registry.counter("things_total", "Things.", ("kind",)) is counter
+        assert registry.render().splitlines() == [
+            "# HELP things_total Things.",
+            "# TYPE things_total counter",
+            'things_total{kind="a\\"b"} 3',
+            "# HELP took_seconds Took.",
+            "# TYPE took_seconds histogram",
+            'took_seconds_bucket{le="1"} 1',
+            'took_seconds_bucket{le="5"} 2',
+            'took_seconds_bucket{le="+Inf"} 2',
+            "took_seconds_sum 3.5",
+            "took_seconds_count 2",
+        ]
+
+    def test_kind_mismatch(self):
+        registry = metrics.Registry()
+        registry.counter("things_total", "Things.")
+
+        with pytest.raises(ValueError):
+            registry.histogram("things_total", "Things.")
+
+
+class TestTimed:
+    def test_errors(self):
+        """
+        Test that calls get timed, and those failing counted.
+        """
+
+        @metrics.timed("test_errors")
+        def fail(should_fail: bool) -> None:
+            if should_fail:
+                raise RuntimeError()
+
+        fail(False)
+
+        with pytest.raises(RuntimeError):
+            fail(True)
+
+        assert metrics.STAGE_SECONDS.count(stage="test_errors") == 2
+        assert metrics.STAGE_ERRORS.value(stage="test_errors") == 1
+
+    def test_ingestion(self, tmp_path):
+        """
+        Test that parsing files into the DB is instrumented.
+        """
+        stages = ["load_daily_usage_json", "parse_usage_json", "agg_daily_df"]
+        counts = {stage: metrics.STAGE_SECONDS.count(stage=stage) for stage in stages}
+        n_bytes = metrics.STAGE_BYTES.value(stage="load_daily_usage_json")
+        n_rows = metrics.STAGE_ROWS.value(stage="insert_df")
+
+        data_parser.parse_json_data_from_file_pair_list(
+            json_test_file_groups(), db_path=f"{str(tmp_path)}/db.sqlite3"
+        )
+
+        for stage in stages:
+            assert metrics.STAGE_SECONDS.count(stage=stage) > counts[stage]
+
+        assert metrics.STAGE_BYTES.value(stage="load_daily_usage_json") > n_bytes
+        assert metrics.STAGE_ROWS.value(stage="insert_df") > n_rows
+
+
+class TestMetricsServer:
+    def test_serve(self):
+        """
+        Test that the metrics are served at /metrics, and nothing else is.
+        """
+        server = metrics.start_metrics_server("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        try:
+            with urllib.request.urlopen(url + "/metrics") as response:
+                content_type = response.headers["Content-Type"]
+                body = response.read().decode()
+
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + "/")
+
+            error.value.close()
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert content_type == metrics.CONTENT_TYPE
+        assert "# TYPE radiant_net_stage_duration_seconds histogram" in body
+        assert error.value.code == 404
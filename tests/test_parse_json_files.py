@@ -1,23 +1,31 @@
+import datetime as dt
+import json
 import os
 import pytest
+import sqlite3
 from pytest_cases import parametrize
 
 from test_infra.common_test_infra import check_db, json_test_file_groups
 
 from radiant_net_scraper import data_parser
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.types import ChartFileGroup
 
 
 class TestParseJsonDataFromFileList:
     @pytest.mark.filterwarnings("error")
+    @pytest.mark.usefixtures("test_data_timezone")
     def test_success(self, tmp_path):
         """
         General test, check if all test files get read without error.
         """
         path_str = str(tmp_path)
-        data_parser.parse_json_data_from_file_pair_list(
+        quarantined = data_parser.parse_json_data_from_file_pair_list(
             json_test_file_groups(), db_path=path_str + "/generation_and_usage.sqlite3"
         )
 
+        assert quarantined == []
+
         expected_db_path = f"{path_str}/generation_and_usage.sqlite3"
 
         check_db(expected_db_path)
@@ -33,12 +41,227 @@ class TestParseJsonDataFromFileList:
         Test each file individually, mainly if ingestion runs without issues.
         """
         path_str = str(tmp_path)
-        data_parser.parse_json_data_from_file_pair_list(
+        quarantined = data_parser.parse_json_data_from_file_pair_list(
             [group], db_path=path_str + "/generation_and_usage.sqlite3"
         )
 
+        assert quarantined == []
+
         expected_db_path = f"{path_str}/generation_and_usage.sqlite3"
 
         # Rows are already checked in the full ingest test, some test files don't
         # contain data, on those no rows is actually expected.
         check_db(expected_db_path, expect_rows=False)
+
+
+def month_chart(year: int, month: int, n_days: int, series_id: str) -> dict:
+    """
+    Construct a minimal month chart holding a total per day for a single series.
+    """
+    return {
+        "isPremiumFeature": False,
+        "settings": {
+            "series": [
+                {
+                    "id": series_id,
+                    "data": [
+                        [dt.datetime(year, month, day).timestamp() * 1e3, float(day)]
+                        for day in range(1, n_days + 1)
+                    ],
+                }
+            ]
+        },
+    }
+
+
+class TestParseCoarse:
+    def write_month_files(self, tmp_path) -> list[str]:
+        files = {
+            "production": month_chart(2024, 5, 31, "FromGen"),
+            "consumption": month_chart(2024, 5, 31, "ToConsumer"),
+        }
+
+        for chart_type, chart in files.items():
+            with open(tmp_path / f"202405_month_{chart_type}.json", "w") as outfile:
+                json.dump(chart, outfile)
+
+        return [
+            str(tmp_path / f"202405_month_{chart_type}.json") for chart_type in files
+        ]
+
+    def test_daily_totals(self, tmp_path):
+        """
+        Test that month charts end up as coarse daily aggregates, up to yesterday.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        infiles = self.write_month_files(tmp_path)
+
+        data_parser.parse_coarse_json_data_from_file_pair_list(
+            data_parser.get_chart_file_groups(infiles),
+            db_path=db_path,
+            today=dt.date(2024, 5, 20),
+        )
+
+        rows = (
+            sqlite3.connect(db_path)
+            .execute(
+                "SELECT day, kwh_FromGen, kwh_ToConsumer, source "
+                "FROM daily_aggregated ORDER BY day"
+            )
+            .fetchall()
+        )
+
+        assert len(rows) == 19
+        assert rows[4] == (5, 5.0, 5.0, "month")
+
+    def test_day_data_takes_precedence(self, tmp_path):
+        """
+        Test that rows from day charts replace coarse rows, but not the other way round.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        coarse_df = data_parser.process_coarse_usage_dict(
+            month_chart(2024, 5, 2, "FromGen")
+        )
+        day_df = coarse_df.iloc[:1].assign(kwh_FromGen=42.0).drop(columns="source")
+
+        db.upsert_coarse_daily_agg_df(coarse_df)
+        db.insert_daily_agg_df(day_df)
+        db.upsert_coarse_daily_agg_df(coarse_df)
+
+        rows = db.db_conn.execute(
+            "SELECT day, kwh_FromGen, source FROM daily_aggregated ORDER BY day"
+        )
+
+        assert [tuple(row) for row in rows] == [(1, 42.0, "day"), (2, 2.0, "month")]
+
+    def test_dir_input(self, tmp_path):
+        """
+        Test that coarse files in a dir are told apart from day files.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        self.write_month_files(tmp_path)
+
+        data_parser.parse_json_data(input_dir=str(tmp_path), db_path=db_path)
+
+        n_rows = (
+            sqlite3.connect(db_path)
+            .execute("SELECT COUNT(1) FROM daily_aggregated WHERE source = 'month'")
+            .fetchone()[0]
+        )
+
+        assert n_rows == 31
+
+    def test_year_files_skipped(self):
+        """
+        Test that year charts are neither taken for month nor for day charts.
+        """
+        day_files, coarse_files = data_parser.split_coarse_files(
+            [
+                "20240501_production.json",
+                "202405_month_production.json",
+                "2024_year_production.json",
+            ]
+        )
+
+        assert day_files == ["20240501_production.json"]
+        assert coarse_files == ["202405_month_production.json"]
+
+
+@pytest.mark.usefixtures("test_data_timezone")
+class TestJournal:
+    def journal(self, db_path: str) -> dict[str, tuple[str, str | None]]:
+        rows = sqlite3.connect(db_path).execute(
+            "SELECT path, state, error FROM ingest_journal"
+        )
+
+        return {os.path.basename(path): (state, error) for path, state, error in rows}
+
+    def test_quarantine(self, tmp_path):
+        """
+        Test that a broken group gets quarantined, while the others are ingested.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        broken_file = tmp_path / "20240101_production.json"
+        broken_file.write_text("{not json")
+        broken_group = ChartFileGroup(production=str(broken_file))
+
+        quarantined = data_parser.parse_json_data_from_file_pair_list(
+            [broken_group, *json_test_file_groups()], db_path=db_path
+        )
+
+        journal = self.journal(db_path)
+
+        assert quarantined == [broken_group]
+        assert journal.pop("20240101_production.json")[0] == "quarantined"
+        assert {state for state, _ in journal.values()} == {"committed"}
+        check_db(db_path)
+
+    def test_resume(self, monkeypatch, tmp_path):
+        """
+        Test that resuming after a crash while writing skips committed groups and
+        redoes the interrupted one, without running into duplicate rows.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        groups = json_test_file_groups()
+        save_usage_dataframe_dict = data_parser.save_usage_dataframe_dict
+        n_saved = []
+
+        def crashing_save(output_dfs, db_handler, system_id):
+            if len(n_saved) == 2:
+                db_handler.insert_raw_data_df(output_dfs.raw, system_id=system_id)
+                raise KeyboardInterrupt()
+
+            n_saved.append(output_dfs)
+            save_usage_dataframe_dict(output_dfs, db_handler, system_id=system_id)
+
+        monkeypatch.setattr(data_parser, "save_usage_dataframe_dict", crashing_save)
+
+        with pytest.raises(KeyboardInterrupt):
+            data_parser.parse_json_data_from_file_pair_list(groups, db_path=db_path)
+
+        assert "parsed" in {state for state, _ in self.journal(db_path).values()}
+
+        monkeypatch.setattr(
+            data_parser, "save_usage_dataframe_dict", save_usage_dataframe_dict
+        )
+        quarantined = data_parser.parse_json_data_from_file_pair_list(
+            groups, db_path=db_path, resume=True
+        )
+
+        clean_db_path = f"{str(tmp_path)}/clean.sqlite3"
+        data_parser.parse_json_data_from_file_pair_list(groups, db_path=clean_db_path)
+
+        def count_rows(path):
+            return sqlite3.connect(path).execute("SELECT COUNT(1) FROM raw_data")
+
+        assert quarantined == []
+        assert {state for state, _ in self.journal(db_path).values()} == {"committed"}
+        assert count_rows(db_path).fetchone() == count_rows(clean_db_path).fetchone()
+
+    def test_rollback(self, monkeypatch, tmp_path):
+        """
+        Test that a group failing to be written leaves none of its rows behind.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        group = json_test_file_groups()[0]
+
+        def failing_save(output_dfs, db_handler, system_id):
+            db_handler.insert_raw_data_df(output_dfs.raw, system_id=system_id)
+            raise ValueError("Disk full.")
+
+        monkeypatch.setattr(data_parser, "save_usage_dataframe_dict", failing_save)
+
+        quarantined = data_parser.parse_json_data_from_file_pair_list(
+            [group], db_path=db_path
+        )
+        n_rows = (
+            sqlite3.connect(db_path)
+            .execute("SELECT COUNT(1) FROM raw_data")
+            .fetchone()[0]
+        )
+
+        assert quarantined == [group]
+        assert self.journal(db_path)[os.path.basename(group.production)][0] == (
+            "quarantined"
+        )
+        assert n_rows == 0
@@ -0,0 +1,170 @@
+import datetime as dt
+import json
+import threading
+
+import pytest
+
+from test_infra.common_test_infra import day_chart
+
+from radiant_net_scraper import pipeline
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.fronius_session import _FroniusSession
+
+SYSTEM = {"name": "default", "username": "a", "password": "a", "fronius-id": "1"}
+SERIES_IDS = {"production": "FromGen", "consumption": "ToConsumer"}
+
+
+@pytest.fixture
+def dated_charts(arbitrary_file_dummy_fronius_session, monkeypatch) -> None:
+    """
+    Serve charts holding data of the date they were requested for.
+    """
+
+    def get_chart(self, date, chart_type, fronius_id=None, interval="day", raw=False):
+        chart = day_chart(date, 12, SERIES_IDS[chart_type])
+
+        return json.dumps(chart).encode() if raw else chart
+
+    monkeypatch.setattr(_FroniusSession, "get_chart", get_chart)
+
+
+class TestRunPipeline:
+    def test_success(self, dated_charts, tmp_path):
+        """
+        Test that all days end up in the DB, and that charts are saved for the record.
+        """
+        dates = [dt.date(2024, 6, 1) + dt.timedelta(days=i) for i in range(5)]
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+
+        stats = pipeline.run_pipeline(
+            dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM, max_workers=2
+        )
+
+        assert [stats[name].n_done for name in ("fetch", "parse", "write")] == [5] * 3
+        assert len(db.get_raw_data_df(dates[0], dates[-1])) == 5 * 12
+        assert db.get_daily_agg_days(dates[0], dates[-1], "default") == set(dates)
+        assert len(list(tmp_path.glob("*.json"))) == 10
+
+    def test_failed_day(self, dated_charts, monkeypatch, tmp_path):
+        """
+        Test that a day failing to parse is left out, without holding up the others.
+        """
+        dates = [dt.date(2024, 6, 1), dt.date(2024, 6, 2)]
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        parse_day_charts = pipeline.parse_day_charts
+
+        def failing_parse(contents):
+            if b"not json" in contents.values():
+                raise ValueError("Broken chart.")
+
+            return parse_day_charts(contents)
+
+        def scrape_daily_data(date, chart_type, system=None):
+            if date == dates[0]:
+                return b"not json"
+
+            return json.dumps(day_chart(date, 12, SERIES_IDS[chart_type])).encode()
+
+        monkeypatch.setattr(pipeline, "parse_day_charts", failing_parse)
+        monkeypatch.setattr(pipeline, "scrape_daily_data", scrape_daily_data)
+
+        stats = pipeline.run_pipeline(
+            dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM
+        )
+
+        assert stats["parse"].n_failed == 1
+        assert db.get_daily_agg_days(dates[0], dates[-1], "default") == {dates[1]}
+
+    def test_back_pressure(self, dated_charts, monkeypatch, tmp_path):
+        """
+        Test that fetchers stop once the queue to a stalled parser is full.
+        """
+        dates = [dt.date(2024, 6, 1) + dt.timedelta(days=i) for i in range(10)]
+        parser_released = threading.Event()
+        fetched = []
+        fetched_while_stalled = []
+
+        def stalled_parse(contents):
+            parser_released.wait(timeout=10)
+
+        def fetch(date, output_dir, system=None):
+            fetched.append(date)
+
+        def release_parser():
+            fetched_while_stalled.append(len(fetched))
+            parser_released.set()
+
+        monkeypatch.setattr(pipeline, "parse_day_charts", stalled_parse)
+        monkeypatch.setattr(pipeline, "fetch_day_charts", fetch)
+        threading.Timer(0.5, release_parser).start()
+
+        pipeline.run_pipeline(
+            dates,
+            Database(f"{str(tmp_path)}/db.sqlite3"),
+            output_dir=f"{str(tmp_path)}/",
+            system=SYSTEM,
+            max_workers=1,
+            parse_workers=1,
+            queue_size=2,
+        )
+
+        # One day being parsed, two queued, and one waiting to be queued.
+        assert fetched_while_stalled == [4]
+        assert len(fetched) == 10
+
+    def test_paywalled_day_kept(self, dated_charts, monkeypatch, tmp_path):
+        """
+        Test that the stored data of a day whose charts turn out paywalled is kept.
+        """
+        dates = [dt.date(2024, 6, 1)]
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        pipeline.run_pipeline(dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM)
+
+        monkeypatch.setattr(pipeline, "parse_day_charts", lambda contents: None)
+        pipeline.run_pipeline(dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM)
+
+        assert len(db.get_raw_data_df(dates[0], dates[0])) == 12
+        assert db.get_daily_agg_days(dates[0], dates[0], "default") == set(dates)
+
+    def test_failed_write_rolled_back(self, dated_charts, monkeypatch, tmp_path):
+        """
+        Test that a day failing to be written keeps its stored data, rather than
+        having it deleted without replacement.
+        """
+        dates = [dt.date(2024, 6, 1)]
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        pipeline.run_pipeline(dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM)
+
+        def failing_save(data, db_handler, system_id):
+            db_handler.insert_raw_data_df(data.raw, system_id=system_id)
+            raise ValueError("Disk full.")
+
+        monkeypatch.setattr(pipeline, "save_usage_dataframe_dict", failing_save)
+        stats = pipeline.run_pipeline(
+            dates, db, output_dir=f"{str(tmp_path)}/", system=SYSTEM
+        )
+
+        assert stats["write"].n_failed == 1
+        assert len(db.get_raw_data_df(dates[0], dates[0])) == 12
+        assert db.get_daily_agg_days(dates[0], dates[0], "default") == set(dates)
+
+
+class TestFetchDayCharts:
+    def test_concurrent(self, monkeypatch, tmp_path):
+        """
+        Test that the chart types of a day are retrieved at the same time.
+        """
+        # Only lets the charts through once all of them are requested at once.
+        barrier = threading.Barrier(len(SERIES_IDS), timeout=5)
+
+        def scrape_daily_data(date, chart_type, system=None):
+            barrier.wait()
+
+            return json.dumps(day_chart(date, 12, SERIES_IDS[chart_type])).encode()
+
+        monkeypatch.setattr(pipeline, "scrape_daily_data", scrape_daily_data)
+
+        contents = pipeline.fetch_day_charts(dt.date(2024, 6, 1), f"{str(tmp_path)}/")
+
+        assert sorted(contents) == sorted(SERIES_IDS)
+        assert len(list(tmp_path.glob("*.json"))) == len(SERIES_IDS)
@@ -0,0 +1,110 @@
+import datetime as dt
+import os
+
+import pandas as pd
+
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.planner import day_files_state, find_gaps, plan_days
+from radiant_net_scraper.scrape import CHART_TYPES, chart_file_path
+
+
+def write_day_files(
+    date: dt.date, output_dir: str, written_at: dt.datetime, chart_types=CHART_TYPES
+) -> None:
+    """
+    Create chart files of `date`, pretending they were written at `written_at`.
+    """
+    for chart_type in chart_types:
+        path = chart_file_path(date, output_dir, chart_type)
+
+        with open(path, "w", encoding="UTF-8") as outfile:
+            outfile.write("{}")
+
+        os.utime(path, (written_at.timestamp(), written_at.timestamp()))
+
+
+class TestDayFilesState:
+    def test_states(self, tmp_path):
+        """
+        Test that files are only complete if all of them were written after the day.
+        """
+        output_dir = f"{str(tmp_path)}/"
+        day = dt.date(2024, 5, 1)
+
+        assert day_files_state(day, output_dir) == "missing"
+
+        write_day_files(day, output_dir, dt.datetime(2024, 5, 1, 15))
+        assert day_files_state(day, output_dir) == "incomplete"
+
+        write_day_files(day, output_dir, dt.datetime(2024, 5, 2, 1))
+        assert day_files_state(day, output_dir) == "complete"
+
+        os.remove(chart_file_path(day, output_dir, "consumption"))
+        assert day_files_state(day, output_dir) == "incomplete"
+
+
+class TestPlanDays:
+    def test_plan(self, tmp_path):
+        """
+        Test that only missing and incomplete days get planned, and today always.
+        """
+        output_dir = f"{str(tmp_path)}/"
+        today = dt.date(2024, 5, 5)
+
+        # Complete on disk.
+        write_day_files(dt.date(2024, 5, 1), output_dir, dt.datetime(2024, 5, 2, 1))
+        # Scraped while it was still ongoing.
+        write_day_files(dt.date(2024, 5, 2), output_dir, dt.datetime(2024, 5, 2, 12))
+        write_day_files(today, output_dir, dt.datetime(2024, 5, 5, 12))
+
+        planned = plan_days(
+            dt.date(2024, 5, 1),
+            today,
+            output_dir,
+            # Stored in the DB, with the files cleaned up.
+            stored_days={dt.date(2024, 5, 3), dt.date(2024, 5, 2)},
+            today=today,
+        )
+
+        assert planned == [dt.date(2024, 5, 2), dt.date(2024, 5, 4), today]
+
+
+class TestFindGaps:
+    def store_days(self, db: Database, dates: list[dt.date]) -> None:
+        db.insert_daily_agg_df(
+            pd.DataFrame(
+                {
+                    "kwh_FromGen": [1.0] * len(dates),
+                    "year": [date.year for date in dates],
+                    "month": [date.month for date in dates],
+                    "day": [date.day for date in dates],
+                }
+            )
+        )
+
+    def test_gaps(self, tmp_path):
+        """
+        Test that days missing since the first stored one are found, up to yesterday.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+        today = dt.date(2024, 5, 10)
+        self.store_days(db, [dt.date(2024, 5, 2), dt.date(2024, 5, 5)])
+
+        assert find_gaps(db, today=today) == [
+            dt.date(2024, 5, 3),
+            dt.date(2024, 5, 4),
+            *[dt.date(2024, 5, day) for day in range(6, 10)],
+        ]
+        assert find_gaps(db, max_days=3, today=today) == [
+            dt.date(2024, 5, 7),
+            dt.date(2024, 5, 8),
+            dt.date(2024, 5, 9),
+        ]
+
+    def test_empty_db(self, tmp_path):
+        """
+        Test that a fresh DB only misses yesterday.
+        """
+        db = Database(f"{str(tmp_path)}/db.sqlite3")
+
+        assert find_gaps(db, today=dt.date(2024, 5, 10)) == [dt.date(2024, 5, 9)]
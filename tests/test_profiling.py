@@ -0,0 +1,88 @@
+import io
+import pstats
+import threading
+import tracemalloc
+
+import pytest
+
+from radiant_net_scraper import metrics, profiling
+
+
+def busy_stage_work() -> list[int]:
+    return [i * i for i in range(10000)]
+
+
+class TestFormatStageReport:
+    def test_deltas(self):
+        """
+        Test that only what the stages did in between gets reported.
+        """
+        before = {
+            "insert_df": {"calls": 1, "seconds": 1.0, "rows": 100},
+            "parse_usage_json": {"calls": 2, "seconds": 0.5},
+        }
+        after = {
+            "insert_df": {"calls": 3, "seconds": 2.5, "rows": 300, "errors": 1},
+            "parse_usage_json": {"calls": 2, "seconds": 0.5},
+            "load_daily_usage_json": {"calls": 4, "seconds": 0.25, "bytes": 2048},
+        }
+
+        assert profiling.format_stage_report(before, after, wall_seconds=2) == [
+            "  insert_df: 2 calls, 1.50s, 200 rows, 1 errors",
+            "  load_daily_usage_json: 4 calls, 0.25s, 2048 bytes",
+            "  100.0 rows/s inserted, 2.0 files/s loaded, 0.0 charts/s fetched",
+        ]
+
+
+class TestProfiled:
+    def test_off(self, tmp_path):
+        """
+        Test that nothing gets profiled or written without a mode.
+        """
+        stream = io.StringIO()
+
+        with profiling.profiled(None, "test", str(tmp_path / "profile"), stream):
+            busy_stage_work()
+
+        assert not (tmp_path / "profile").exists()
+        assert stream.getvalue() == ""
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            with profiling.profiled("disk", "test"):
+                pass
+
+    def test_cpu_threads(self, tmp_path):
+        """
+        Test that functions run by threads started while profiling get profiled too.
+        """
+        output_path = str(tmp_path / "profile.pstats")
+        stream = io.StringIO()
+
+        with profiling.profiled("cpu", "test", output_path, stream):
+            thread = threading.Thread(target=busy_stage_work)
+            thread.start()
+            thread.join()
+
+        functions = {function for _, _, function in pstats.Stats(output_path).stats}
+
+        assert "busy_stage_work" in functions
+        assert "of 2 threads" in stream.getvalue()
+
+    def test_memory_per_stage(self, tmp_path):
+        """
+        Test that the memory traced at the end of timed stages gets reported.
+        """
+        output_path = str(tmp_path / "profile.tracemalloc")
+        stream = io.StringIO()
+        stage = metrics.timed("test_profiling")(busy_stage_work)
+
+        with profiling.profiled("mem", "test", output_path, stream):
+            kept = stage()
+
+        assert not tracemalloc.is_tracing()
+        assert tracemalloc.Snapshot.load(output_path).traces
+        assert metrics.STAGE_TRACED_MEMORY.value(stage="test_profiling") > 0
+        assert "  test_profiling: " in stream.getvalue()
+        assert "  test_profiling: 1 calls, " in stream.getvalue()
+        assert len(kept) == 10000
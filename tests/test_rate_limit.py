@@ -0,0 +1,46 @@
+import pytest
+
+from radiant_net_scraper.rate_limit import TokenBucket
+
+
+class FakeClock:
+    """
+    Clock which only advances when slept on.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def test_burst(self):
+        """
+        Test that up to `capacity` tokens are available without waiting.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=3, clock=clock, sleep=clock.sleep)
+
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+        assert clock.now == 0
+
+    def test_rate(self):
+        """
+        Test that once the bucket is empty, tokens are handed out at `rate`.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=1, clock=clock, sleep=clock.sleep)
+
+        for _ in range(5):
+            bucket.acquire()
+
+        assert clock.now == pytest.approx(2)
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
@@ -0,0 +1,174 @@
+import pytest
+import requests as rq
+
+from radiant_net_scraper.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RequestStats,
+    RetryableStatusError,
+    RetryPolicy,
+    call_with_retries,
+)
+
+
+class FakeClock:
+    """
+    Clock which only advances when slept on.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def make_response(status_code: int) -> rq.Response:
+    """
+    Construct a response as returned by `requests` with the given status.
+    """
+    response = rq.Response()
+    response.status_code = status_code
+    response.url = "https://www.solarweb.com/"
+
+    return response
+
+
+def respond_with(*outcomes):
+    """
+    Make a request function which returns or raises `outcomes` one after another.
+    """
+    outcomes = list(outcomes)
+
+    def request():
+        outcome = outcomes.pop(0)
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return outcome
+
+    return request
+
+
+class TestCallWithRetries:
+    def test_recovers(self):
+        """
+        Test that transient failures get retried until a request succeeds.
+        """
+        clock = FakeClock()
+        stats = RequestStats()
+        response = make_response(200)
+
+        result = call_with_retries(
+            respond_with(rq.ReadTimeout(), rq.ConnectionError(), response),
+            RetryPolicy(max_retries=2),
+            stats=stats,
+            sleep=clock.sleep,
+        )
+
+        assert result is response
+        assert stats.snapshot() == {
+            "timeout": 1,
+            "connection_error": 1,
+            "retry": 2,
+            "success": 1,
+        }
+
+    def test_gives_up(self):
+        """
+        Test that the last failure gets raised once the retries are used up.
+        """
+        clock = FakeClock()
+        stats = RequestStats()
+
+        with pytest.raises(RetryableStatusError):
+            call_with_retries(
+                respond_with(*[make_response(503)] * 3),
+                RetryPolicy(max_retries=2, backoff_base=1, backoff_max=1.5),
+                stats=stats,
+                sleep=clock.sleep,
+            )
+
+        assert stats.snapshot() == {"server_error": 3, "retry": 2, "gave_up": 1}
+        assert clock.now <= 2.5
+
+    @pytest.mark.parametrize(
+        "outcome",
+        [make_response(404), ValueError("not a request problem")],
+        ids=["client_error", "other_error"],
+    )
+    def test_no_retry(self, outcome):
+        """
+        Test that anything but transient failures is passed through immediately.
+        """
+        calls = []
+
+        def request():
+            calls.append(1)
+            return respond_with(outcome)()
+
+        try:
+            call_with_retries(request, RetryPolicy(), sleep=pytest.fail)
+
+        except ValueError:
+            pass
+
+        assert len(calls) == 1
+
+
+class TestCircuitBreaker:
+    def test_open_and_recover(self):
+        """
+        Test that the circuit opens after too many failures, lets a single trial
+        through after the timeout, and closes again if it succeeds.
+        """
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60, clock=clock)
+        stats = RequestStats()
+
+        with pytest.raises(rq.ConnectionError):
+            call_with_retries(
+                respond_with(rq.ConnectionError(), rq.ConnectionError()),
+                RetryPolicy(max_retries=1, backoff_base=0),
+                breaker=breaker,
+                stats=stats,
+            )
+
+        assert breaker.state == "open"
+
+        with pytest.raises(CircuitOpenError):
+            call_with_retries(
+                respond_with(make_response(200)),
+                RetryPolicy(),
+                breaker=breaker,
+                stats=stats,
+            )
+
+        assert stats.snapshot()["circuit_open"] == 1
+
+        clock.sleep(60)
+        assert breaker.state == "half-open"
+
+        call_with_retries(
+            respond_with(make_response(200)), RetryPolicy(), breaker=breaker
+        )
+
+        assert breaker.state == "closed"
+
+    def test_failed_trial(self):
+        """
+        Test that a failing trial call opens the circuit again right away.
+        """
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60, clock=clock)
+
+        breaker.record_failure()
+        clock.sleep(60)
+        breaker.before_call()
+        breaker.record_failure()
+
+        assert breaker.state == "open"
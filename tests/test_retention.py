@@ -0,0 +1,165 @@
+import datetime as dt
+import os
+import sqlite3
+import stat
+
+from configparser import ConfigParser
+
+import pandas as pd
+import pytest
+
+from test_infra.common_test_infra import json_test_file_groups
+
+from radiant_net_scraper import data_parser, retention
+from radiant_net_scraper.config import Config
+from radiant_net_scraper.database import Database
+
+
+@pytest.fixture(params=[False, True], ids=["unsharded", "sharded"])
+def ingested_db(request, tmp_path) -> Database:
+    """
+    Provide a DB into which all the test files have been ingested.
+    """
+    db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+
+    data_parser.parse_json_data_from_file_pair_list(
+        json_test_file_groups(), db_path=db_path, shard_by_year=request.param
+    )
+
+    return Database(db_path, shard_by_year=request.param)
+
+
+class TestEnforceRetention:
+    def test_kwh_exact(self, ingested_db):
+        """
+        Test that all old raw data gets downsampled, keeping the kWh totals.
+        """
+        days = ingested_db.get_raw_days(before=dt.date.max)
+
+        done = retention.enforce_retention(
+            ingested_db, raw_max_age_days=0, batch_days=len(days)
+        )
+
+        assert done == days
+        assert ingested_db.get_raw_days(before=dt.date.max) == []
+
+        daily_df = pd.read_sql_query(
+            "SELECT * FROM daily_aggregated", ingested_db.db_conn
+        ).set_index(["year", "month", "day"])
+        hourly_df = (
+            pd.read_sql_query("SELECT * FROM hourly_aggregated", ingested_db.db_conn)
+            .groupby(["year", "month", "day"])
+            .sum(min_count=1)
+        )
+
+        kwh_cols = [col for col in daily_df.columns if col.startswith("kwh_")]
+
+        pd.testing.assert_frame_equal(
+            hourly_df.loc[daily_df.index, kwh_cols].astype(float),
+            daily_df[kwh_cols].astype(float),
+        )
+
+    def test_bounded_batch(self, ingested_db):
+        """
+        Test that a run only handles the oldest `batch_days` days, and that recent data
+        is left alone.
+        """
+        days = ingested_db.get_raw_days(before=dt.date.max)
+
+        done = retention.enforce_retention(
+            ingested_db,
+            raw_max_age_days=1,
+            batch_days=2,
+            today=days[-1] + dt.timedelta(days=1),
+        )
+
+        assert done == days[:2]
+        assert ingested_db.get_raw_days(before=dt.date.max) == days[2:]
+
+    def test_failed_delete_rolled_back(self, ingested_db, monkeypatch):
+        """
+        Test that a day whose raw rows fail to be deleted doesn't keep hourly buckets
+        next to them.
+        """
+        day = ingested_db.get_raw_days(before=dt.date.max)[0]
+
+        def failing_delete(*args, **kwargs):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(ingested_db, "delete_raw_data", failing_delete)
+
+        with pytest.raises(sqlite3.OperationalError):
+            retention.downsample_day(ingested_db, day)
+
+        n_hourly = ingested_db.db_conn.execute(
+            "SELECT COUNT(1) FROM hourly_aggregated"
+        ).fetchone()[0]
+
+        assert n_hourly == 0
+        assert ingested_db.get_raw_days(before=dt.date.max)[0] == day
+
+    def test_freeze_shards(self, monkeypatch, tmp_path):
+        """
+        Test that the configured retention freezes the shards of old years, and leaves
+        their raw data alone from then on.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+
+        data_parser.parse_json_data_from_file_pair_list(
+            json_test_file_groups(), db_path=db_path, shard_by_year=True
+        )
+
+        config = ConfigParser(allow_no_value=True)
+        config.read_dict(Config.get_config())
+        config["retention"]["raw_max_age_days"] = "0"
+        config["retention"]["freeze_shards_after_years"] = "1"
+        monkeypatch.setattr(Config, "_config_obj", config)
+
+        db = Database(db_path, shard_by_year=True)
+        days = db.get_raw_days(before=dt.date.max)
+
+        assert retention.run_retention(db) == []
+        assert not os.stat(db.get_shard_path(2008)).st_mode & stat.S_IWUSR
+        assert db.get_raw_days(before=dt.date.max) == []
+        assert len(db.get_raw_data_df(days[0], days[-1])) > 0
+
+    def test_incremental_vacuum(self, tmp_path):
+        """
+        Test that new DBs get created with incremental auto-vacuum.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        Database(db_path).close()
+
+        auto_vacuum = sqlite3.connect(db_path).execute("PRAGMA auto_vacuum").fetchone()
+
+        # 2 means incremental.
+        assert auto_vacuum[0] == 2
+
+    def test_convert_existing_db(self, tmp_path):
+        """
+        Test that DBs created without incremental auto-vacuum get converted on the
+        first run, so they shrink as their raw data gets downsampled.
+        """
+        db_path = f"{str(tmp_path)}/generation_and_usage.sqlite3"
+        data_parser.parse_json_data_from_file_pair_list(
+            json_test_file_groups(), db_path=db_path
+        )
+
+        db_conn = sqlite3.connect(db_path)
+        db_conn.execute("PRAGMA auto_vacuum = NONE")
+        db_conn.execute("VACUUM")
+        db_conn.close()
+
+        def pragma(name):
+            return sqlite3.connect(db_path).execute(f"PRAGMA {name}").fetchone()[0]
+
+        assert pragma("auto_vacuum") == 0
+
+        db = Database(db_path)
+        days = retention.enforce_retention(db, batch_days=100, vacuum_pages=None)
+        db.close()
+
+        assert len(days) > 0
+        assert pragma("auto_vacuum") == 2
+        # The pages freed by deleting the raw data were given back.
+        assert pragma("freelist_count") == 0
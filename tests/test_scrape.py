@@ -1,3 +1,5 @@
+import asyncio
+import datetime as dt
 import os
 import pytest
 
@@ -12,6 +14,26 @@ class TestRunScraper:
 
         assert all(os.path.exists(out_file) for out_file in astuple(output_file_group))
 
+    def test_failed_chart(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmpdir
+    ):
+        """
+        Test that no file gets written unless all charts of the day succeed.
+        """
+
+        def fail_consumption(date, chart_type, system=None):
+            if chart_type == "consumption":
+                raise ValueError("Solarweb is down.")
+
+            return "{}"
+
+        monkeypatch.setattr(scrape, "scrape_daily_data", fail_consumption)
+
+        with pytest.raises(ValueError):
+            scrape.run_scraper(output_dir=f"{str(tmpdir)}/")
+
+        assert os.listdir(tmpdir) == []
+
     @pytest.mark.requires_login
     def test_actual_retrieval(self, request, tmpdir):
         if "requires_login" not in request.config.getoption("-m", default=""):
@@ -23,3 +45,92 @@ class TestRunScraper:
         output_file_group = scrape.run_scraper(output_dir=f"{str(tmpdir)}/")
 
         assert all(os.path.exists(out_file) for out_file in astuple(output_file_group))
+
+
+class TestRunScraperRange:
+    def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        output_file_groups = scrape.run_scraper_range(
+            start=dt.date(2024, 2, 27),
+            end=dt.date(2024, 3, 1),
+            output_dir=f"{str(tmpdir)}/",
+            max_workers=3,
+        )
+
+        assert [os.path.basename(group.production) for group in output_file_groups] == [
+            "20240227_production.json",
+            "20240228_production.json",
+            "20240229_production.json",
+            "20240301_production.json",
+        ]
+        assert all(
+            os.path.exists(out_file)
+            for group in output_file_groups
+            for out_file in astuple(group)
+        )
+
+    def test_failed_day(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmpdir
+    ):
+        """
+        Test that days with failing charts are left out without writing any of their
+        charts, while the rest goes on.
+        """
+        scrape_daily_data = scrape.scrape_daily_data
+
+        def fail_on_first(date, chart_type, **kwargs):
+            if date == dt.date(2024, 1, 1) and chart_type == "consumption":
+                raise ValueError("Solarweb is down.")
+
+            return scrape_daily_data(date, chart_type, **kwargs)
+
+        monkeypatch.setattr(scrape, "scrape_daily_data", fail_on_first)
+
+        output_file_groups = scrape.run_scraper_range(
+            start=dt.date(2024, 1, 1),
+            end=dt.date(2024, 1, 2),
+            output_dir=f"{str(tmpdir)}/",
+        )
+
+        assert len(output_file_groups) == 1
+        assert sorted(path.basename for path in tmpdir.listdir("*.json")) == [
+            "20240102_consumption.json",
+            "20240102_production.json",
+        ]
+
+
+class TestRunCoarseScraperRange:
+    def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        """
+        Test that a range is covered by one group of month charts per month.
+        """
+        output_file_groups = scrape.run_coarse_scraper_range(
+            start=dt.date(2024, 1, 15),
+            end=dt.date(2024, 3, 1),
+            output_dir=f"{str(tmpdir)}/",
+        )
+
+        assert [os.path.basename(group.production) for group in output_file_groups] == [
+            "202401_month_production.json",
+            "202402_month_production.json",
+            "202403_month_production.json",
+        ]
+        assert len(tmpdir.listdir("*.json")) == 6
+
+
+class TestAsyncRunScraperRange:
+    def test_success(self, arbitrary_file_dummy_fronius_session, tmpdir):
+        output_file_groups = asyncio.run(
+            scrape.async_run_scraper_range(
+                start=dt.date(2024, 1, 1),
+                end=dt.date(2024, 1, 10),
+                output_dir=f"{str(tmpdir)}/",
+                max_concurrency=4,
+            )
+        )
+
+        assert len(output_file_groups) == 10
+        assert all(
+            os.path.exists(out_file)
+            for group in output_file_groups
+            for out_file in astuple(group)
+        )
@@ -1,8 +1,48 @@
+import json
+import sqlite3
+import subprocess
 import sys
 
+import pytest
+
 from test_infra.common_test_infra import check_db, json_test_file_dir, json_test_files
 
+from radiant_net_scraper import context, data_parser, scripts, worker
+from radiant_net_scraper.job_queue import JobQueue
+
+# Modules none of the commands need just to get going.
+HEAVY_MODULES = ["apscheduler", "bs4", "lxml", "numpy", "pandas", "requests"]
+
+# Seconds a command may take to import and print its help. Importing pandas alone
+# takes longer than that.
+STARTUP_BUDGET = 0.3
+
+STARTUP_SCRIPT = """
+import json, sys, time
+
+started = time.perf_counter()
+
 from radiant_net_scraper import scripts
+from radiant_net_scraper.config import Config
+
+sys.argv = ["TESTING", *sys.argv[1:]]
+
+try:
+    scripts.{command}()
+
+except SystemExit:
+    pass
+
+print(
+    json.dumps(
+        {{
+            "seconds": time.perf_counter() - started,
+            "modules": [name for name in {heavy_modules!r} if name in sys.modules],
+            "config_read": Config._config_obj is not None,
+        }}
+    )
+)
+"""
 
 
 class TestShowAppPaths:
@@ -16,6 +56,59 @@ class TestShowAppPaths:
         scripts.show_app_paths()
 
 
+class TestScrape:
+    def test_range(self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path):
+        """
+        Test that a range of days can be scraped.
+        """
+        args = [
+            "TESTING",
+            "--output-dir",
+            f"{str(tmp_path)}/",
+            "--from",
+            "2024-01-01",
+            "--to",
+            "2024-01-03",
+        ]
+
+        monkeypatch.setattr(sys, "argv", args)
+
+        scripts.scrape()
+
+        assert len(list(tmp_path.glob("*.json"))) == 6
+
+    def test_ingest_async(
+        self, arbitrary_file_dummy_fronius_session, monkeypatch, tmp_path
+    ):
+        """
+        Test that a range of days can be scraped and ingested on the async client.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        args = [
+            "TESTING",
+            "--output-dir",
+            f"{str(tmp_path)}/",
+            "--from",
+            "2024-01-01",
+            "--to",
+            "2024-01-01",
+            "--ingest-async",
+        ]
+
+        monkeypatch.setattr(sys, "argv", args)
+        monkeypatch.setattr(data_parser, "get_chosen_data_path", lambda: db_path)
+
+        scripts.scrape()
+
+        assert len(list(tmp_path.glob("*.json"))) == 2
+        assert (
+            sqlite3.connect(db_path)
+            .execute("SELECT COUNT(1) FROM raw_data")
+            .fetchone()[0]
+            > 0
+        )
+
+
 class TestParseJsonFiles:
     def test_dir_input(self, monkeypatch, tmp_path):
         """
@@ -49,3 +142,136 @@ class TestParseJsonFiles:
         scripts.parse_json_files()
 
         check_db(db_path)
+
+    @pytest.mark.parametrize(
+        "mode, summary", [("cpu", "top functions"), ("mem", "peak traced memory")]
+    )
+    def test_profile(self, mode, summary, capsys, monkeypatch, tmp_path):
+        """
+        Test that the ingestion can be profiled, writing the profile to a file and
+        summarizing it along with the stages on stderr.
+        """
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        profile_path = tmp_path / f"profile.{mode}"
+        args = [
+            "TESTING",
+            "--input-dir",
+            json_test_file_dir(),
+            "--output-db",
+            db_path,
+            f"--profile={mode}",
+            "--profile-output",
+            str(profile_path),
+        ]
+
+        monkeypatch.setattr(sys, "argv", args)
+
+        scripts.parse_json_files()
+
+        check_db(db_path)
+        assert profile_path.stat().st_size > 0
+
+        stderr = capsys.readouterr().err
+        assert summary in stderr
+        assert "  insert_df: " in stderr
+        assert "rows/s inserted" in stderr
+
+
+def run_startup(command: str, *args: str) -> dict:
+    """
+    Run a command in a fresh interpreter, and report how long it took, which heavy
+    modules it imported, and whether it read the config.
+    """
+    script = STARTUP_SCRIPT.format(command=command, heavy_modules=HEAVY_MODULES)
+    process = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+class TestWork:
+    def test_systems(self, monkeypatch, tmp_path):
+        """
+        Test that only the PV systems given by `--system` are logged into and worked
+        on.
+        """
+        queue_path = f"{str(tmp_path)}/queue.sqlite3"
+        used = {}
+
+        class DummyContext:
+            def __init__(self, systems):
+                used["systems"] = systems
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def warm_up(self):
+                pass
+
+        def run_worker(job_queue, app_context, system_ids=None):
+            used["system_ids"] = system_ids
+
+        args = [
+            "TESTING",
+            "--queue",
+            queue_path,
+            "--from",
+            "2024-01-01",
+            "--to",
+            "2024-01-02",
+            "--system",
+            "barn",
+        ]
+
+        monkeypatch.setattr(sys, "argv", args)
+        monkeypatch.setattr(
+            scripts, "get_fronius_systems", lambda: [{"name": "roof"}, {"name": "barn"}]
+        )
+        monkeypatch.setattr(context, "AppContext", DummyContext)
+        monkeypatch.setattr(worker, "run_worker", run_worker)
+
+        scripts.work()
+
+        assert used == {"systems": [{"name": "barn"}], "system_ids": ["barn"]}
+        assert JobQueue(queue_path).counts()["queued"] == 2
+
+
+class TestStartup:
+    @pytest.mark.parametrize(
+        "command",
+        [
+            "show_app_paths",
+            "scrape",
+            "parse_json_files",
+            "backup",
+            "archive_raw_data",
+            "work",
+            "run",
+        ],
+    )
+    def test_help(self, command):
+        """
+        Test that getting the help of a command neither imports heavy modules, nor
+        takes long.
+        """
+        startup = run_startup(command, "--help")
+
+        assert startup["modules"] == []
+        assert startup["seconds"] < STARTUP_BUDGET
+
+    def test_paths(self):
+        """
+        Test that showing the paths doesn't even need to read the config.
+        """
+        startup = run_startup("show_app_paths")
+
+        assert startup["modules"] == []
+        assert not startup["config_read"]
+        assert startup["seconds"] < STARTUP_BUDGET
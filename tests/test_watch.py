@@ -0,0 +1,144 @@
+import datetime as dt
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+from test_infra.common_test_infra import day_chart
+
+from radiant_net_scraper import watch
+from radiant_net_scraper.database import Database
+from radiant_net_scraper.files import write_files_atomically
+from radiant_net_scraper.scrape import CHART_TYPES, chart_file_path
+
+SERIES_IDS = {"production": "FromGen", "consumption": "ToConsumer"}
+
+
+def write_day(output_dir: str, date: dt.date, n_points: int, chart_types=CHART_TYPES):
+    """
+    Atomically write the charts of `date` holding `n_points` values to `output_dir`.
+    """
+    write_files_atomically(
+        {
+            chart_file_path(date, output_dir, chart_type): json.dumps(
+                day_chart(date, n_points, SERIES_IDS[chart_type])
+            )
+            for chart_type in chart_types
+        }
+    )
+
+
+def wait_for(condition, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(0.05)
+
+    return False
+
+
+class TestGroupCollector:
+    def test_complete_group(self, tmp_path):
+        """
+        Test that a complete group is released once it settled.
+        """
+        output_dir = f"{str(tmp_path)}/"
+        date = dt.date(2024, 1, 1)
+        write_day(output_dir, date, 1)
+        paths = {chart_file_path(date, output_dir, chart) for chart in CHART_TYPES}
+
+        collector = watch.GroupCollector(settle_seconds=1, debounce_seconds=30)
+        collector.add(paths, now=0)
+
+        assert collector.ready(now=0.5) == []
+        assert collector.ready(now=1) == sorted(paths)
+        assert len(collector) == 0
+
+    def test_partial_group(self, tmp_path):
+        """
+        Test that a group missing a chart is held back until debounced, and that a
+        chart stored before completes it.
+        """
+        output_dir = f"{str(tmp_path)}/"
+        date = dt.date(2024, 1, 1)
+        write_day(output_dir, date, 1, chart_types=["production"])
+        production = chart_file_path(date, output_dir, "production")
+        consumption = chart_file_path(date, output_dir, "consumption")
+
+        collector = watch.GroupCollector(settle_seconds=1, debounce_seconds=30)
+        collector.add({production}, now=0)
+
+        assert collector.ready(now=10) == []
+        assert collector.ready(now=30) == [production]
+
+        write_day(output_dir, date, 1, chart_types=["consumption"])
+        collector.add({consumption}, now=40)
+
+        assert collector.ready(now=41) == [consumption, production]
+
+
+class TestWatchDir:
+    @pytest.fixture(params=["inotify", "polling"])
+    def watcher_kind(self, request, monkeypatch) -> str:
+        if request.param == "inotify" and not sys.platform.startswith("linux"):
+            pytest.skip("inotify is only available on Linux.")
+
+        if request.param == "polling":
+            monkeypatch.setattr(
+                watch,
+                "make_watcher",
+                lambda dir_path, poll_interval: watch.PollingWatcher(
+                    dir_path, interval=poll_interval
+                ),
+            )
+
+        return request.param
+
+    def test_ingest(self, watcher_kind, tmp_path):
+        """
+        Test that days in the dir are ingested on start, new ones as soon as they are
+        written, and rewritten ones replace their stored data.
+        """
+        output_dir = f"{str(tmp_path)}/raw"
+        db_path = f"{str(tmp_path)}/db.sqlite3"
+        (tmp_path / "raw").mkdir()
+        write_day(f"{output_dir}/", dt.date(2024, 1, 1), 12)
+
+        db_handler = Database(db_path=db_path)
+        stop = threading.Event()
+        watcher = threading.Thread(
+            target=watch.watch_dir,
+            kwargs=dict(
+                input_dir=output_dir,
+                db_handler=db_handler,
+                debounce_seconds=5,
+                poll_interval=0.1,
+                settle_seconds=0.2,
+                stop=stop,
+            ),
+        )
+        watcher.start()
+
+        def count_rows() -> int:
+            with sqlite3.connect(db_path) as conn:
+                return conn.execute("SELECT COUNT(1) FROM raw_data").fetchone()[0]
+
+        try:
+            assert wait_for(lambda: count_rows() == 12)
+
+            write_day(f"{output_dir}/", dt.date(2024, 1, 2), 24)
+            assert wait_for(lambda: count_rows() == 36)
+
+            write_day(f"{output_dir}/", dt.date(2024, 1, 2), 6)
+            assert wait_for(lambda: count_rows() == 18)
+
+        finally:
+            stop.set()
+            watcher.join()
+            db_handler.close()